@@ -6,8 +6,11 @@
 #   POST /predict/failure - Predict equipment failure probability
 #   POST /predict/maintenance - Predict optimal maintenance schedule
 #   POST /analyze/patterns - Analyze usage patterns
-#   POST /train - Retrain models with new data
-#   POST /feedback - Submit prediction feedback for learning
+#   POST /train - Retrain models with new data (background job)
+#   GET  /train/{job_id} - Training job status
+#   GET  /models - Model registry versions (manifests)
+#   POST /models/rollback - Make a previous model version current
+#   POST /feedback - Submit prediction feedback for learning (feeds the online model)
 #
 # Launch:
 #   uvicorn ml_service:app --host 0.0.0.0 --port 8089
@@ -16,10 +19,17 @@
 
 import os
 import json
+import time
 import pickle
+import uuid
+import shutil
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, NamedTuple
 from pathlib import Path
 
 from fastapi import FastAPI, HTTPException
@@ -29,17 +39,26 @@ from pydantic import BaseModel, Field
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
-# ML imports
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingRegressor
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, mean_squared_error
+# ML imports (scikit-learn itself is imported on first training / model load)
 import joblib
 
 # Config
 PG_URL = os.getenv("NEON_DATABASE_URL") or os.getenv("DATABASE_URL")
-MODEL_DIR = Path(os.getenv("ML_MODEL_DIR", "/tmp/electrohub_models"))
-MODEL_DIR.mkdir(parents=True, exist_ok=True)
+MODEL_DIR = Path(os.getenv("ML_MODEL_DIR", "/tmp/electrohub_models"))  # legacy flat files, imported once
+REGISTRY_DIR = Path(os.getenv("ML_REGISTRY_DIR", "/var/lib/electrohub/model_registry"))  # keep on a persistent volume
+REGISTRY_KEEP = int(os.getenv("ML_REGISTRY_KEEP", "10"))          # versions kept (current never pruned)
+REGISTRY_POLL_S = float(os.getenv("ML_REGISTRY_POLL_S", "5"))     # how often workers look for a new CURRENT
+ONLINE_BATCH = int(os.getenv("ML_ONLINE_BATCH", "32"))            # examples per partial_fit
+ONLINE_WINDOW = int(os.getenv("ML_ONLINE_WINDOW", "500"))         # rolling accuracy window (examples)
+ONLINE_MIN_SAMPLES = int(os.getenv("ML_ONLINE_MIN_SAMPLES", "200"))  # shadow mode below this
+ONLINE_PROMOTE_MARGIN = float(os.getenv("ML_ONLINE_PROMOTE_MARGIN", "0.05"))
+ONLINE_MEMORY = int(os.getenv("ML_ONLINE_MEMORY", "10000"))       # recent predictions kept for feedback
+ONLINE_CONTROLS_S = float(os.getenv("ML_ONLINE_CONTROLS_S", "0"))  # poll new control outcomes (0 = off)
+TRAIN_ITERSIZE = int(os.getenv("ML_TRAIN_ITERSIZE", "20000"))  # rows per server-side cursor fetch
+PATTERN_TTL_S = float(os.getenv("ML_PATTERN_TTL_S", "600"))     # /analyze/patterns cache per site (0 = off)
+PATTERN_CACHE_MAX = int(os.getenv("ML_PATTERN_CACHE_MAX", "64"))  # sites kept (LRU)
+TRAIN_WORKERS = int(os.getenv("ML_TRAIN_WORKERS", "1"))          # training processes
+TRAIN_JOBS_KEEP = int(os.getenv("ML_TRAIN_JOBS_KEEP", "50"))     # finished jobs kept for /train/{job_id}
 
 # ============================================================
 # Database helpers
@@ -67,53 +86,253 @@ def db_execute(sql: str, params=()):
     finally:
         conn.close()
 
+def db_stream(sql: str, params=(), itersize: int = TRAIN_ITERSIZE):
+    """Yield row batches (plain tuples) through a server-side cursor; nothing is buffered client-side"""
+    if not PG_URL:
+        return
+    conn = psycopg2.connect(PG_URL)
+    try:
+        with conn:  # named cursors live inside a transaction
+            with conn.cursor(name="ml_stream") as cur:
+                cur.itersize = itersize
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows:
+                        break
+                    yield rows
+    finally:
+        conn.close()
+
 # ============================================================
 # ML Models Manager
 # ============================================================
-class MLModelsManager:
-    def __init__(self):
-        self.failure_model = None
-        self.maintenance_model = None
-        self.scaler = StandardScaler()
-        self.label_encoders = {}
-        self.model_version = "1.0.0"
-        self.last_trained = None
-        self._load_models()
+FEATURES = ["days_since_control", "nc_count", "total_controls", "nc_rate",
+            "age_days", "criticality_score", "zone_score", "type_score"]
+
+class ModelBundle(NamedTuple):
+    """Everything a prediction needs, published as one immutable unit: readers take
+    `models.bundle` once per call and never see a model paired with another run's scaler."""
+    failure_model: Any = None
+    maintenance_model: Any = None
+    scaler: Any = None
+    model_version: str = "1.0.0"
+    trained_at: Optional[datetime] = None
+    metrics: Dict[str, Any] = {}
+    data_window: Dict[str, Any] = {}
 
-    def _load_models(self):
-        """Load pre-trained models if available"""
+# ============================================================
+# Model registry
+# ============================================================
+class ModelRegistry:
+    """Versioned bundles on disk: <root>/versions/vNNNN/{*.joblib, manifest.json} and a
+    CURRENT file naming the live one. Versions are written to a temp dir and renamed into
+    place, CURRENT is replaced atomically; nothing is ever overwritten in place. Parts are
+    loaded with mmap_mode='r': plain numpy arrays (scaler statistics) map the same pages in
+    every worker, but sklearn trees copy their node arrays on unpickling and stay per-process."""
+    PARTS = ("failure_model", "maintenance_model", "scaler")
+
+    def __init__(self, root: Path, keep: int = REGISTRY_KEEP):
+        self.root = root
+        self.versions_dir = root / "versions"
+        self.keep = keep
+        self.versions_dir.mkdir(parents=True, exist_ok=True)
+
+    def current(self) -> Optional[str]:
         try:
-            failure_path = MODEL_DIR / "failure_model.joblib"
-            maintenance_path = MODEL_DIR / "maintenance_model.joblib"
-            scaler_path = MODEL_DIR / "scaler.joblib"
-
-            if failure_path.exists():
-                self.failure_model = joblib.load(failure_path)
-                print("[ML] Loaded failure prediction model")
-
-            if maintenance_path.exists():
-                self.maintenance_model = joblib.load(maintenance_path)
-                print("[ML] Loaded maintenance prediction model")
-
-            if scaler_path.exists():
-                self.scaler = joblib.load(scaler_path)
-                print("[ML] Loaded scaler")
-
-        except Exception as e:
-            print(f"[ML] Model load warning: {e}")
-
-    def _save_models(self):
-        """Save trained models"""
+            v = (self.root / "CURRENT").read_text().strip()
+            return v if (self.versions_dir / v).is_dir() else None
+        except FileNotFoundError:
+            return None
+
+    def _set_current(self, version: str):
+        tmp = self.root / f".CURRENT.{uuid.uuid4().hex[:8]}"
+        tmp.write_text(version)
+        os.replace(tmp, self.root / "CURRENT")
+
+    def list_versions(self) -> List[str]:
+        return sorted(p.name for p in self.versions_dir.iterdir() if p.is_dir() and p.name.startswith("v"))
+
+    def manifest(self, version: str) -> Dict[str, Any]:
+        with open(self.versions_dir / version / "manifest.json") as f:
+            return json.load(f)
+
+    def publish(self, bundle: ModelBundle, note: Optional[str] = None) -> str:
+        """Write a new version and make it current; returns its name"""
+        tmp = self.versions_dir / f".tmp-{uuid.uuid4().hex[:8]}"
+        tmp.mkdir()
+        try:
+            files = {}
+            for name in self.PARTS:
+                obj = getattr(bundle, name)
+                if obj is not None:
+                    joblib.dump(obj, tmp / f"{name}.joblib")  # uncompressed: required for mmap
+                    files[name] = f"{name}.joblib"
+            manifest = {
+                "created_at": datetime.now().isoformat(),
+                "trained_at": bundle.trained_at.isoformat() if bundle.trained_at else None,
+                "features": FEATURES,
+                "metrics": bundle.metrics,
+                "data_window": bundle.data_window,
+                "files": files,
+                "sklearn_version": _sklearn_version(),
+                "note": note,
+            }
+            while True:  # several workers may publish at once: first rename wins the number
+                existing = self.list_versions()
+                version = f"v{int(existing[-1][1:]) + 1 if existing else 1:04d}"
+                manifest["version"] = version
+                with open(tmp / "manifest.json", "w") as f:
+                    json.dump(manifest, f, indent=2)
+                try:
+                    os.rename(tmp, self.versions_dir / version)
+                    break
+                except OSError:
+                    if not (self.versions_dir / version).exists():
+                        raise
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self._set_current(version)
+        self._prune()
+        print(f"[ML] Published model bundle {version}")
+        return version
+
+    def load(self, version: str) -> ModelBundle:
+        d = self.versions_dir / version
+        m = self.manifest(version)
+        parts = {name: joblib.load(d / fn, mmap_mode="r") for name, fn in m.get("files", {}).items()}
+        print(f"[ML] Loaded model bundle {version} ({', '.join(parts) or 'empty'})")
+        return ModelBundle(model_version=version,
+                           trained_at=datetime.fromisoformat(m["trained_at"]) if m.get("trained_at") else None,
+                           metrics=m.get("metrics") or {}, data_window=m.get("data_window") or {}, **parts)
+
+    def rollback(self, version: Optional[str] = None) -> str:
+        """Make `version` (default: the one before the current) current again"""
+        versions = self.list_versions()
+        if version is None:
+            cur = self.current()
+            older = [v for v in versions if cur is None or v < cur]
+            if not older:
+                raise ValueError("no previous version")
+            version = older[-1]
+        if version not in versions:
+            raise ValueError(f"unknown version {version}")
+        self._set_current(version)
+        return version
+
+    def _prune(self):
+        cur = self.current()
+        old = [v for v in self.list_versions() if v != cur]
+        for v in old[:max(0, len(old) - (self.keep - 1))]:
+            shutil.rmtree(self.versions_dir / v, ignore_errors=True)
+
+    def import_legacy(self, legacy_dir: Path):
+        """First start on a registry: adopt flat *.joblib files from the old MODEL_DIR"""
+        if self.list_versions() or not (legacy_dir / "failure_model.joblib").exists():
+            return
         try:
-            if self.failure_model:
-                joblib.dump(self.failure_model, MODEL_DIR / "failure_model.joblib")
-            if self.maintenance_model:
-                joblib.dump(self.maintenance_model, MODEL_DIR / "maintenance_model.joblib")
-            joblib.dump(self.scaler, MODEL_DIR / "scaler.joblib")
-            self.last_trained = datetime.now()
-            print("[ML] Models saved successfully")
+            parts = {n: joblib.load(legacy_dir / f"{n}.joblib") for n in self.PARTS
+                     if (legacy_dir / f"{n}.joblib").exists()}
+            self.publish(ModelBundle(**parts), note=f"imported from {legacy_dir}")
         except Exception as e:
-            print(f"[ML] Model save error: {e}")
+            print(f"[ML] Legacy model import warning: {e}")
+
+def _sklearn_version() -> Optional[str]:
+    try:
+        import sklearn
+        return sklearn.__version__
+    except Exception:
+        return None
+
+class MLModelsManager:
+    def __init__(self, registry: ModelRegistry):
+        self.registry = registry
+        self._bundle: Optional[ModelBundle] = None  # loaded on first use
+        self._checked = 0.0
+        self._load_lock = threading.Lock()
+        self.label_encoders = {}
+        self.online = OnlineLearner(registry.root / "online.joblib")
+        self._recent = OrderedDict()  # equipment_id -> (features, served probability), for /feedback
+        self._recent_lock = threading.Lock()
+        self._pattern_cache = OrderedDict()  # site -> (expires_at, watermark, result), LRU
+        self._pattern_lock = threading.Lock()
+
+    @property
+    def bundle(self) -> ModelBundle:
+        """Current bundle; loaded lazily, re-checked against CURRENT every REGISTRY_POLL_S
+        so a version published or rolled back by another worker is picked up"""
+        b = self._bundle
+        if b is None or time.time() - self._checked > REGISTRY_POLL_S:
+            b = self._refresh()
+        return b
+
+    # read-only views of the current bundle
+    failure_model = property(lambda self: self.bundle.failure_model)
+    maintenance_model = property(lambda self: self.bundle.maintenance_model)
+    scaler = property(lambda self: self.bundle.scaler)
+    model_version = property(lambda self: self.bundle.model_version)
+    last_trained = property(lambda self: self.bundle.trained_at)
+
+    def _refresh(self) -> ModelBundle:
+        with self._load_lock:
+            b = self._bundle
+            if b is not None and time.time() - self._checked <= REGISTRY_POLL_S:
+                return b
+            try:
+                if b is None:
+                    self.registry.import_legacy(MODEL_DIR)
+                version = self.registry.current()
+                if b is None or (version is not None and version != b.model_version):
+                    b = self.registry.load(version) if version else ModelBundle()
+            except Exception as e:
+                print(f"[ML] Model load warning: {e}")
+                b = b or ModelBundle()
+            self._bundle, self._checked = b, time.time()
+            return b
+
+    def publish(self, bundle: ModelBundle) -> str:
+        """Register a freshly trained bundle, then swap it in with one reference assignment"""
+        version = self.registry.publish(bundle)
+        with self._load_lock:
+            self._bundle, self._checked = self.registry.load(version), time.time()
+        return version
+
+    def rollback(self, version: Optional[str] = None) -> str:
+        version = self.registry.rollback(version)
+        with self._load_lock:
+            self._bundle, self._checked = self.registry.load(version), time.time()
+        return version
+
+    def _remember(self, equipment_id: Optional[str], x: np.ndarray, prob: float):
+        if not equipment_id:
+            return
+        with self._recent_lock:
+            self._recent[equipment_id] = (np.asarray(x, dtype=float).ravel(), float(prob))
+            self._recent.move_to_end(equipment_id)
+            while len(self._recent) > ONLINE_MEMORY:
+                self._recent.popitem(last=False)
+
+    def recall(self, equipment_id: str):
+        """(features, served probability) of the last prediction for an equipment, if still kept"""
+        with self._recent_lock:
+            return self._recent.get(equipment_id)
+
+    def served_probabilities(self, X: np.ndarray) -> np.ndarray:
+        """Failure probabilities of the current bundle (forest or heuristic), before online blending"""
+        b = self.bundle
+        if b.failure_model is not None:
+            proba = b.failure_model.predict_proba(self._scaled(b, X))
+            return proba[:, 1] if proba.shape[1] > 1 else proba[:, 0]
+        # only atex/vsd change the heuristic and their type scores are unique
+        types = np.where(X[:, 7] == self.TYPE_SCORE['atex'], 'atex',
+                         np.where(X[:, 7] == self.TYPE_SCORE['vsd'], 'vsd', ''))
+        return self._heuristic_failure_batch(X, types.tolist())
+
+    @staticmethod
+    def _scaled(bundle: ModelBundle, X: np.ndarray) -> np.ndarray:
+        """Features as the bundle's model was trained on them (scaler fitted in the same run)"""
+        return bundle.scaler.transform(X) if hasattr(bundle.scaler, "mean_") else X
 
     def prepare_features(self, equipment_data: Dict) -> np.ndarray:
         """Prepare feature vector from equipment data"""
@@ -139,18 +358,87 @@ class MLModelsManager:
 
         return np.array(features).reshape(1, -1)
 
-    def predict_failure(self, equipment_data: Dict) -> Dict:
+    ZONE_SCORE = {'zone0': 1.0, 'zone1': 0.8, 'zone2': 0.6, 'zone21': 0.7, 'zone22': 0.5, 'none': 0.2}
+    TYPE_SCORE = {'atex': 1.0, 'vsd': 0.7, 'meca': 0.6, 'switchboard': 0.5}
+    RISK_LEVELS = [
+        (0.7, "CRITICAL", "Inspection immédiate requise"),
+        (0.5, "HIGH", "Planifier contrôle préventif urgent"),
+        (0.3, "MEDIUM", "Surveillance accrue recommandée"),
+    ]
+
+    def prepare_features_batch(self, items: List[Dict]) -> np.ndarray:
+        """Columnar prepare_features: one (n, 8) matrix for the whole batch"""
+        X = np.empty((len(items), 8))
+        X[:, 0] = [d.get('days_since_control', 0) for d in items]
+        X[:, 1] = [d.get('nc_count', 0) for d in items]
+        X[:, 2] = [d.get('total_controls', 0) for d in items]
+        X[:, 3] = [d.get('nc_rate', 0) for d in items]
+        X[:, 4] = [d.get('age_days', 365) for d in items]
+        X[:, 5] = [d.get('criticality_score', 0.5) for d in items]
+        X[:, 6] = [self.ZONE_SCORE.get(str(d.get('zone', 'none')).lower(), 0.3) for d in items]
+        X[:, 7] = [self.TYPE_SCORE.get(d.get('equipment_type', 'switchboard').lower(), 0.5) for d in items]
+        return X
+
+    def predict_failure_batch(self, items: List[Dict]) -> List[Dict]:
+        """predict_failure over many equipments: one predict_proba call, same output per item"""
+        if not items:
+            return []
+        b = self.bundle
+        try:
+            X = self.prepare_features_batch(items)
+            if b.failure_model is not None:
+                proba = b.failure_model.predict_proba(self._scaled(b, X))
+                probs = proba[:, 1] if proba.shape[1] > 1 else proba[:, 0]
+            else:
+                probs = self._heuristic_failure_batch(X, [d.get('equipment_type', '') for d in items])
+            served = probs
+            probs = self.online.blend(X, probs)
+        except Exception as e:
+            print(f"[ML] Batch prediction error, falling back to per-item: {e}")
+            return [self.predict_failure(d, bundle=b) for d in items]
+
+        # risk classification: index into RISK_LEVELS (+ LOW), first threshold reached wins
+        level = np.full(len(items), len(self.RISK_LEVELS))
+        for i, (thr, _, _) in reversed(list(enumerate(self.RISK_LEVELS))):
+            level[probs >= thr] = i
+        labels = [(r, a) for _, r, a in self.RISK_LEVELS] + [("LOW", "Maintenance standard")]
+        confidence = 0.85 if b.failure_model else 0.6
+
+        results = []
+        for d, x, p, ps, lv in zip(items, X, probs.tolist(), served.tolist(), level.tolist()):
+            self._remember(d.get('equipment_id'), x, ps)
+            risk_level, action = labels[lv]
+            results.append({
+                "failure_probability": round(p, 3),
+                "risk_level": risk_level,
+                "confidence": confidence,
+                "recommended_action": action,
+                "model_version": b.model_version,
+                "factors": {
+                    "days_since_control": d.get('days_since_control', 0),
+                    "nc_history": d.get('nc_count', 0),
+                    "equipment_type": d.get('equipment_type', 'unknown')
+                }
+            })
+        return results
+
+    def predict_failure(self, equipment_data: Dict, bundle: Optional[ModelBundle] = None) -> Dict:
         """Predict failure probability for equipment"""
+        b = bundle or self.bundle
         try:
             features = self.prepare_features(equipment_data)
 
-            if self.failure_model is not None:
+            if b.failure_model is not None:
                 # Use trained model
-                proba = self.failure_model.predict_proba(features)[0]
+                proba = b.failure_model.predict_proba(self._scaled(b, features))[0]
                 failure_prob = float(proba[1]) if len(proba) > 1 else float(proba[0])
             else:
                 # Heuristic fallback when no model trained
                 failure_prob = self._heuristic_failure_prediction(equipment_data)
+            self._remember(equipment_data.get('equipment_id'), features, failure_prob)
+            blended = self.online.blend(features, np.array([failure_prob]))
+            if blended[0] != failure_prob:
+                failure_prob = float(blended[0])
 
             # Risk classification
             if failure_prob >= 0.7:
@@ -169,9 +457,9 @@ class MLModelsManager:
             return {
                 "failure_probability": round(failure_prob, 3),
                 "risk_level": risk_level,
-                "confidence": 0.85 if self.failure_model else 0.6,
+                "confidence": 0.85 if b.failure_model else 0.6,
                 "recommended_action": action,
-                "model_version": self.model_version,
+                "model_version": b.model_version,
                 "factors": {
                     "days_since_control": equipment_data.get('days_since_control', 0),
                     "nc_history": equipment_data.get('nc_count', 0),
@@ -217,11 +505,23 @@ class MLModelsManager:
 
         return min(score, 1.0)
 
+    def _heuristic_failure_batch(self, X: np.ndarray, eq_types: List[str]) -> np.ndarray:
+        """Vectorized _heuristic_failure_prediction (same terms, same order of additions)"""
+        days = X[:, 0]
+        score = np.full(len(X), 0.2)
+        score += np.where(days > 365, 0.3, np.where(days > 180, 0.15, np.where(days > 90, 0.05, 0.0)))
+        score += np.minimum(X[:, 1] * 0.1, 0.3)
+        score += X[:, 3] * 0.2
+        t = np.array([str(e or '').lower() for e in eq_types])
+        score += np.where(t == 'atex', 0.15, np.where(t == 'vsd', 0.1, 0.0))
+        return np.minimum(score, 1.0)
+
     def predict_maintenance_date(self, equipment_data: Dict) -> Dict:
         """Predict optimal next maintenance date"""
         try:
             # Get failure prediction first
-            failure_pred = self.predict_failure(equipment_data)
+            b = self.bundle
+            failure_pred = self.predict_failure(equipment_data, bundle=b)
             failure_prob = failure_pred['failure_probability']
 
             # Calculate recommended days until maintenance
@@ -245,7 +545,7 @@ class MLModelsManager:
                 "days_until": days_until,
                 "urgency": "immediate" if days_until == 0 else "week" if days_until <= 7 else "month" if days_until <= 30 else "scheduled",
                 "based_on_risk": failure_prob,
-                "confidence": 0.8 if self.maintenance_model else 0.65
+                "confidence": 0.8 if b.maintenance_model else 0.65
             }
         except Exception as e:
             print(f"[ML] Maintenance prediction error: {e}")
@@ -256,235 +556,597 @@ class MLModelsManager:
                 "error": str(e)
             }
 
-    def analyze_patterns(self, site: str) -> Dict:
-        """Analyze patterns in control and NC data"""
+    # control history source -> (date column, non-conformity predicate)
+    CONTROL_TABLES = {
+        "control_reports": ("cr.control_date", "cr.result = 'non_conforme'"),
+        "control_records": ("cr.performed_at", "cr.status = 'non_conform'"),
+    }
+    # One pass over the full history: GROUPING(...) tells the sets apart (3 = day of week,
+    # 5 = building, 6 = month, 7 = grand total) even where building_code itself is NULL
+    PATTERN_SQL = """
+        WITH c AS (
+            SELECT
+                EXTRACT(DOW FROM {date})::int AS day_of_week,
+                s.building_code,
+                EXTRACT(MONTH FROM {date})::int AS month,
+                ({nc}) AS nc
+            FROM {table} cr
+            LEFT JOIN switchboards s ON cr.switchboard_id = s.id
+            WHERE s.site = %s
+        )
+        SELECT
+            GROUPING(day_of_week, building_code, month) AS g,
+            day_of_week, building_code, month,
+            COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE nc) AS nc
+        FROM c
+        GROUP BY GROUPING SETS ((day_of_week), (building_code), (month), ())
+        ORDER BY g, day_of_week, building_code, month
+    """
+    # change detector for the per-site cache: newest control id, one backward step on the
+    # primary key (new controls only; edits are picked up at TTL or via invalidate_patterns)
+    PATTERN_WATERMARK_SQL = "SELECT MAX(id) AS last_id FROM {table}"
+
+    def _pattern_query(self, sql: str, site: Optional[str]):
+        """Run a pattern query on control_reports, falling back to control_records"""
+        params = (site,) if site is not None else ()
         try:
-            # Get control history - try control_reports view first, fallback to control_records
-            try:
-                controls = db_query("""
-                    SELECT
-                        cr.control_date,
-                        cr.result,
-                        s.building_code,
-                        EXTRACT(DOW FROM cr.control_date) as day_of_week,
-                        EXTRACT(MONTH FROM cr.control_date) as month
-                    FROM control_reports cr
-                    LEFT JOIN switchboards s ON cr.switchboard_id = s.id
-                    WHERE s.site = %s
-                    ORDER BY cr.control_date DESC
-                    LIMIT 1000
-                """, (site,))
-            except Exception as view_error:
-                # Fallback to control_records table directly
-                print(f"[ML] control_reports view not available, trying control_records: {view_error}")
-                controls = db_query("""
-                    SELECT
-                        cr.performed_at as control_date,
-                        CASE WHEN cr.status = 'conform' THEN 'conforme'
-                             WHEN cr.status = 'non_conform' THEN 'non_conforme'
-                             ELSE cr.status END as result,
-                        s.building_code,
-                        EXTRACT(DOW FROM cr.performed_at) as day_of_week,
-                        EXTRACT(MONTH FROM cr.performed_at) as month
-                    FROM control_records cr
-                    LEFT JOIN switchboards s ON cr.switchboard_id = s.id
-                    WHERE s.site = %s
-                    ORDER BY cr.performed_at DESC
-                    LIMIT 1000
-                """, (site,))
-
-            if not controls:
-                return {"patterns": [], "insights": ["Pas assez de données pour l'analyse"]}
-
-            # Analyze patterns
-            patterns = []
-            insights = []
-
-            # Day of week analysis
-            dow_counts = {}
-            dow_nc = {}
-            for c in controls:
-                dow = int(c.get('day_of_week', 0))
-                dow_counts[dow] = dow_counts.get(dow, 0) + 1
-                if c.get('result') == 'non_conforme':
-                    dow_nc[dow] = dow_nc.get(dow, 0) + 1
-
-            # Find problematic days
-            for dow, count in dow_counts.items():
-                nc_count = dow_nc.get(dow, 0)
-                if count > 0:
-                    nc_rate = nc_count / count
-                    if nc_rate > 0.3:
-                        day_names = ['Dimanche', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi']
-                        patterns.append({
-                            "type": "day_pattern",
-                            "day": day_names[dow],
-                            "nc_rate": round(nc_rate * 100, 1),
-                            "total_controls": count
-                        })
-
-            # Building analysis
-            building_stats = {}
-            for c in controls:
-                bldg = c.get('building_code', 'Unknown')
-                if bldg not in building_stats:
-                    building_stats[bldg] = {'total': 0, 'nc': 0}
-                building_stats[bldg]['total'] += 1
-                if c.get('result') == 'non_conforme':
-                    building_stats[bldg]['nc'] += 1
-
-            # Find problematic buildings
-            for bldg, stats in building_stats.items():
-                if stats['total'] >= 10:
-                    nc_rate = stats['nc'] / stats['total']
-                    if nc_rate > 0.25:
-                        patterns.append({
-                            "type": "building_pattern",
-                            "building": bldg,
-                            "nc_rate": round(nc_rate * 100, 1),
-                            "total_controls": stats['total']
-                        })
-                        insights.append(f"Bâtiment {bldg}: taux de NC élevé ({round(nc_rate * 100)}%)")
-
-            # Monthly trend
-            monthly_nc = {}
-            for c in controls:
-                month = int(c.get('month', 1))
-                if month not in monthly_nc:
-                    monthly_nc[month] = {'total': 0, 'nc': 0}
-                monthly_nc[month]['total'] += 1
-                if c.get('result') == 'non_conforme':
-                    monthly_nc[month]['nc'] += 1
-
-            # Seasonal patterns
-            high_nc_months = []
-            for month, stats in monthly_nc.items():
-                if stats['total'] >= 5:
-                    nc_rate = stats['nc'] / stats['total']
-                    if nc_rate > 0.3:
-                        month_names = ['Jan', 'Fév', 'Mar', 'Avr', 'Mai', 'Jun', 'Jul', 'Aoû', 'Sep', 'Oct', 'Nov', 'Déc']
-                        high_nc_months.append(month_names[month - 1])
-
-            if high_nc_months:
-                insights.append(f"Mois à surveiller: {', '.join(high_nc_months)}")
+            date, nc = self.CONTROL_TABLES["control_reports"]
+            return db_query(sql.format(table="control_reports", date=date, nc=nc), params)
+        except Exception as view_error:
+            print(f"[ML] control_reports view not available, trying control_records: {view_error}")
+            date, nc = self.CONTROL_TABLES["control_records"]
+            return db_query(sql.format(table="control_records", date=date, nc=nc), params)
+
+    def invalidate_patterns(self, site: Optional[str] = None):
+        """Drop cached pattern analyses (one site, or all) after new control outcomes"""
+        with self._pattern_lock:
+            if site is None:
+                self._pattern_cache.clear()
+            else:
+                self._pattern_cache.pop(site, None)
 
-            return {
-                "patterns": patterns,
-                "insights": insights if insights else ["Aucun pattern anormal détecté"],
-                "data_points": len(controls),
-                "buildings_analyzed": len(building_stats)
-            }
+    def analyze_patterns(self, site: str) -> Dict:
+        """Analyze patterns in control and NC data (cached per site until TTL, new controls
+        or invalidate_patterns)"""
+        try:
+            wm = self._pattern_query(self.PATTERN_WATERMARK_SQL, None)
+            watermark = wm[0]["last_id"] if wm else None
+            now = time.time()
+            with self._pattern_lock:
+                hit = self._pattern_cache.get(site)
+                if hit:
+                    self._pattern_cache.move_to_end(site)
+            if hit and hit[0] > now and hit[1] == watermark:
+                return {**hit[2], "cached": True}
+            result = self._compute_patterns(site)
+            if PATTERN_TTL_S > 0 and "error" not in result:
+                with self._pattern_lock:
+                    self._pattern_cache[site] = (now + PATTERN_TTL_S, watermark, result)
+                    self._pattern_cache.move_to_end(site)
+                    while len(self._pattern_cache) > PATTERN_CACHE_MAX:
+                        self._pattern_cache.popitem(last=False)
+            return {**result, "cached": False}
         except Exception as e:
             print(f"[ML] Pattern analysis error: {e}")
             return {"patterns": [], "insights": [f"Erreur d'analyse: {str(e)}"], "error": str(e)}
 
-    def train_models(self, site: str = None) -> Dict:
-        """Train/retrain ML models with current data"""
+    def _compute_patterns(self, site: str) -> Dict:
+        rows = self._pattern_query(self.PATTERN_SQL, site)
+        total = next((int(r['total']) for r in rows if r['g'] == 7), 0)
+        if not total:
+            return {"patterns": [], "insights": ["Pas assez de données pour l'analyse"]}
+
+        patterns = []
+        insights = []
+        day_names = ['Dimanche', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi']
+        month_names = ['Jan', 'Fév', 'Mar', 'Avr', 'Mai', 'Jun', 'Jul', 'Aoû', 'Sep', 'Oct', 'Nov', 'Déc']
+
+        # Find problematic days
+        for r in (r for r in rows if r['g'] == 3 and r['day_of_week'] is not None):
+            nc_rate = r['nc'] / r['total']
+            if nc_rate > 0.3:
+                patterns.append({
+                    "type": "day_pattern",
+                    "day": day_names[int(r['day_of_week'])],
+                    "nc_rate": round(nc_rate * 100, 1),
+                    "total_controls": int(r['total'])
+                })
+
+        # Find problematic buildings
+        buildings = [r for r in rows if r['g'] == 5]
+        for r in buildings:
+            if r['total'] >= 10:
+                nc_rate = r['nc'] / r['total']
+                if nc_rate > 0.25:
+                    bldg = r['building_code']
+                    patterns.append({
+                        "type": "building_pattern",
+                        "building": bldg,
+                        "nc_rate": round(nc_rate * 100, 1),
+                        "total_controls": int(r['total'])
+                    })
+                    insights.append(f"Bâtiment {bldg}: taux de NC élevé ({round(nc_rate * 100)}%)")
+
+        # Seasonal patterns
+        high_nc_months = []
+        for r in (r for r in rows if r['g'] == 6 and r['month'] is not None):
+            if r['total'] >= 5 and r['nc'] / r['total'] > 0.3:
+                high_nc_months.append(month_names[int(r['month']) - 1])
+
+        if high_nc_months:
+            insights.append(f"Mois à surveiller: {', '.join(high_nc_months)}")
+
+        return {
+            "patterns": patterns,
+            "insights": insights if insights else ["Aucun pattern anormal détecté"],
+            "data_points": total,
+            "buildings_analyzed": len(buildings)
+        }
+
+    # Point-in-time features: every control only sees the controls of its switchboard that
+    # came strictly before it (no leakage of its own / future outcomes), in one windowed pass.
+    TRAINING_SQL = {
+        "control_reports": """
+            SELECT
+                cr.control_date::date - LAG(cr.control_date::date) OVER p AS days_since_control,
+                COUNT(*) FILTER (WHERE cr.result = 'non_conforme') OVER w AS nc_count,
+                COUNT(*) OVER w AS total_controls,
+                COALESCE(cr.result = 'non_conforme', false)::int AS label
+            FROM control_reports cr
+            LEFT JOIN switchboards s ON cr.switchboard_id = s.id
+            WHERE s.site = %s OR %s IS NULL
+            WINDOW p AS (PARTITION BY cr.switchboard_id ORDER BY cr.control_date),
+                   w AS (p ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+            ORDER BY cr.control_date
+        """,
+        "control_records": """
+            SELECT
+                cr.performed_at::date - LAG(cr.performed_at::date) OVER p AS days_since_control,
+                COUNT(*) FILTER (WHERE cr.status = 'non_conform') OVER w AS nc_count,
+                COUNT(*) OVER w AS total_controls,
+                COALESCE(cr.status = 'non_conform', false)::int AS label
+            FROM control_records cr
+            LEFT JOIN switchboards s ON cr.switchboard_id = s.id
+            WHERE s.site = %s OR %s IS NULL
+            WINDOW p AS (PARTITION BY cr.switchboard_id ORDER BY cr.performed_at),
+                   w AS (p ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+            ORDER BY cr.performed_at
+        """,
+    }
+    TRAINING_COUNT_SQL = """
+        SELECT COUNT(*) AS n, MIN({date}) AS first, MAX({date}) AS last FROM {table} cr
+        LEFT JOIN switchboards s ON cr.switchboard_id = s.id
+        WHERE s.site = %s OR %s IS NULL
+    """
+
+    @classmethod
+    def _extract_training_data(cls, table: str, site: Optional[str]):
+        """Stream the windowed training rows into preallocated (X, y) arrays laid out like
+        prepare_features, plus the data window they cover"""
+        cnt = db_query(cls.TRAINING_COUNT_SQL.format(table=table, date=cls.CONTROL_TABLES[table][0]), (site, site))
+        n = int(cnt[0]["n"]) if cnt else 0
+        window = {"source": table, "site": site,
+                  "first": str(cnt[0]["first"]) if cnt and cnt[0].get("first") else None,
+                  "last": str(cnt[0]["last"]) if cnt and cnt[0].get("last") else None}
+        raw = np.empty((n, 4))
+        i = 0
+        for rows in db_stream(cls.TRAINING_SQL[table], (site, site)):
+            batch = np.array(rows, dtype=float)  # NULL days (first control) -> nan
+            if i + len(batch) > len(raw):  # rows inserted since the count
+                raw = np.concatenate([raw, np.empty((i + len(batch) - len(raw), 4))])
+            raw[i:i + len(batch)] = batch
+            i += len(batch)
+        raw = raw[:i]
+
+        X = np.empty((i, 8))
+        X[:, 0] = np.nan_to_num(raw[:, 0], nan=0.0)             # days_since_control
+        X[:, 1] = raw[:, 1]                                     # nc_count (before this control)
+        X[:, 2] = raw[:, 2]                                     # total_controls (before this control)
+        X[:, 3] = raw[:, 1] / np.maximum(raw[:, 2], 1)          # nc_rate
+        # not in the control history: prepare_features defaults for a switchboard
+        X[:, 4] = 365
+        X[:, 5] = 0.5
+        X[:, 6] = cls.ZONE_SCORE['none']
+        X[:, 7] = cls.TYPE_SCORE['switchboard']
+        window["rows"] = i
+        return X, raw[:, 3].astype(np.int8), window
+
+    @classmethod
+    def fit_bundle(cls, site: Optional[str] = None, version: str = "1.0.0"):
+        """Extract + fit without touching any live state: (result, ModelBundle or None).
+        Runs in a training worker process; the caller publishes the bundle."""
+        from sklearn.ensemble import RandomForestClassifier
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import accuracy_score
         try:
             # Get training data - try control_reports view first, fallback to control_records
+            t0 = time.perf_counter()
             try:
-                controls = db_query("""
-                    SELECT
-                        cr.switchboard_id,
-                        cr.result,
-                        cr.control_date,
-                        s.building_code,
-                        (SELECT COUNT(*) FROM control_reports cr2
-                         WHERE cr2.switchboard_id = cr.switchboard_id
-                         AND cr2.result = 'non_conforme') as nc_count,
-                        (SELECT COUNT(*) FROM control_reports cr2
-                         WHERE cr2.switchboard_id = cr.switchboard_id) as total_controls
-                    FROM control_reports cr
-                    LEFT JOIN switchboards s ON cr.switchboard_id = s.id
-                    WHERE s.site = %s OR %s IS NULL
-                    ORDER BY cr.control_date
-                """, (site, site))
+                X, y, window = cls._extract_training_data("control_reports", site)
             except Exception as view_error:
                 # Fallback to control_records table directly
                 print(f"[ML] control_reports view not available for training, trying control_records: {view_error}")
-                controls = db_query("""
-                    SELECT
-                        cr.switchboard_id,
-                        CASE WHEN cr.status = 'conform' THEN 'conforme'
-                             WHEN cr.status = 'non_conform' THEN 'non_conforme'
-                             ELSE cr.status END as result,
-                        cr.performed_at as control_date,
-                        s.building_code,
-                        (SELECT COUNT(*) FROM control_records cr2
-                         WHERE cr2.switchboard_id = cr.switchboard_id
-                         AND cr2.status = 'non_conform') as nc_count,
-                        (SELECT COUNT(*) FROM control_records cr2
-                         WHERE cr2.switchboard_id = cr.switchboard_id) as total_controls
-                    FROM control_records cr
-                    LEFT JOIN switchboards s ON cr.switchboard_id = s.id
-                    WHERE s.site = %s OR %s IS NULL
-                    ORDER BY cr.performed_at
-                """, (site, site))
-
-            if len(controls) < 50:
+                X, y, window = cls._extract_training_data("control_records", site)
+            extract_s = time.perf_counter() - t0
+
+            if len(X) < 50:
                 return {
                     "success": False,
                     "message": "Pas assez de données pour l'entraînement (min 50 contrôles)",
-                    "data_points": len(controls)
-                }
-
-            # Prepare training data
-            X = []
-            y = []
-
-            for c in controls:
-                features = [
-                    c.get('nc_count', 0),
-                    c.get('total_controls', 1),
-                    c.get('nc_count', 0) / max(c.get('total_controls', 1), 1),
-                    0.5,  # placeholder for days_since
-                    0.5,  # placeholder for criticality
-                    0.5,  # placeholder for zone
-                    0.5,  # placeholder for type
-                    0.5   # placeholder
-                ]
-                X.append(features)
-                y.append(1 if c.get('result') == 'non_conforme' else 0)
-
-            X = np.array(X)
-            y = np.array(y)
+                    "data_points": len(X)
+                }, None
 
             # Split data
             X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
             # Scale features
-            X_train_scaled = self.scaler.fit_transform(X_train)
-            X_test_scaled = self.scaler.transform(X_test)
+            scaler = StandardScaler()
+            X_train_scaled = scaler.fit_transform(X_train)
+            X_test_scaled = scaler.transform(X_test)
 
             # Train failure prediction model
-            self.failure_model = RandomForestClassifier(n_estimators=100, max_depth=10, random_state=42)
-            self.failure_model.fit(X_train_scaled, y_train)
+            failure_model = RandomForestClassifier(n_estimators=100, max_depth=10, random_state=42)
+            failure_model.fit(X_train_scaled, y_train)
 
             # Evaluate
-            y_pred = self.failure_model.predict(X_test_scaled)
+            y_pred = failure_model.predict(X_test_scaled)
             accuracy = accuracy_score(y_test, y_pred)
+            trained_at = datetime.now()
 
-            # Save models
-            self._save_models()
-
-            return {
+            result = {
                 "success": True,
                 "message": f"Modèles entraînés avec succès",
-                "data_points": len(controls),
+                "data_points": len(X),
+                "extract_s": round(extract_s, 3),
                 "accuracy": round(accuracy, 3),
-                "model_version": self.model_version,
-                "trained_at": datetime.now().isoformat()
+                "model_version": version,
+                "trained_at": trained_at.isoformat()
             }
+            bundle = ModelBundle(failure_model=failure_model, scaler=scaler, model_version=version,
+                                 trained_at=trained_at, data_window=window,
+                                 metrics={"accuracy": result["accuracy"], "data_points": len(X),
+                                          "test_size": len(y_test), "positive_rate": round(float(y.mean()), 4)})
+            return result, bundle
         except Exception as e:
             print(f"[ML] Training error: {e}")
             return {
                 "success": False,
                 "message": f"Erreur d'entraînement: {str(e)}",
                 "error": str(e)
-            }
+            }, None
+
+    def train_models(self, site: str = None) -> Dict:
+        """Train/retrain ML models with current data (in the calling thread)"""
+        result, bundle = self.fit_bundle(site, version=self.model_version)
+        if bundle is not None:
+            result["model_version"] = self.publish(bundle._replace(maintenance_model=self.bundle.maintenance_model))
+        return result
+
+def _train_job(site: Optional[str], version: str):
+    """Training worker entry point (top level so the process pool can pickle it)"""
+    return MLModelsManager.fit_bundle(site, version=version)
+
+# ============================================================
+# Background training jobs
+# ============================================================
+class TrainingJobs:
+    """Training runs in worker processes (the fit never holds the API's GIL); when one
+    finishes, its bundle is published by a single reference swap on the manager."""
+    def __init__(self, manager: "MLModelsManager", workers: int = TRAIN_WORKERS):
+        self.manager = manager
+        self.workers = max(1, workers)
+        self._pool = None
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: never fork a process that has live server threads
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def submit(self, site: Optional[str]) -> Dict[str, Any]:
+        with self._lock:
+            # one pending run per site is enough: the next one would see the same data
+            for job in self._jobs.values():
+                if job["site"] == site and job["status"] in ("queued", "running"):
+                    return self._view(job)
+            job_id = uuid.uuid4().hex[:12]
+            job = {"job_id": job_id, "site": site, "status": "queued",
+                   "submitted_at": datetime.now().isoformat(), "finished_at": None, "result": None,
+                   "done": threading.Event()}  # set once finished and published
+            self._jobs[job_id] = job
+            self._prune()
+            try:
+                job["future"] = self._executor().submit(_train_job, site, self.manager.model_version)
+            except Exception as e:
+                job.update(status="failed", finished_at=datetime.now().isoformat(),
+                           result={"success": False, "message": f"Erreur d'entraînement: {e}", "error": str(e)})
+                job["done"].set()
+                return self._view(job)
+        job["future"].add_done_callback(lambda fut, job=job: self._finish(job, fut))
+        return self._view(job)
+
+    def _finish(self, job: Dict[str, Any], fut):
+        try:
+            result, bundle = fut.result()
+            if bundle is not None:
+                result["model_version"] = self.manager.publish(
+                    bundle._replace(maintenance_model=self.manager.bundle.maintenance_model))
+        except Exception as e:
+            print(f"[ML] Training job {job['job_id']} failed: {e}")
+            result = {"success": False, "message": f"Erreur d'entraînement: {e}", "error": str(e)}
+        with self._lock:
+            job.update(status="succeeded" if result.get("success") else "failed",
+                       finished_at=datetime.now().isoformat(), result=result)
+        job["done"].set()
+
+    def _prune(self):
+        done = [j for j in self._jobs.values() if j["status"] in ("succeeded", "failed")]
+        for j in done[:max(0, len(done) - TRAIN_JOBS_KEEP)]:
+            del self._jobs[j["job_id"]]
+
+    def _view(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        out = {k: v for k, v in job.items() if k not in ("future", "done")}
+        fut = job.get("future")
+        if out["status"] == "queued" and fut is not None and fut.running():
+            out["status"] = "running"
+        return out
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._view(job) if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until the job is finished and its bundle (if any) published"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job["done"].wait(timeout)
+        return self.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            views = [self._view(j) for j in self._jobs.values()]
+        out: Dict[str, int] = {}
+        for v in views:
+            out[v["status"]] = out.get(v["status"], 0) + 1
+        return out
 
-# Initialize models manager
-models = MLModelsManager()
+# ============================================================
+# Online learning
+# ============================================================
+class OnlineLearner:
+    """Incremental failure model fed by /feedback and new control outcomes in mini-batches
+    (SGD logistic regression + running scaler: constant cost per update, no history re-read).
+    Every batch is first scored by both the online model and the served model
+    (prequential evaluation); rolling accuracies decide the online model's share:
+    shadow (0) until warm or while clearly worse, blended in proportion to accuracy when
+    close, promoted (1) once better by ONLINE_PROMOTE_MARGIN. State lives next to the
+    registry and is reloaded under a file lock, so all workers learn into one model."""
+    def __init__(self, path: Path):
+        self.path = path
+        self.model = None
+        self.scaler = None
+        self.n_seen = 0
+        self.acc_online = deque(maxlen=ONLINE_WINDOW)
+        self.acc_base = deque(maxlen=ONLINE_WINDOW)
+        self.controls_watermark = None
+        self._buffer: List[tuple] = []
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- state ----------
+    def _new_model(self):
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.preprocessing import StandardScaler
+        return SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42), StandardScaler()
+
+    def _reload_if_newer(self):
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        st = joblib.load(self.path)
+        self.model, self.scaler, self.n_seen = st["model"], st["scaler"], st["n_seen"]
+        self.acc_online = deque(st["acc_online"], maxlen=ONLINE_WINDOW)
+        self.acc_base = deque(st["acc_base"], maxlen=ONLINE_WINDOW)
+        self.controls_watermark = st.get("controls_watermark")
+        self._mtime = mtime
+
+    def _save(self):
+        tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex[:8]}")
+        joblib.dump({"model": self.model, "scaler": self.scaler, "n_seen": self.n_seen,
+                     "acc_online": list(self.acc_online), "acc_base": list(self.acc_base),
+                     "controls_watermark": self.controls_watermark}, tmp)
+        os.replace(tmp, self.path)
+        self._mtime = self.path.stat().st_mtime
+
+    def _locked_state(self):
+        """Cross-process lock around reload -> update -> save"""
+        import fcntl
+
+        class _Lock:
+            def __enter__(lk):
+                lk.f = open(self.path.with_suffix(".lock"), "w")
+                fcntl.flock(lk.f, fcntl.LOCK_EX)
+                self._reload_if_newer()
+            def __exit__(lk, *exc):
+                fcntl.flock(lk.f, fcntl.LOCK_UN)
+                lk.f.close()
+        return _Lock()
+
+    # ---------- learning ----------
+    def add(self, x: np.ndarray, label: int, base_prob: float):
+        """Queue one labelled example (x laid out like prepare_features); fits per mini-batch"""
+        with self._lock:
+            self._buffer.append((np.asarray(x, dtype=float).ravel(), int(label), float(base_prob)))
+            if len(self._buffer) < ONLINE_BATCH:
+                return
+            batch, self._buffer = self._buffer, []
+        self._fit(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if batch:
+            self._fit(batch)
+
+    def _fit(self, batch: List[tuple]):
+        X = np.vstack([b[0] for b in batch])
+        y = np.array([b[1] for b in batch])
+        base = np.array([b[2] for b in batch])
+        with self._lock, self._locked_state():
+            self._partial_fit(X, y, base)
+            self._save()
+
+    def _partial_fit(self, X: np.ndarray, y: np.ndarray, base: np.ndarray):
+        """Score (prequential) then fit one mini-batch; caller holds both locks"""
+        if self.model is None:
+            self.model, self.scaler = self._new_model()
+        elif self.n_seen:
+            pred = self.model.predict(self.scaler.transform(X))
+            self.acc_online.extend((pred == y).tolist())
+            self.acc_base.extend(((base >= 0.5).astype(int) == y).tolist())
+        self.scaler.partial_fit(X)
+        self.model.partial_fit(self.scaler.transform(X), y, classes=np.array([0, 1]))
+        self.n_seen += len(y)
+
+    # ---------- serving ----------
+    def weight(self):
+        """(mode, share of the online model in the served probability)"""
+        now = time.time()
+        if now - self._checked > REGISTRY_POLL_S:
+            self._checked = now
+            try:
+                with self._lock:
+                    self._reload_if_newer()
+            except Exception as e:
+                print(f"[ML] Online model load warning: {e}")
+        if self.model is None or self.n_seen < ONLINE_MIN_SAMPLES or len(self.acc_online) < ONLINE_BATCH:
+            return "shadow", 0.0
+        a_on = sum(self.acc_online) / len(self.acc_online)
+        a_base = sum(self.acc_base) / len(self.acc_base)
+        if a_on >= a_base + ONLINE_PROMOTE_MARGIN:
+            return "promoted", 1.0
+        if a_on >= a_base - ONLINE_PROMOTE_MARGIN:
+            return "blend", a_on / max(a_on + a_base, 1e-9)
+        return "shadow", 0.0
+
+    def blend(self, X: np.ndarray, probs: np.ndarray) -> np.ndarray:
+        """Served failure probabilities: unchanged unless the online model earned a share"""
+        _, w = self.weight()
+        if w <= 0:
+            return probs
+        model, scaler = self.model, self.scaler
+        p_online = model.predict_proba(scaler.transform(X))[:, 1]
+        return (1 - w) * probs + w * p_online
+
+    def stats(self) -> Dict[str, Any]:
+        mode, w = self.weight()
+        acc = lambda d: round(sum(d) / len(d), 4) if d else None
+        return {"mode": mode, "weight": round(w, 4), "samples": self.n_seen, "pending": len(self._buffer),
+                "rolling_accuracy": {"online": acc(self.acc_online), "served": acc(self.acc_base),
+                                     "window": len(self.acc_online)},
+                "controls_watermark": self.controls_watermark}
+
+    # ---------- new control outcomes ----------
+    # Point-in-time features (as in training) for controls after the (date, id) keyset
+    # cursor; the windows only run over switchboards that actually have new controls
+    ONLINE_CONTROLS_SQL = """
+        WITH fresh AS (
+            SELECT DISTINCT switchboard_id FROM {table} WHERE ({date_raw}, id) > (%s::timestamptz, %s)
+        ), w AS (
+            SELECT
+                cr.id,
+                {date} AS control_date,
+                {date}::date - LAG({date}::date) OVER p AS days_since_control,
+                COUNT(*) FILTER (WHERE {nc}) OVER win AS nc_count,
+                COUNT(*) OVER win AS total_controls,
+                COALESCE({nc}, false)::int AS label
+            FROM {table} cr
+            JOIN fresh f ON f.switchboard_id = cr.switchboard_id
+            WINDOW p AS (PARTITION BY cr.switchboard_id ORDER BY {date}),
+                   win AS (p ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING)
+        )
+        SELECT * FROM w WHERE (control_date, id) > (%s::timestamptz, %s)
+        ORDER BY control_date, id LIMIT %s
+    """
+
+    def ingest_controls(self, manager: "MLModelsManager") -> int:
+        """Feed controls recorded since the cursor (served-model probabilities as the baseline).
+        Cursor read, fit and cursor advance happen under the state file lock, so a row is
+        learned once even if two processes ingest."""
+        with self._lock, self._locked_state():
+            wm = self.controls_watermark
+            if not isinstance(wm, dict):  # legacy: plain date, ids unknown
+                # start where the batch model's data ends (or now): history is the trainer's job
+                wm = {"date": wm or manager.bundle.data_window.get("last") or datetime.now().isoformat(), "id": 0}
+            rows = None
+            for table in ("control_reports", "control_records"):
+                date, nc = MLModelsManager.CONTROL_TABLES[table]
+                try:
+                    rows = db_query(self.ONLINE_CONTROLS_SQL.format(table=table, date=date, nc=nc,
+                                                                    date_raw=date.split(".", 1)[1]),
+                                    (wm["date"], wm["id"], wm["date"], wm["id"], ONLINE_BATCH * 50))
+                    break
+                except Exception as e:
+                    print(f"[ML] Online control ingestion: {table} unavailable ({e})")
+            if not rows:
+                return 0
+            X, y = self._control_features(rows)
+            base = manager.served_probabilities(X)
+            for lo in range(0, len(rows), ONLINE_BATCH):
+                self._partial_fit(X[lo:lo + ONLINE_BATCH], y[lo:lo + ONLINE_BATCH], base[lo:lo + ONLINE_BATCH])
+            self.controls_watermark = {"date": str(rows[-1]["control_date"]), "id": int(rows[-1]["id"])}
+            self._save()
+        manager.invalidate_patterns()
+        return len(rows)
+
+    @staticmethod
+    def _control_features(rows) -> tuple:
+        X = np.empty((len(rows), 8))
+        X[:, 0] = [float(r["days_since_control"] or 0) for r in rows]
+        X[:, 1] = [r["nc_count"] for r in rows]
+        X[:, 2] = [r["total_controls"] for r in rows]
+        X[:, 3] = X[:, 1] / np.maximum(X[:, 2], 1)
+        X[:, 4] = 365
+        X[:, 5] = 0.5
+        X[:, 6] = MLModelsManager.ZONE_SCORE['none']
+        X[:, 7] = MLModelsManager.TYPE_SCORE['switchboard']
+        return X, np.array([int(r["label"]) for r in rows])
+
+def _online_controls_loop():
+    """One ingester per registry: the process holding online-ingest.lock (taken over if it dies)"""
+    import fcntl
+    lock = open(REGISTRY_DIR / "online-ingest.lock", "w")
+    leader = False
+    while True:
+        time.sleep(ONLINE_CONTROLS_S)
+        if not leader:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)  # held for the process lifetime
+                leader = True
+                print(f"[ML] Online control ingestion: elected (pid {os.getpid()})")
+            except OSError:
+                continue
+        try:
+            n = models.online.ingest_controls(models)
+            if n:
+                print(f"[ML] Online learning: {n} new control outcomes")
+        except Exception as e:
+            print(f"[ML] Online control ingestion error: {e}")
+
+# Initialize models manager (cheap: the bundle is loaded on first use)
+models = MLModelsManager(ModelRegistry(REGISTRY_DIR))
+train_jobs = TrainingJobs(models)
 
 # ============================================================
 # FastAPI App
@@ -498,6 +1160,13 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+@app.on_event("startup")
+def start_online_ingestion():
+    # server processes only (training workers import this module too); every worker runs
+    # the loop, the ingest lock elects the one that polls
+    if ONLINE_CONTROLS_S > 0 and PG_URL:
+        threading.Thread(target=_online_controls_loop, name="ml-online-controls", daemon=True).start()
+
 # Request models
 class EquipmentData(BaseModel):
     equipment_id: Optional[str] = None
@@ -522,13 +1191,18 @@ class FeedbackRequest(BaseModel):
     was_accurate: bool
     actual_outcome: Optional[str] = None
     site: Optional[str] = None
+    equipment: Optional["EquipmentData"] = None  # features, when the prediction is no longer in memory
 
 class TrainRequest(BaseModel):
     site: Optional[str] = None
+    wait: bool = False  # block until the job is done and answer with its result (previous behaviour)
 
 class PatternRequest(BaseModel):
     site: str
 
+class RollbackRequest(BaseModel):
+    version: Optional[str] = None  # default: the version before the current one
+
 # Endpoints
 @app.get("/health")
 def health():
@@ -541,7 +1215,9 @@ def health():
             "maintenance_model": models.maintenance_model is not None
         },
         "model_version": models.model_version,
-        "last_trained": models.last_trained.isoformat() if models.last_trained else None
+        "last_trained": models.last_trained.isoformat() if models.last_trained else None,
+        "training_jobs": train_jobs.stats(),
+        "online": models.online.stats()
     }
 
 @app.post("/predict/failure")
@@ -554,11 +1230,9 @@ def predict_failure(data: EquipmentData):
 @app.post("/predict/failure/batch")
 def predict_failure_batch(data: BatchPredictionRequest):
     """Predict failure probability for multiple equipments"""
-    results = []
-    for eq in data.equipments:
-        result = models.predict_failure(eq.dict())
+    results = models.predict_failure_batch([eq.dict() for eq in data.equipments])
+    for eq, result in zip(data.equipments, results):
         result['equipment_id'] = eq.equipment_id
-        results.append(result)
 
     # Sort by risk
     results.sort(key=lambda x: x['failure_probability'], reverse=True)
@@ -583,15 +1257,79 @@ def analyze_patterns(data: PatternRequest):
     result = models.analyze_patterns(data.site)
     return {"ok": True, "analysis": result}
 
-@app.post("/train")
+@app.post("/train", status_code=202)
 def train_models(data: TrainRequest):
-    """Train/retrain ML models"""
-    result = models.train_models(data.site)
-    return {"ok": result['success'], **result}
+    """Submit a training job (poll GET /train/{job_id}); predictions keep using the
+    current models until the new bundle is published"""
+    job = train_jobs.submit(data.site)
+    if data.wait:
+        job = train_jobs.wait(job["job_id"])
+        result = job["result"] or {}
+        return {"ok": bool(result.get('success')), "job_id": job["job_id"], **result}
+    return {"ok": True, **job}
+
+@app.get("/models")
+def list_models():
+    """Registry versions (manifest each), newest first"""
+    cur = models.registry.current()
+    out = []
+    for v in reversed(models.registry.list_versions()):
+        try:
+            m = models.registry.manifest(v)
+        except Exception as e:
+            m = {"version": v, "error": str(e)}
+        out.append({**m, "current": v == cur})
+    return {"ok": True, "current": cur, "loaded": models._bundle.model_version if models._bundle else None,
+            "versions": out}
+
+@app.post("/models/rollback")
+def rollback_models(data: RollbackRequest):
+    """Make a previous version current again (all workers follow within ML_REGISTRY_POLL_S)"""
+    try:
+        version = models.rollback(data.version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"ok": True, "current": version}
+
+@app.get("/train/{job_id}")
+def train_status(job_id: str):
+    """Status of a training job: queued | running | succeeded | failed (+ result)"""
+    job = train_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown training job")
+    return {"ok": True, **job}
+
+FAILURE_OUTCOMES = {"failure", "failed", "panne", "defaillance", "défaillance", "non_conforme", "non_conform", "nc"}
+OK_OUTCOMES = {"ok", "no_failure", "conforme", "conform"}
+
+def learn_from_feedback(data: FeedbackRequest) -> bool:
+    """Turn failure-prediction feedback into one online training example"""
+    if "failure" not in data.prediction_type.lower():
+        return False
+    if data.equipment is not None:
+        eq = data.equipment.dict()
+        x = models.prepare_features(eq).ravel()
+        served = float(models.served_probabilities(x.reshape(1, -1))[0])
+    else:
+        hit = models.recall(data.equipment_id)
+        if hit is None:
+            return False
+        x, served = hit
+    outcome = (data.actual_outcome or "").strip().lower()
+    if outcome in FAILURE_OUTCOMES:
+        label = 1
+    elif outcome in OK_OUTCOMES:
+        label = 0
+    else:  # no explicit outcome: the served call was right or wrong
+        predicted = int(served >= 0.5)
+        label = predicted if data.was_accurate else 1 - predicted
+    models.online.add(x, label, served)
+    return True
 
 @app.post("/feedback")
 def submit_feedback(data: FeedbackRequest):
-    """Submit feedback on predictions for learning"""
+    """Submit feedback on predictions for learning (storage and online learning reported apart)"""
+    out: Dict[str, Any] = {}
     try:
         # Store feedback in database
         db_execute("""
@@ -605,16 +1343,16 @@ def submit_feedback(data: FeedbackRequest):
             json.dumps({"actual_outcome": data.actual_outcome}),
             data.was_accurate
         ))
+        out.update(ok=True, message="Feedback enregistré, merci! Cela améliore nos prédictions.")
+    except Exception as e:
+        out.update(ok=False, error=str(e))
 
-        return {
-            "ok": True,
-            "message": "Feedback enregistré, merci! Cela améliore nos prédictions."
-        }
+    try:
+        out["learned"] = learn_from_feedback(data)
     except Exception as e:
-        return {
-            "ok": False,
-            "error": str(e)
-        }
+        print(f"[ML] Online learning from feedback failed: {e}")
+        out.update(learned=False, learning_error=str(e))
+    return out
 
 @app.get("/stats")
 def get_stats():
@@ -646,7 +1384,8 @@ def get_stats():
             "ok": True,
             "prediction_stats": stats,
             "model_version": models.model_version,
-            "last_trained": models.last_trained.isoformat() if models.last_trained else None
+            "last_trained": models.last_trained.isoformat() if models.last_trained else None,
+            "online": models.online.stats()
         }
     except Exception as e:
         return {"ok": False, "error": str(e)}
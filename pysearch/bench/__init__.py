@@ -0,0 +1,10 @@
+# DeepSearch++ bench — offline performance harness for pysearch_service
+#
+# - synth.py    : synthetic askv_documents / askv_chunks / askv_spans / askv_synonyms
+# - backends.py : in-process FakeDB (drop-in for db_query) + Postgres seeding
+# - run.py      : build_index + /search + /compare load runs, JSON results, regression diff
+# - replay.py   : re-run a PYSEARCH_QUERY_LOG capture against a live instance over HTTP
+# - tune.py     : sweep search knobs on a frozen index, nDCG/recall vs latency/CPU, Pareto frontier
+#
+# Run from the pysearch/ directory:
+#   python -m bench.run --chunks 10000 --backend fake --out bench_results.json
@@ -0,0 +1,96 @@
+# Bench backends
+# - FakeDB: in-process stand-in for pysearch_service.db_query over a synthetic corpus.
+#   It only understands the handful of statements the service issues (schema probes,
+#   chunk/span loads, synonym lookups) and raises on anything else.
+# - seed_postgres: loads a synthetic corpus into a *dedicated* Postgres database
+#   (tables are truncated — never point this at production).
+
+import re
+import time
+from typing import List, Dict, Any
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+CHUNK_COLS = ["id", "doc_id", "chunk_index", "content", "page", "section_title"]
+SPAN_COLS = ["id", "doc_id", "chunk_index", "span_index", "text", "page", "bbox"]
+
+
+class FakeDB:
+    def __init__(self, corpus: Dict[str, List[Dict[str, Any]]], latency_ms: float = 0.0):
+        self.corpus = corpus
+        self.latency = max(0.0, latency_ms) / 1000.0
+        self.calls = 0
+        fn_by_doc = {d["id"]: d["filename"] for d in corpus["documents"]}
+        self._chunk_rows = [{
+            "chunk_id": c["id"], "doc_id": c["doc_id"], "chunk_index": c["chunk_index"],
+            "content": c["content"], "filename": fn_by_doc.get(c["doc_id"]),
+            "page": c.get("page"), "section_title": c.get("section_title"),
+        } for c in corpus["chunks"]]
+        self._tables = {
+            "askv_documents": ["id", "filename"],
+            "askv_chunks": CHUNK_COLS,
+            "askv_spans": SPAN_COLS if corpus.get("spans") else None,
+            "askv_synonyms": ["term", "alt_term", "weight"],
+        }
+
+    def db_query(self, sql: str, params=()):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        s = " ".join(sql.split())
+
+        if "information_schema.columns" in s:
+            m = re.search(r"table_name='(\w+)'", s)
+            cols = self._tables.get(m.group(1)) if m else None
+            return [{"column_name": c} for c in (cols or [])]
+        if "to_regclass" in s:
+            name = params[0] if params else None
+            return [{"t": name if self._tables.get(name) else None}]
+        if "FROM askv_chunks c" in s:
+            return list(self._chunk_rows)
+        if "FROM askv_spans" in s:
+            return list(self.corpus.get("spans") or [])
+        if "FROM askv_synonyms" in s:
+            if "COUNT(*)" in s:
+                return [{"n": len(self.corpus["synonyms"])}]
+            wanted = {str(p).lower() for p in params}
+            out = []
+            for r in self.corpus["synonyms"]:
+                if r["term"].lower() in wanted or r["alt_term"].lower() in wanted:
+                    out.append({"term": r["term"], "alt_term": r["alt_term"], "weight": r["weight"]})
+                    if len(out) >= 1000:
+                        break
+            return out
+        raise RuntimeError(f"FakeDB: unsupported statement: {s[:120]}")
+
+
+def seed_postgres(pg_url: str, corpus: Dict[str, List[Dict[str, Any]]], page_size: int = 5000):
+    """(Re)create askv_* tables and bulk-load the corpus. Destructive by design."""
+    conn = psycopg2.connect(pg_url)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS askv_documents (id uuid PRIMARY KEY, filename text);
+                CREATE TABLE IF NOT EXISTS askv_chunks (
+                    id bigint PRIMARY KEY, doc_id uuid, chunk_index int, content text,
+                    page int, section_title text);
+                CREATE TABLE IF NOT EXISTS askv_spans (
+                    id bigint PRIMARY KEY, doc_id uuid, chunk_index int, span_index int,
+                    text text, page int, bbox float4[]);
+                CREATE TABLE IF NOT EXISTS askv_synonyms (term text, alt_term text, weight float4);
+                TRUNCATE askv_documents, askv_chunks, askv_spans, askv_synonyms;
+            """)
+            execute_values(cur, "INSERT INTO askv_documents (id, filename) VALUES %s",
+                           [(d["id"], d["filename"]) for d in corpus["documents"]], page_size=page_size)
+            execute_values(cur, f"INSERT INTO askv_chunks ({', '.join(CHUNK_COLS)}) VALUES %s",
+                           [tuple(c[k] for k in CHUNK_COLS) for c in corpus["chunks"]], page_size=page_size)
+            if corpus.get("spans"):
+                execute_values(cur, f"INSERT INTO askv_spans ({', '.join(SPAN_COLS)}) VALUES %s",
+                               [tuple(s[k] for k in SPAN_COLS) for s in corpus["spans"]], page_size=page_size)
+            execute_values(cur, "INSERT INTO askv_synonyms (term, alt_term, weight) VALUES %s",
+                           [(r["term"], r["alt_term"], r["weight"]) for r in corpus["synonyms"]],
+                           page_size=page_size)
+        conn.commit()
+    finally:
+        conn.close()
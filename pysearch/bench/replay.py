@@ -0,0 +1,156 @@
+# Replay a pysearch query log (PYSEARCH_QUERY_LOG) against a running instance
+#
+#   python -m bench.replay --log /var/log/pysearch/queries.jsonl --url http://localhost:8088 --rate 20
+#   python -m bench.replay --log queries.jsonl --url ... --speed 4          # original pacing, 4x faster
+#   python -m bench.replay --log queries.jsonl --url ... --concurrency 16   # unthrottled
+#
+# Each logged request is re-sent to the endpoint it was captured on (batch entries as
+# single /search calls). Reports p50/p95/p99 latency per endpoint plus status counts
+# (503 = shed by admission control), and optionally writes the JSON summary.
+
+import sys
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+SEARCH_FIELDS = ("k", "role", "sector", "deep", "rerank", "budget_ms", "filters")
+COMPARE_FIELDS = ("doc_ids", "criteria", "k_per_crit", "role", "sector")
+
+
+def read_log(paths: List[str]) -> List[Dict[str, Any]]:
+    out = []
+    for p in paths:
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    continue
+    out.sort(key=lambda r: r.get("ts") or 0)
+    return out
+
+
+def to_request(rec: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+    """(label, path, body) for a log record."""
+    ep = rec.get("ep") or "search"
+    if ep == "compare":
+        body = {"topic": rec.get("q") or "", **{f: rec[f] for f in COMPARE_FIELDS if f in rec}}
+        return ep, "/compare", body
+    body = {"query": rec.get("q") or "", **{f: rec[f] for f in SEARCH_FIELDS if f in rec}}
+    if ep == "search_stream":
+        return ep, "/search/stream", body
+    return "search", "/search", body
+
+
+def send(url: str, path: str, body: Dict[str, Any], timeout: float) -> int:
+    req = urllib.request.Request(url.rstrip("/") + path, data=json.dumps(body).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            r.read()  # streams are consumed to the end
+            return r.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def summarize(lat_ms: List[float]) -> Dict[str, Any]:
+    if not lat_ms:
+        return {"n": 0}
+    ms = np.array(lat_ms)
+    return {
+        "n": len(lat_ms),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="replay a pysearch query log")
+    ap.add_argument("--log", nargs="+", required=True, help="query log file(s), rotated ones included")
+    ap.add_argument("--url", default="http://localhost:8088")
+    ap.add_argument("--rate", type=float, default=0.0, help="fixed request rate (req/s); 0 = see --speed")
+    ap.add_argument("--speed", type=float, default=0.0, help="replay logged inter-arrival times / speed; 0 = unthrottled")
+    ap.add_argument("--concurrency", type=int, default=8, help="max requests in flight")
+    ap.add_argument("--limit", type=int, default=0, help="replay only the first N records")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+
+    # cursor pages reference server-side state that is gone by now
+    recs = [r for r in read_log(args.log) if r.get("ep") != "search_page"]
+    if args.limit:
+        recs = recs[:args.limit]
+    if not recs:
+        print("[replay] no records")
+        return 1
+
+    # send offsets (s) relative to the start of the replay
+    if args.rate > 0:
+        offsets = [i / args.rate for i in range(len(recs))]
+    elif args.speed > 0:
+        t0 = recs[0].get("ts") or 0
+        offsets = [max(0.0, ((r.get("ts") or t0) - t0) / args.speed) for r in recs]
+    else:
+        offsets = [0.0] * len(recs)
+
+    lat: Dict[str, List[float]] = {}
+    status: Dict[str, Dict[str, int]] = {}
+    late_ms: List[float] = []
+    lock = threading.Lock()
+
+    def one(i: int):
+        label, path, body = to_request(recs[i])
+        delay = start + offsets[i] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        t = time.perf_counter()
+        try:
+            code = str(send(args.url, path, body, args.timeout))
+        except Exception as e:
+            code = type(e).__name__
+        dt = (time.perf_counter() - t) * 1000
+        with lock:
+            late_ms.append(max(0.0, -delay * 1000))
+            st = status.setdefault(label, {})
+            st[code] = st.get(code, 0) + 1
+            if code == "200":
+                lat.setdefault(label, []).append(dt)
+
+    print(f"[replay] {len(recs)} requests -> {args.url} (concurrency={args.concurrency})")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as ex:
+        list(ex.map(one, range(len(recs))))
+    wall = time.perf_counter() - start
+
+    results = {
+        "meta": {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "url": args.url, "records": len(recs),
+                 "rate": args.rate, "speed": args.speed, "concurrency": args.concurrency},
+        "wall_s": round(wall, 3),
+        "achieved_rps": round(len(recs) / wall, 2) if wall > 0 else None,
+        # how far behind schedule sends were (client saturated when this grows)
+        "send_lag_ms": summarize(late_ms),
+        "endpoints": {ep: {**summarize(lat.get(ep, [])), "status": status[ep]} for ep in status},
+    }
+    for ep, r in results["endpoints"].items():
+        lat_s = f"p50={r['p50_ms']}ms p95={r['p95_ms']}ms p99={r['p99_ms']}ms " if r["n"] else ""
+        print(f"[replay] {ep:<14} n={r['n']} {lat_s}status={r['status']}")
+    print(f"[replay] wall={results['wall_s']}s achieved={results['achieved_rps']} req/s")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[replay] results -> {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
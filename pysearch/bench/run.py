@@ -0,0 +1,243 @@
+# pysearch benchmark runner
+#
+#   python -m bench.run --chunks 10000 --backend fake --concurrency 1,4,16 --out results.json
+#   python -m bench.run --chunks 100000 --backend pg --pg-url postgres://.../askv_bench --seed-db
+#   python -m bench.run ... --baseline previous.json --tolerance 0.15   # exit 1 on regression
+#
+# Reports build_index time + peak RSS, then p50/p95/p99 latency and throughput for
+# /search (hybrid / deep / deep+rerank) and /compare at each concurrency level.
+# The handlers are called in-process (no HTTP) so numbers isolate the retrieval pipeline.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable
+
+import numpy as np
+
+from .synth import generate_corpus, generate_queries
+from .backends import FakeDB, seed_postgres
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except Exception:
+        return float("nan")
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def load_service(backend: str, corpus, pg_url: str = None, db_latency_ms: float = 0.0, rerank: bool = False):
+    os.environ["PYSEARCH_AUTOINDEX"] = "0"
+    os.environ["PYSEARCH_RERANK"] = "1" if rerank else "0"
+    os.environ.setdefault("PYSEARCH_MAX_INFLIGHT", "0")  # bench measures the pipeline, not shedding
+    if pg_url:
+        os.environ["NEON_DATABASE_URL"] = pg_url
+    import pysearch_service as svc
+    if backend == "fake":
+        fake = FakeDB(corpus, latency_ms=db_latency_ms)
+        svc.db_query = fake.db_query
+    return svc
+
+
+def run_load(fn: Callable[[Any], Any], payloads: List[Any], concurrency: int) -> Dict[str, Any]:
+    lat = []
+    errors = []
+
+    def one(p):
+        t = time.perf_counter()
+        try:
+            fn(p)
+        except Exception as e:
+            errors.append(repr(e))
+        return time.perf_counter() - t
+
+    t0 = time.perf_counter()
+    if concurrency <= 1:
+        lat = [one(p) for p in payloads]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            lat = list(ex.map(one, payloads))
+    wall = time.perf_counter() - t0
+    ms = np.array(lat) * 1000.0
+    return {
+        "n": len(payloads),
+        "concurrency": concurrency,
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "qps": round(len(payloads) / wall, 2) if wall > 0 else None,
+        "wall_s": round(wall, 3),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def scenarios(svc, corpus, queries: List[str], rerank_available: bool):
+    """(name, fn, payloads, flags) — flags are module switches applied during the run."""
+    out = [
+        ("search_hybrid", lambda q: svc.search(svc.SearchReq(query=q, k=20)), queries,
+         {"DEEP_ON": False, "RERANK_ENABLED": False}),
+        ("search_deep", lambda q: svc.search(svc.SearchReq(query=q, k=20)), queries,
+         {"DEEP_ON": True, "RERANK_ENABLED": False}),
+    ]
+    if rerank_available:
+        out.append(("search_deep_rerank", lambda q: svc.search(svc.SearchReq(query=q, k=20)), queries,
+                    {"DEEP_ON": True, "RERANK_ENABLED": True}))
+    batches = [queries[i:i + 16] for i in range(0, len(queries), 16)]
+    out.append(("search_batch16",
+                lambda qs: svc.search_batch(svc.SearchBatchReq(requests=[svc.SearchReq(query=q, k=20) for q in qs])),
+                batches, {"DEEP_ON": True, "RERANK_ENABLED": rerank_available}))
+    doc_ids = [d["id"] for d in corpus["documents"]]
+    cmp_payloads = []
+    for i, q in enumerate(queries):
+        ids = [doc_ids[(i * 7 + j) % len(doc_ids)] for j in range(4)]
+        cmp_payloads.append(svc.CompareReq(topic=q, doc_ids=ids, k_per_crit=2))
+    out.append(("compare", lambda r: svc.compare(r), cmp_payloads,
+                {"DEEP_ON": True, "RERANK_ENABLED": False}))
+    return out
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return human-readable regressions (latency up or qps down beyond tolerance)."""
+    regressions = []
+    prev = {(r["scenario"], r["concurrency"]): r for r in baseline.get("runs", [])}
+    for r in results["runs"]:
+        b = prev.get((r["scenario"], r["concurrency"]))
+        if not b:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if b.get(key) and r[key] > b[key] * (1 + tolerance):
+                regressions.append(f"{r['scenario']}@c{r['concurrency']} {key}: {b[key]} -> {r[key]}")
+        if b.get("qps") and r.get("qps") and r["qps"] < b["qps"] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}@c{r['concurrency']} qps: {b['qps']} -> {r['qps']}")
+    bi, ri = baseline.get("index", {}), results["index"]
+    if bi.get("build_s") and ri["build_s"] > bi["build_s"] * (1 + tolerance):
+        regressions.append(f"build_index secs: {bi['build_s']} -> {ri['build_s']}")
+    if bi.get("peak_rss_mb") and ri["peak_rss_mb"] > bi["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {bi['peak_rss_mb']} -> {ri['peak_rss_mb']}")
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="pysearch retrieval benchmark")
+    ap.add_argument("--chunks", type=int, default=10000)
+    ap.add_argument("--chunks-per-doc", type=int, default=20)
+    ap.add_argument("--spans-per-chunk", type=int, default=2)
+    ap.add_argument("--dup-rate", type=float, default=0.0, help="share of near-duplicate chunks in the corpus")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--concurrency", default="1,4,16")
+    ap.add_argument("--backend", choices=["fake", "pg"], default="fake")
+    ap.add_argument("--pg-url", default=None, help="dedicated bench database (pg backend)")
+    ap.add_argument("--seed-db", action="store_true", help="truncate + load the synthetic corpus into --pg-url")
+    ap.add_argument("--db-latency-ms", type=float, default=0.0, help="simulated round-trip for FakeDB")
+    ap.add_argument("--rerank", action="store_true", help="load the cross-encoder and bench rerank")
+    ap.add_argument("--only", default=None, help="comma-separated scenario names")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default=None)
+    ap.add_argument("--baseline", default=None)
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    args = ap.parse_args(argv)
+
+    t = time.perf_counter()
+    corpus = generate_corpus(args.chunks, seed=args.seed, chunks_per_doc=args.chunks_per_doc,
+                             spans_per_chunk=args.spans_per_chunk, dup_rate=args.dup_rate)
+    queries = generate_queries(corpus, args.queries, seed=args.seed + 1)
+    gen_s = time.perf_counter() - t
+    print(f"[bench] corpus docs={len(corpus['documents'])} chunks={len(corpus['chunks'])} "
+          f"spans={len(corpus['spans'])} in {gen_s:.1f}s")
+
+    if args.backend == "pg":
+        if not args.pg_url:
+            ap.error("--backend pg requires --pg-url")
+        if args.seed_db:
+            t = time.perf_counter()
+            seed_postgres(args.pg_url, corpus)
+            print(f"[bench] seeded postgres in {time.perf_counter() - t:.1f}s")
+
+    svc = load_service(args.backend, corpus, pg_url=args.pg_url,
+                       db_latency_ms=args.db_latency_ms, rerank=args.rerank)
+
+    rss_before = rss_mb()
+    t = time.perf_counter()
+    info = svc.build_index()
+    build_s = time.perf_counter() - t
+    index = {
+        "build_s": round(build_s, 3),
+        "chunks": info.get("docs"),
+        "spans": info.get("spans"),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_after_mb": round(rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    print(f"[bench] build_index {index['build_s']}s peak_rss={index['peak_rss_mb']}MB")
+
+    rerank_available = bool(args.rerank and svc.ce_model is not None)
+    only = set(args.only.split(",")) if args.only else None
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    runs = []
+    for name, fn, payloads, flags in scenarios(svc, corpus, queries, rerank_available):
+        if only and name not in only:
+            continue
+        saved = {k: getattr(svc, k) for k in flags}
+        for k, v in flags.items():
+            setattr(svc, k, v)
+        try:
+            try:
+                fn(payloads[0])  # warm-up
+            except Exception as e:
+                print(f"[bench] {name} warm-up failed: {e!r}")
+            for c in levels:
+                r = {"scenario": name, **run_load(fn, payloads, c)}
+                runs.append(r)
+                print(f"[bench] {name:<20} c={c:<3} p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+                      f"p99={r['p99_ms']}ms qps={r['qps']} errors={r['errors']}")
+        finally:
+            for k, v in saved.items():
+                setattr(svc, k, v)
+
+    results = {
+        "meta": {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "backend": args.backend,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "rerank_model": svc.RERANK_MODEL_NAME if rerank_available else None,
+        },
+        "index": index,
+        "runs": runs,
+    }
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[bench] results -> {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"[bench] REGRESSION {r}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
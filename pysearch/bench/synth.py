@@ -0,0 +1,162 @@
+# Synthetic Ask Veeva corpus
+# Deterministic (seeded) generator shaped like the Veeva export:
+# - documents named after SOP codes (QD-SOP-######) and lines (N####-#), FR or EN
+# - chunks of FR/EN technical prose with codes sprinkled in
+# - spans = sentence-level slices of chunks (page + bbox)
+# - synonyms = FR<->EN term pairs with weights
+#
+# - dup_rate: share of chunks that are near-copies of an earlier chunk (one word changed),
+#   like the same SOP exported in several versions
+#
+# Sizes are driven by the number of chunks (10k .. 1M); everything else is derived.
+
+import random
+import uuid
+from typing import List, Dict, Any
+
+FR_WORDS = [
+    "procédure", "nettoyage", "déchets", "sécurité", "maintenance", "validation", "contrôle",
+    "vignetteuse", "format", "réglages", "ligne", "équipement", "opérateur", "responsable",
+    "enregistrement", "traçabilité", "déviation", "tolérance", "fréquence", "étape",
+    "vérifier", "remplacer", "nettoyer", "démonter", "inspecter", "documenter", "valider",
+    "machine", "produit", "lot", "étiquette", "carton", "palette", "convoyeur", "capteur",
+    "variateur", "moteur", "armoire", "tableau", "consigne", "habilitation", "risque",
+    "zone", "atex", "poussière", "solvant", "liquide", "vrac", "conditionnement", "qualité",
+]
+EN_WORDS = [
+    "procedure", "cleaning", "waste", "safety", "maintenance", "validation", "inspection",
+    "labeler", "changeover", "settings", "line", "equipment", "operator", "owner",
+    "record", "traceability", "deviation", "tolerance", "frequency", "step",
+    "check", "replace", "clean", "disassemble", "inspect", "document", "approve",
+    "machine", "product", "batch", "label", "carton", "pallet", "conveyor", "sensor",
+    "drive", "motor", "cabinet", "panel", "instruction", "training", "hazard",
+    "area", "explosive", "dust", "solvent", "liquid", "bulk", "packaging", "quality",
+]
+FR_GLUE = ["le", "la", "les", "des", "du", "de", "et", "pour", "avant", "après", "sur", "dans"]
+EN_GLUE = ["the", "and", "of", "for", "before", "after", "on", "in", "with", "to"]
+TITLES_FR = ["Objet", "Définitions", "Responsabilités", "Procédure", "Enregistrements", "Sécurité"]
+TITLES_EN = ["Scope", "Definitions", "Responsibilities", "Procedure", "Records", "Safety"]
+
+TYPO_SWAPS = [("nettoyage", "nettoyge"), ("vignetteuse", "vignetuse"), ("procédure", "procedre"),
+              ("maintenance", "maintenace"), ("validation", "valdation")]
+
+
+def _sop_code(rng: random.Random) -> str:
+    return f"QD-SOP-{rng.randint(1, 999999):06d}"
+
+
+def _line_code(rng: random.Random) -> str:
+    return f"N{rng.randint(1000, 2999)}-{rng.randint(1, 9)}"
+
+
+def _sentence(rng: random.Random, lang: str, n_words: int, codes: List[str]) -> str:
+    words = FR_WORDS if lang == "fr" else EN_WORDS
+    glue = FR_GLUE if lang == "fr" else EN_GLUE
+    out = []
+    for _ in range(n_words):
+        out.append(rng.choice(glue) if rng.random() < 0.3 else rng.choice(words))
+    if codes and rng.random() < 0.25:
+        out.insert(rng.randrange(len(out) + 1), rng.choice(codes))
+    s = " ".join(out)
+    return s[:1].upper() + s[1:] + "."
+
+
+def generate_corpus(n_chunks: int, seed: int = 42, chunks_per_doc: int = 20,
+                    spans_per_chunk: int = 2, n_synonyms: int = 200,
+                    dup_rate: float = 0.0) -> Dict[str, List[Dict[str, Any]]]:
+    """Return {"documents", "chunks", "spans", "synonyms"} row lists (askv_* shaped)."""
+    rng = random.Random(seed)
+    n_docs = max(1, n_chunks // max(1, chunks_per_doc))
+
+    documents = []
+    for _ in range(n_docs):
+        lang = "fr" if rng.random() < 0.65 else "en"
+        codes = [_sop_code(rng)]
+        if rng.random() < 0.5:
+            codes.append(_line_code(rng))
+        topic = " ".join(rng.sample(FR_WORDS if lang == "fr" else EN_WORDS, 3))
+        filename = f"{' '.join(codes)} {topic}.pdf"
+        documents.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "filename": filename,
+            "lang": lang,
+            "codes": codes,
+        })
+
+    chunks, spans = [], []
+    chunk_id, span_id = 1, 1
+    prev_sentences: List[List[str]] = []
+    for i in range(n_chunks):
+        d = documents[i % n_docs]
+        chunk_index = i // n_docs
+        titles = TITLES_FR if d["lang"] == "fr" else TITLES_EN
+        if prev_sentences and rng.random() < dup_rate:
+            sentences = list(rng.choice(prev_sentences))
+            k = rng.randrange(len(sentences))
+            words = sentences[k].split(" ")
+            words[rng.randrange(len(words))] = rng.choice(FR_WORDS if d["lang"] == "fr" else EN_WORDS)
+            sentences[k] = " ".join(words)
+        else:
+            sentences = [_sentence(rng, d["lang"], rng.randint(10, 22), d["codes"])
+                         for _ in range(rng.randint(3, 7))]
+        prev_sentences.append(sentences)
+        chunks.append({
+            "id": chunk_id,
+            "doc_id": d["id"],
+            "chunk_index": chunk_index,
+            "content": " ".join(sentences),
+            "page": 1 + chunk_index // 3,
+            "section_title": titles[chunk_index % len(titles)],
+        })
+        for si, s in enumerate(sentences[:spans_per_chunk]):
+            y = 0.1 + 0.15 * si
+            spans.append({
+                "id": span_id,
+                "doc_id": d["id"],
+                "chunk_index": chunk_index,
+                "span_index": si,
+                "text": s,
+                "page": 1 + chunk_index // 3,
+                "bbox": [0.08, round(y, 3), 0.92, round(y + 0.1, 3)],
+            })
+            span_id += 1
+        chunk_id += 1
+
+    synonyms = []
+    for j in range(n_synonyms):
+        k = j % len(FR_WORDS)
+        synonyms.append({
+            "term": FR_WORDS[k],
+            "alt_term": EN_WORDS[k] if j < len(FR_WORDS) else rng.choice(EN_WORDS),
+            "weight": round(rng.uniform(0.5, 1.0), 2),
+        })
+
+    for d in documents:
+        d.pop("lang", None)
+        d.pop("codes", None)
+    return {"documents": documents, "chunks": chunks, "spans": spans, "synonyms": synonyms}
+
+
+def generate_queries(corpus: Dict[str, List[Dict[str, Any]]], n: int, seed: int = 7) -> List[str]:
+    """Mix of FR/EN free text, code lookups, long multi-code queries and typos."""
+    rng = random.Random(seed)
+    docs = corpus["documents"]
+    out = []
+    for _ in range(n):
+        kind = rng.random()
+        if kind < 0.35:
+            q = " ".join(rng.sample(FR_WORDS, rng.randint(2, 5)))
+        elif kind < 0.55:
+            q = " ".join(rng.sample(EN_WORDS, rng.randint(2, 5)))
+        elif kind < 0.75:
+            fn = rng.choice(docs)["filename"]
+            q = fn.split(" ")[0] + " " + rng.choice(FR_WORDS)
+        elif kind < 0.90:
+            fns = [rng.choice(docs)["filename"] for _ in range(3)]
+            codes = " ".join(f.split(" ")[0] for f in fns)
+            q = f"{codes} " + " ".join(rng.sample(FR_WORDS, 8))
+        else:
+            _, typo = rng.choice(TYPO_SWAPS)
+            q = f"{typo} " + rng.choice(FR_WORDS)
+        out.append(q)
+    return out
@@ -0,0 +1,255 @@
+# pysearch relevance-vs-latency tuning harness
+#
+#   python -m bench.tune --chunks 10000 --sweep RERANK_CAND=50,100,150 --sweep MMR_LIMIT_DOC=20,40
+#   python -m bench.tune --backend pg --pg-url postgres://... --judged judged.jsonl --configs tiers.json
+#   python -m bench.tune ... --sweep COMBINE_W.bm=0.4,0.6,0.8 --objective recall@20 --cost cpu_ms
+#
+# Builds the index once (frozen), then for each configuration sets the module knobs,
+# replays the judged queries through search() and reports nDCG@k / recall@k / MRR next to
+# wall latency and CPU per query. The Pareto frontier (best quality for its cost) is printed
+# and written with --out, so a setting can be picked per deployment tier.
+#
+# Judged set (JSONL, one query per line):
+#   {"query": "...", "relevant_chunks": [12, 40]}                 # binary, chunk level
+#   {"query": "...", "relevant_chunks": {"12": 2, "40": 1}}       # graded
+#   {"query": "...", "relevant_docs": ["<uuid>", ...]}            # doc level (first hit per doc counts)
+# Without --judged, queries are synthesized from the corpus (words + code of a chunk; that
+# chunk is grade 2, the rest of its document grade 1).
+#
+# Configs (--configs, JSON list): [{"name": "tier-s", "set": {"RERANK_CAND": 60, "COMBINE_W.bm": 0.5}}]
+# --sweep KNOB=v1,v2 flags are crossed (cartesian product). "default" (no overrides) always runs.
+
+import sys
+import json
+import time
+import random
+import argparse
+import itertools
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+from .synth import generate_corpus, FR_WORDS, EN_WORDS
+from .run import load_service
+from .backends import seed_postgres
+
+
+def load_judged(path: str) -> List[Dict[str, Any]]:
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            out.append({
+                "query": rec["query"],
+                "chunks": _gains(rec.get("relevant_chunks")),
+                "docs": _gains(rec.get("relevant_docs")),
+            })
+    return out
+
+
+def _gains(rel) -> Dict[str, float]:
+    if not rel:
+        return {}
+    if isinstance(rel, dict):
+        return {str(k): float(v) for k, v in rel.items() if float(v) > 0}
+    return {str(k): 1.0 for k in rel}
+
+
+def synth_judged(corpus, n: int, seed: int = 11) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    content_words = set(FR_WORDS) | set(EN_WORDS)
+    fn_by_doc = {d["id"]: d["filename"] for d in corpus["documents"]}
+    by_doc: Dict[str, List[int]] = {}
+    for c in corpus["chunks"]:
+        by_doc.setdefault(c["doc_id"], []).append(c["id"])
+    out = []
+    for c in rng.sample(corpus["chunks"], min(n, len(corpus["chunks"]))):
+        words = [w.strip(".").lower() for w in c["content"].split()]
+        words = list(dict.fromkeys(w for w in words if w in content_words))
+        q = " ".join(rng.sample(words, min(len(words), rng.randint(3, 5))))
+        if rng.random() < 0.3:
+            q = fn_by_doc[c["doc_id"]].split(" ")[0] + " " + q
+        gains = {str(cid): 1.0 for cid in by_doc[c["doc_id"]]}
+        gains[str(c["id"])] = 2.0
+        out.append({"query": q, "chunks": gains, "docs": {}})
+    return out
+
+
+# ---------------- metrics ----------------
+def item_gains(items: List[Dict[str, Any]], judged: Dict[str, Any]) -> Tuple[List[float], Dict[str, float]]:
+    """Gains of the ranked items and the judged pool they are measured against."""
+    if judged["chunks"]:
+        pool = judged["chunks"]
+        return [pool.get(str(it.get("chunk_id")), 0.0) for it in items], pool
+    pool, seen, out = judged["docs"], set(), []
+    for it in items:
+        d = str(it.get("doc_id"))
+        out.append(0.0 if d in seen else pool.get(d, 0.0))
+        seen.add(d)
+    return out, pool
+
+
+def dcg(gains: List[float]) -> float:
+    g = np.asarray(gains, dtype=float)
+    return float(((2.0 ** g - 1.0) / np.log2(np.arange(2, len(g) + 2))).sum()) if len(g) else 0.0
+
+
+def query_metrics(items: List[Dict[str, Any]], judged: Dict[str, Any], ks: List[int]) -> Dict[str, float]:
+    gains, pool = item_gains(items, judged)
+    out = {}
+    ideal = sorted(pool.values(), reverse=True)
+    for k in ks:
+        idcg = dcg(ideal[:k])
+        out[f"ndcg@{k}"] = dcg(gains[:k]) / idcg if idcg > 0 else 0.0
+        out[f"recall@{k}"] = sum(1 for g in gains[:k] if g > 0) / len(pool) if pool else 0.0
+    first = next((i for i, g in enumerate(gains) if g > 0), None)
+    out["mrr"] = 1.0 / (first + 1) if first is not None else 0.0
+    return out
+
+
+# ---------------- configs ----------------
+def parse_value(v: str):
+    try:
+        return json.loads(v)
+    except ValueError:
+        return v
+
+
+def build_configs(sweeps: List[str], config_file: str = None) -> List[Dict[str, Any]]:
+    configs = [{"name": "default", "set": {}}]
+    if config_file:
+        with open(config_file) as f:
+            configs += json.load(f)
+    if sweeps:
+        axes = []
+        for s in sweeps:
+            knob, _, vals = s.partition("=")
+            axes.append([(knob.strip(), parse_value(v.strip())) for v in vals.split(",") if v.strip()])
+        for combo in itertools.product(*axes):
+            configs.append({"name": " ".join(f"{k}={v}" for k, v in combo), "set": dict(combo)})
+    return configs
+
+
+def apply_config(svc, overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """Set module knobs ("COMBINE_W.bm" sets one key of a dict knob); returns what to restore."""
+    saved = {}
+    for knob, v in overrides.items():
+        name, _, key = knob.partition(".")
+        if not hasattr(svc, name):
+            raise SystemExit(f"[tune] unknown knob: {name}")
+        saved.setdefault(name, getattr(svc, name))
+        if key:
+            setattr(svc, name, {**getattr(svc, name), key: float(v)})
+        else:
+            setattr(svc, name, type(saved[name])(v) if saved[name] is not None else v)
+    return saved
+
+
+def run_config(svc, judged: List[Dict[str, Any]], k: int, ks: List[int], repeat: int) -> Dict[str, Any]:
+    fields = ["chunk_id", "doc_id"]
+    wall, cpu, per_q = [], [], []
+    svc.search(svc.SearchReq(query=judged[0]["query"], k=k, fields=fields))  # warm-up
+    for rep in range(max(1, repeat)):
+        for j in judged:
+            t, c = time.perf_counter(), time.process_time()
+            resp = svc.search(svc.SearchReq(query=j["query"], k=k, fields=fields))
+            wall.append((time.perf_counter() - t) * 1000)
+            cpu.append((time.process_time() - c) * 1000)
+            if rep == 0:
+                per_q.append(query_metrics(json.loads(resp.body)["items"], j, ks))
+    ms, cpu_ms = np.array(wall), np.array(cpu)
+    quality = {m: round(float(np.mean([q[m] for q in per_q])), 4) for m in per_q[0]}
+    return {
+        **quality,
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "cpu_ms": round(float(cpu_ms.mean()), 2),
+    }
+
+
+def pareto(rows: List[Dict[str, Any]], objective: str, cost: str) -> List[Dict[str, Any]]:
+    """Configs no other config beats on both quality (higher) and cost (lower), cheapest first."""
+    front, best = [], -1.0
+    for r in sorted(rows, key=lambda r: (r[cost], -r[objective])):
+        if r[objective] > best:
+            front.append(r)
+            best = r[objective]
+    return front
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="pysearch relevance/latency tuning harness")
+    ap.add_argument("--judged", default=None, help="judged queries (JSONL); synthesized when omitted")
+    ap.add_argument("--queries", type=int, default=100, help="synthesized judged queries")
+    ap.add_argument("--chunks", type=int, default=10000)
+    ap.add_argument("--chunks-per-doc", type=int, default=20)
+    ap.add_argument("--backend", choices=["fake", "pg"], default="fake")
+    ap.add_argument("--pg-url", default=None)
+    ap.add_argument("--seed-db", action="store_true", help="truncate + load the synthetic corpus into --pg-url")
+    ap.add_argument("--rerank", action="store_true", help="load the cross-encoder (rerank knobs matter only then)")
+    ap.add_argument("--sweep", action="append", default=[], help="KNOB=v1,v2,... (repeatable, crossed)")
+    ap.add_argument("--configs", default=None, help="JSON list of {name, set}")
+    ap.add_argument("--k", type=int, default=20, help="results requested per query")
+    ap.add_argument("--ks", default="5,10,20", help="cutoffs for nDCG/recall")
+    ap.add_argument("--objective", default="ndcg@10")
+    ap.add_argument("--cost", choices=["p50_ms", "p95_ms", "mean_ms", "cpu_ms"], default="cpu_ms")
+    ap.add_argument("--repeat", type=int, default=1, help="timing passes per config")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args(argv)
+
+    ks = [int(x) for x in args.ks.split(",") if x.strip()]
+    corpus = None
+    if args.backend == "fake" or args.seed_db or not args.judged:
+        corpus = generate_corpus(args.chunks, seed=args.seed, chunks_per_doc=args.chunks_per_doc)
+    if args.backend == "pg":
+        if not args.pg_url:
+            ap.error("--backend pg requires --pg-url")
+        if args.seed_db:
+            seed_postgres(args.pg_url, corpus)
+    judged = load_judged(args.judged) if args.judged else synth_judged(corpus, args.queries, seed=args.seed + 1)
+    if not judged:
+        print("[tune] no judged queries")
+        return 1
+
+    svc = load_service(args.backend, corpus, pg_url=args.pg_url, rerank=args.rerank)
+    t = time.perf_counter()
+    svc.build_index()
+    print(f"[tune] index built in {time.perf_counter() - t:.1f}s, {len(judged)} judged queries")
+
+    rows = []
+    for cfg in build_configs(args.sweep, args.configs):
+        saved = apply_config(svc, cfg["set"])
+        try:
+            r = {"name": cfg["name"], "set": cfg["set"], **run_config(svc, judged, args.k, ks, args.repeat)}
+        finally:
+            for name, v in saved.items():
+                setattr(svc, name, v)
+        rows.append(r)
+        print(f"[tune] {r['name']:<40} {args.objective}={r[args.objective]:.4f} "
+              f"recall@{ks[-1]}={r[f'recall@{ks[-1]}']:.4f} p50={r['p50_ms']}ms cpu={r['cpu_ms']}ms")
+
+    front = pareto(rows, args.objective, args.cost)
+    print(f"[tune] pareto frontier ({args.objective} vs {args.cost}):")
+    for r in front:
+        print(f"[tune]   {r[args.cost]:>9} {args.cost}  {r[args.objective]:.4f}  {r['name']}")
+
+    if args.out:
+        results = {
+            "meta": {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args), "queries": len(judged),
+                     "rerank_model": svc.RERANK_MODEL_NAME if svc.ce_model is not None else None},
+            "configs": rows,
+            "pareto": [r["name"] for r in front],
+        }
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[tune] results -> {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,9 +3,13 @@
 # - Hybrid sparse: BM25 + TF-IDF(word 1..3) + TF-IDF(char 3..5)
 # - Domain-normalization (SOP/N####-#, IDR) + bilingual FR<->EN expansion
 # - Heuristics: filename boosts, code boosts, negative tokens, role/sector bias
+# - Typo correction: symmetric-delete (SymSpell-style) index over the corpus vocabulary
 # - Query rewriting: multi-subqueries (FR/EN, codes, variantes) + synonym DB + next_terms
+# - Near-duplicate chunks (MinHash LSH) collapsed to one indexed representative + members
+# - Vectorized scoring kernels, row-sharded on a thread pool for large corpora
 # - Two-stage MMR (doc-level then chunk-level) to maximize diversity
 # - Optional Cross-Encoder rerank (default: BAAI/bge-reranker-large, fallback to MiniLM)
+#   cascade mode (PYSEARCH_RERANK_CASCADE=1): MiniLM on the pool, bge-large on its top slice
 # - Phrase-level evidence: optional table askv_spans (span embeddings) if present
 # - /compare endpoint: builds an evidence matrix across docs (criteria planner light)
 # - Answerability guard (light): CERTAIN | PARTIAL | NR based on evidence coverage
@@ -14,31 +18,75 @@
 #
 # Endpoints:
 #   GET  /health
+#   GET  /metrics  (Prometheus: per-stage histograms + corpus/cache/rerank gauges)
+#   GET  /profiles/{name}  (admin: download a stored profile artifact)
 #   POST /reindex
-#   POST /search {query,k,role,sector,rerank,deep,next_terms?}
-#   POST /compare {topic, doc_ids[], criteria?, k_per_crit?, role?, sector?}
+#   POST /search {query,k,role,sector,rerank,deep,next_terms?,filters?,budget_ms?,debug_timings?,spell?,expand_duplicates?,
+#                 fields?,snippet_len?,debug?}
+#        fields/snippet_len project each item; `_`-prefixed internals only with debug=true
+#        filters = {doc_ids?, filename_prefix?, filename_regex?, codes?, sector?} (AND; scored rows only)
+#        paginate=true: the response carries `cursor` (null when exhausted); POST /search {cursor, k?}
+#        returns the next page from the server-side ranked list (410 once expired/reindexed)
+#   POST /search/stream  (same body; NDJSON events: hybrid -> ranked -> evidence* -> done)
+#   POST /search/batch {requests: [SearchReq...]} -> {results: [/search payload...]}
+#        (cursor, paginate and budget_ms are per-request features of /search: 422 here)
+#   GET  /suggest?q=&limit=&kinds=code,file,term  (prefix autocomplete, no scoring)
+#   POST /compare {topic, doc_ids[], criteria?, k_per_crit?, role?, sector?, debug_timings?, debug?}
+#
+# Admission control: /search, /search/stream, /search/batch and /compare share a bounded
+# number of in-flight slots (PYSEARCH_MAX_INFLIGHT) with a short wait queue; when the queue
+# is full or the wait times out they answer 503 + Retry-After instead of piling up.
+# /reindex has its own class. Responses carry queue_wait_ms.
+#
+# Query log (opt-in): PYSEARCH_QUERY_LOG=/path/queries.jsonl appends one anonymized,
+# normalized JSON line per /search, /search/stream, /search/batch entry, cursor page
+# (ep=search_page, not replayed) and /compare (params + latency, no client info), rotated by size. `python -m bench.replay` re-runs a
+# log against an instance; PYSEARCH_WARMUP_N replays the N most frequent logged queries
+# after each index build; /health answers 503 until the startup warm-up is finished (a
+# /reindex warm-up keeps it at 200 and only reports the warming state in the body).
+#
+# Profiling (opt-in, admin only): set PYSEARCH_PROFILE_TOKEN, then send
+#   X-Pysearch-Profile: <token>   and   ?profile=cprofile|sample
+# on /search or /compare. The artifact (.pstats or collapsed stacks for flamegraph.pl /
+# speedscope) is stored under PYSEARCH_PROFILE_DIR and summarized in the response.
+# Only the handler thread is profiled (shard pool workers are not). cProfile is
+# process-global, so one cprofile request runs at a time; a concurrent one gets 409.
 #
 # Launch:
 #   uvicorn pysearch_service:app --host 0.0.0.0 --port 8088
 # Or:
 #   python pysearch_service.py
 
-import os, re, json, time, math
+import os, re, json, time, math, random
+import sys, uuid, zlib, bisect, base64, secrets, threading, contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional, Tuple
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, FileResponse, StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
 from unidecode import unidecode
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import OSA
 from rank_bm25 import BM25Okapi
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 import numpy as np
+from scipy.special import expit
+
+# Fast JSON for the heavy endpoints (optional)
+try:
+    import orjson as ORJSON
+except Exception as e:
+    print(f"[pysearch] WARN: orjson unavailable, stdlib json responses ({e})")
+    ORJSON = None
 
 # ---------------- Config / env ----------------
 PG_URL = os.getenv("NEON_DATABASE_URL") or os.getenv("DATABASE_URL")
@@ -46,6 +94,12 @@ PG_URL = os.getenv("NEON_DATABASE_URL") or os.getenv("DATABASE_URL")
 TOPK_DEFAULT = int(os.getenv("PYSEARCH_TOPK", "60"))
 DEEP_ON = os.getenv("PYSEARCH_DEEP", "1").strip().lower() not in ("0","false","no")
 
+# Hybrid scoring: combine_scores weights (bm25 / tfidf word / tfidf char are z-scored first)
+# and the cap on generated sub-queries. Tuned offline with bench.tune.
+COMBINE_W = dict(zip(("bm", "tfw", "tfc", "fname", "code", "fuzzy"),
+                     (float(x) for x in os.getenv("PYSEARCH_COMBINE_W", "0.60,0.56,0.22,1,1,0.5").split(","))))
+SUBQ_MAX = int(os.getenv("PYSEARCH_SUBQ_MAX", "10"))
+
 # Cross-Encoder rerank
 RERANK_ENABLED = os.getenv("PYSEARCH_RERANK", "1").strip().lower() not in ("0","false","no")
 DEFAULT_RERANK_MODEL = "BAAI/bge-reranker-large"
@@ -55,16 +109,95 @@ RERANK_CAND = int(os.getenv("PYSEARCH_RERANK_CAND", "150"))
 RERANK_KEEP = int(os.getenv("PYSEARCH_RERANK_KEEP", "80"))
 RERANK_ALPHA = float(os.getenv("PYSEARCH_RERANK_ALPHA", "0.85"))  # blend CE vs hybrid
 
+# Latency budget (0 = unlimited). Per request via SearchReq.budget_ms, else this default.
+# The pipeline degrades step by step: fewer sub-queries, smaller rerank pool,
+# small CE model instead of the large one, no span coverage/evidence.
+BUDGET_MS_DEFAULT = float(os.getenv("PYSEARCH_BUDGET_MS", "0"))
+BUDGET_SUBQ_SHARE = float(os.getenv("PYSEARCH_BUDGET_SUBQ_SHARE", "0.5"))      # sub-queries stop past this share
+BUDGET_COVERAGE_SHARE = float(os.getenv("PYSEARCH_BUDGET_COVERAGE_SHARE", "0.6"))
+BUDGET_EVIDENCE_SHARE = float(os.getenv("PYSEARCH_BUDGET_EVIDENCE_SHARE", "0.9"))
+BUDGET_MIN_POOL = int(os.getenv("PYSEARCH_BUDGET_MIN_POOL", "20"))             # below this, a tier is not worth it
+RERANK_SMALL_ON = os.getenv("PYSEARCH_RERANK_SMALL", "1" if BUDGET_MS_DEFAULT > 0 else "0").strip().lower() not in ("0","false","no")
+
+# Cascade rerank: the small CE scores the whole pool, the main (large) CE only its top
+# CASCADE_TOP; there the two are blended (CASCADE_BLEND = weight of the large model)
+RERANK_CASCADE = os.getenv("PYSEARCH_RERANK_CASCADE", "0").strip().lower() not in ("0","false","no")
+CASCADE_TOP = int(os.getenv("PYSEARCH_CASCADE_TOP", "24"))
+CASCADE_BLEND = float(os.getenv("PYSEARCH_CASCADE_BLEND", "0.7"))
+
 # MMR diversification
 MMR_LAMBDA_DOC = float(os.getenv("PYSEARCH_MMR_LAMBDA_DOC", "0.75"))
 MMR_LAMBDA_CHUNK = float(os.getenv("PYSEARCH_MMR_LAMBDA_CHUNK", "0.70"))
 MMR_LIMIT_DOC = int(os.getenv("PYSEARCH_MMR_LIMIT_DOC", "40"))
 MMR_LIMIT_CHUNK = int(os.getenv("PYSEARCH_MMR_LIMIT_CHUNK", "24"))
 
+# Intra-query sharding: corpus rows split into contiguous shards scored in parallel
+# (sparse kernels release the GIL). Corpora smaller than SHARD_MIN_ROWS stay unsharded.
+SHARDS = int(os.getenv("PYSEARCH_SHARDS", str(min(8, os.cpu_count() or 1))))
+SHARD_MIN_ROWS = int(os.getenv("PYSEARCH_SHARD_MIN_ROWS", "20000"))
+
+# Cursor pagination (opt-in per request, SearchReq.paginate): /search keeps its first-stage pool
+# (PAGE_POOL items) and ranked list server-side for PAGE_TTL_S; follow-up pages slice it and
+# rerank further only past its end
+PAGE_TTL_S = float(os.getenv("PYSEARCH_PAGE_TTL_S", "300"))   # 0 = no cursors
+PAGE_POOL = int(os.getenv("PYSEARCH_PAGE_POOL", "200"))
+PAGE_CACHE_MAX = int(os.getenv("PYSEARCH_PAGE_CACHE_MAX", "256"))            # open cursors (LRU by creation)
+
+# Near-duplicate chunks (SOP versions, boilerplate headers): MinHash over token 3-shingles, LSH
+# banding, clusters at estimated Jaccard >= threshold keep one indexed row, across documents;
+# filters still see every member's doc/codes/filename (0 = disabled)
+DEDUP_THRESHOLD = float(os.getenv("PYSEARCH_DEDUP_THRESHOLD", "0.9"))
+DEDUP_PERM = int(os.getenv("PYSEARCH_DEDUP_PERM", "128"))
+DEDUP_SHINGLE = int(os.getenv("PYSEARCH_DEDUP_SHINGLE", "3"))
+
+# Sub-query planner: variants with the same token multiset are scored once (weights summed);
+# expansions whose added terms carry < PLAN_MIN_IDF_SHARE of the query's IDF mass are
+# folded into the original query instead of costing a corpus pass
+PLAN_ON = os.getenv("PYSEARCH_PLAN", "1").strip().lower() not in ("0","false","no")
+PLAN_MIN_IDF_SHARE = float(os.getenv("PYSEARCH_PLAN_MIN_IDF_SHARE", "0.1"))
+
+# Spelling correction (symmetric delete over the BM25 vocabulary)
+SPELL_ON = os.getenv("PYSEARCH_SPELL", "1").strip().lower() not in ("0","false","no")
+SPELL_MAX_EDIT = int(os.getenv("PYSEARCH_SPELL_MAX_EDIT", "2"))    # tokens of <= 5 chars use 1
+SPELL_PREFIX = int(os.getenv("PYSEARCH_SPELL_PREFIX", "7"))        # deletes generated on this prefix only
+SPELL_MIN_DF = int(os.getenv("PYSEARCH_SPELL_MIN_DF", "2"))        # dictionary terms: seen in >= N chunks
+SPELL_RARE_DF = int(os.getenv("PYSEARCH_SPELL_RARE_DF", "2"))      # known tokens below this may get an expansion
+SPELL_EXPAND_RATIO = float(os.getenv("PYSEARCH_SPELL_EXPAND_RATIO", "20"))  # ... if a 1-edit term is N x more frequent
+
+# /suggest (prefix autocomplete)
+SUGGEST_TERMS_MAX = int(os.getenv("PYSEARCH_SUGGEST_TERMS_MAX", "20000"))  # most frequent vocabulary terms kept
+SUGGEST_LIMIT_MAX = int(os.getenv("PYSEARCH_SUGGEST_LIMIT_MAX", "20"))
+SUGGEST_HEAD_LEN = 2                      # prefixes up to this length answer from a precomputed top list
+
+# /search/batch
+BATCH_MAX = int(os.getenv("PYSEARCH_BATCH_MAX", "256"))
+
 # Evidence / spans
 USE_SPANS = os.getenv("PYSEARCH_USE_SPANS", "1").strip().lower() not in ("0","false","no")
 SPANS_TOP = int(os.getenv("PYSEARCH_SPANS_TOP", "3"))
 
+# Admission control (0 in-flight = unlimited)
+ADMIT_MAX_INFLIGHT = int(os.getenv("PYSEARCH_MAX_INFLIGHT", str(min(4, os.cpu_count() or 1))))
+ADMIT_QUEUE_MAX = int(os.getenv("PYSEARCH_QUEUE_MAX", str(2 * ADMIT_MAX_INFLIGHT)))
+ADMIT_QUEUE_TIMEOUT_MS = float(os.getenv("PYSEARCH_QUEUE_TIMEOUT_MS", "2000"))
+ADMIT_RETRY_AFTER_S = int(os.getenv("PYSEARCH_RETRY_AFTER_S", "1"))
+REINDEX_MAX_INFLIGHT = int(os.getenv("PYSEARCH_REINDEX_MAX_INFLIGHT", "1"))
+REINDEX_QUEUE_MAX = int(os.getenv("PYSEARCH_REINDEX_QUEUE_MAX", "0"))
+
+# Query log + warm-up (disabled unless a path is configured)
+QUERY_LOG_PATH = os.getenv("PYSEARCH_QUERY_LOG", "").strip()
+QUERY_LOG_MAX_MB = float(os.getenv("PYSEARCH_QUERY_LOG_MAX_MB", "50"))
+QUERY_LOG_KEEP = int(os.getenv("PYSEARCH_QUERY_LOG_KEEP", "5"))          # rotated files kept
+QUERY_LOG_SAMPLE = float(os.getenv("PYSEARCH_QUERY_LOG_SAMPLE", "1.0"))
+WARMUP_N = int(os.getenv("PYSEARCH_WARMUP_N", "0"))
+WARMUP_LOG = os.getenv("PYSEARCH_WARMUP_LOG", QUERY_LOG_PATH).strip()
+
+# On-demand profiling (disabled unless a token is configured)
+PROFILE_TOKEN = os.getenv("PYSEARCH_PROFILE_TOKEN", "").strip()
+PROFILE_DIR = os.getenv("PYSEARCH_PROFILE_DIR", "/tmp/pysearch_profiles")
+PROFILE_SAMPLE_MS = float(os.getenv("PYSEARCH_PROFILE_SAMPLE_MS", "2"))
+PROFILE_KEEP = int(os.getenv("PYSEARCH_PROFILE_KEEP", "50"))
+
 # Anticipation (+1 tour light) – can be disabled
 PREDICT_NEXT_ON = os.getenv("PYSEARCH_PREDICT_NEXT", "1").strip().lower() not in ("0","false","no")
 
@@ -134,9 +267,454 @@ if RERANK_ENABLED:
         ce_model = None
         RERANK_ENABLED = False
 
+# Small CE kept warm as the budget fallback / cascade first tier when the main model is the large one
+ce_small = None
+CE_SMALL_LOGITS = True  # small model returns raw logits (ms-marco MiniLM: Identity activation)
+if RERANK_CASCADE and RERANK_ENABLED and ce_model is not None and RERANK_MODEL_NAME == FALLBACK_RERANK_MODEL:
+    print("[pysearch] WARN: cascade rerank disabled (main model is already the small one)")
+    RERANK_CASCADE = False
+if RERANK_ENABLED and ce_model is not None and (RERANK_SMALL_ON or RERANK_CASCADE) and RERANK_MODEL_NAME != FALLBACK_RERANK_MODEL:
+    try:
+        ce_small = CrossEncoder(FALLBACK_RERANK_MODEL, device=ce_device)
+        act = getattr(ce_small, "default_activation_function", None)
+        CE_SMALL_LOGITS = act is None or type(act).__name__ == "Identity"
+        print(f"[pysearch] Cross-encoder (small): {FALLBACK_RERANK_MODEL} on {ce_device}")
+    except Exception as e:
+        print(f"[pysearch] WARN: small cross-encoder unavailable ({e})")
+        ce_small = None
+        RERANK_CASCADE = False
+
 if not PG_URL:
     print("[pysearch] WARN: no Postgres URL in NEON_DATABASE_URL/DATABASE_URL")
 
+# ---------------- Timings / metrics ----------------
+# Every pipeline stage runs inside `with timed("stage"):`. Durations feed a Prometheus
+# histogram (if prometheus_client is installed) and the per-request breakdown that
+# /search and /compare return when `debug_timings` is set.
+METRICS_ON = os.getenv("PYSEARCH_METRICS", "1").strip().lower() not in ("0","false","no")
+PROM = None
+if METRICS_ON:
+    try:
+        import prometheus_client as PROM
+        _LAT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 120)
+        M_STAGE = PROM.Histogram("pysearch_stage_seconds", "Time spent per pipeline stage", ["stage"], buckets=_LAT_BUCKETS)
+        M_REQUEST = PROM.Histogram("pysearch_request_seconds", "End-to-end handler time", ["endpoint"], buckets=_LAT_BUCKETS)
+        M_CHUNKS = PROM.Gauge("pysearch_corpus_chunks", "Chunks in the RAM index")
+        M_SPANS = PROM.Gauge("pysearch_corpus_spans", "Spans in the RAM index")
+        M_DOCS = PROM.Gauge("pysearch_corpus_docs", "Distinct documents in the RAM index")
+        M_INDEX_GEN = PROM.Gauge("pysearch_index_generation", "Incremented on every successful build_index()")
+        M_INDEX_SECS = PROM.Gauge("pysearch_index_build_seconds", "Duration of the last build_index()")
+        M_CACHE_HIT = PROM.Gauge("pysearch_cache_hit_ratio", "Hit ratio per cache since start", ["cache"])
+        M_RERANK_DEPTH = PROM.Gauge("pysearch_rerank_queue_depth", "Cross-encoder batches in flight or waiting")
+        M_QUEUE_WAIT = PROM.Histogram("pysearch_queue_wait_seconds", "Admission queue wait", ["cls"], buckets=_LAT_BUCKETS)
+        M_INFLIGHT = PROM.Gauge("pysearch_inflight", "Admitted requests in flight", ["cls"])
+        M_QUEUED = PROM.Gauge("pysearch_queued", "Requests waiting for admission", ["cls"])
+        M_REJECTED = PROM.Counter("pysearch_rejected_total", "Requests shed with 503", ["cls"])
+        M_DEGRADE = PROM.Counter("pysearch_degradations_total", "Budget-driven degradations applied", ["step"])
+    except Exception as e:
+        print(f"[pysearch] WARN: prometheus metrics disabled ({e})")
+        PROM = None
+
+_REQ_TIMINGS: contextvars.ContextVar = contextvars.ContextVar("pysearch_req_timings", default=None)
+
+class timed:
+    """Stage timer: Prometheus histogram + per-request accumulator (ms, calls)."""
+    __slots__ = ("name", "t0")
+    def __init__(self, name: str):
+        self.name = name
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t0
+        if PROM is not None:
+            M_STAGE.labels(self.name).observe(dt)
+        acc = _REQ_TIMINGS.get()
+        if acc is not None:
+            e = acc.get(self.name)
+            if e is None: acc[self.name] = [dt, 1]
+            else: e[0] += dt; e[1] += 1
+        return False
+
+class request_timer:
+    """Request scope: collects stage timings of the current handler."""
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.stages: Dict[str, List[float]] = {}
+        self.total = 0.0
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self._tok = _REQ_TIMINGS.set(self.stages)
+        return self
+    def __exit__(self, *exc):
+        self.total = time.perf_counter() - self.t0
+        _REQ_TIMINGS.reset(self._tok)
+        if PROM is not None:
+            M_REQUEST.labels(self.endpoint).observe(self.total)
+        return False
+    def report(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(self.total * 1000, 3),
+            "stages": {k: {"ms": round(v[0] * 1000, 3), "calls": int(v[1])} for k, v in self.stages.items()},
+        }
+
+_CACHE_STATS: Dict[str, List[int]] = {}  # cache -> [hits, lookups]
+
+def cache_lookup(cache: str, hit: bool):
+    st = _CACHE_STATS.setdefault(cache, [0, 0])
+    st[0] += int(hit); st[1] += 1
+    if PROM is not None:
+        M_CACHE_HIT.labels(cache).set(st[0] / st[1])
+
+def cache_stats() -> Dict[str, Any]:
+    return {c: {"hits": h, "lookups": n, "hit_ratio": round(h / n, 3) if n else None}
+            for c, (h, n) in _CACHE_STATS.items()}
+
+# ---------------- Admission control ----------------
+class Overloaded(Exception):
+    pass
+
+class Admission:
+    """Bounded in-flight slots + bounded FIFO wait queue for one request class."""
+    def __init__(self, cls: str, limit: int, queue: int, timeout_ms: float):
+        self.cls = cls
+        self.limit = limit
+        self.queue = max(0, queue)
+        self.timeout = max(0.0, timeout_ms) / 1000.0
+        self.cv = threading.Condition()
+        self.inflight = 0
+        self.line: deque = deque()   # waiter tickets in arrival order; only the head may take a slot
+        self.rejected = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self.line)
+
+    def _gauges(self):
+        if PROM is not None:
+            M_INFLIGHT.labels(self.cls).set(self.inflight)
+            M_QUEUED.labels(self.cls).set(self.waiting)
+
+    def _reject(self, why: str):
+        self.rejected += 1
+        if PROM is not None: M_REJECTED.labels(self.cls).inc()
+        raise Overloaded(why)
+
+    def acquire(self) -> float:
+        """Take a slot; returns the queue wait in ms or raises Overloaded."""
+        if self.limit <= 0:
+            return 0.0
+        t0 = time.perf_counter()
+        with self.cv:
+            # newcomers queue behind existing waiters; slots go to the head of the line
+            if self.inflight >= self.limit or self.line:
+                if len(self.line) >= self.queue:
+                    self._reject("queue full")
+                ticket = object()
+                self.line.append(ticket)
+                self._gauges()
+                try:
+                    deadline = t0 + self.timeout
+                    while self.line[0] is not ticket or self.inflight >= self.limit:
+                        rem = deadline - time.perf_counter()
+                        if rem <= 0:
+                            self._reject("queue timeout")
+                        self.cv.wait(rem)
+                finally:
+                    self.line.remove(ticket)
+                    self.cv.notify_all()   # the new head may be able to go (spare slot or our timeout)
+            self.inflight += 1
+            self._gauges()
+        wait = time.perf_counter() - t0
+        if PROM is not None: M_QUEUE_WAIT.labels(self.cls).observe(wait)
+        return round(wait * 1000, 3)
+
+    def release(self):
+        if self.limit <= 0:
+            return
+        with self.cv:
+            self.inflight -= 1
+            self._gauges()
+            self.cv.notify_all()   # waiters re-check whether they are now the head
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "queue": self.queue, "inflight": self.inflight,
+                "waiting": self.waiting, "rejected": self.rejected}
+
+# admission class override for the current context (warm-up runs handlers in its own class)
+_ADMIT_AS: contextvars.ContextVar = contextvars.ContextVar("pysearch_admit_as", default=None)
+
+class admitted:
+    """`with admitted(ADMIT_SEARCH) as adm:` -> adm.wait_ms; sheds with 503 + Retry-After."""
+    def __init__(self, ctl: Admission):
+        self.ctl = _ADMIT_AS.get() or ctl
+        self.wait_ms = 0.0
+        self._held = False
+    def __enter__(self):
+        try:
+            self.wait_ms = self.ctl.acquire()
+        except Overloaded as e:
+            raise HTTPException(status_code=503, detail=f"pysearch overloaded ({self.ctl.cls}: {e})",
+                                headers={"Retry-After": str(ADMIT_RETRY_AFTER_S)})
+        self._held = True
+        return self
+    def release(self):
+        if self._held:
+            self._held = False
+            self.ctl.release()
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+ADMIT_SEARCH = Admission("search", ADMIT_MAX_INFLIGHT, ADMIT_QUEUE_MAX, ADMIT_QUEUE_TIMEOUT_MS)
+ADMIT_REINDEX = Admission("reindex", REINDEX_MAX_INFLIGHT, REINDEX_QUEUE_MAX, ADMIT_QUEUE_TIMEOUT_MS)
+# warm-up replays sequentially in one slot of its own: never takes interactive slots, never shed
+ADMIT_WARMUP = Admission("warmup", 1, 0, 0)
+
+# ---------------- Responses ----------------
+def json_response(obj: Dict[str, Any]) -> Response:
+    """Serialize once, bypassing FastAPI's jsonable_encoder (orjson when installed)."""
+    if ORJSON is not None:
+        return Response(ORJSON.dumps(obj, option=ORJSON.OPT_SERIALIZE_NUMPY | ORJSON.OPT_NON_STR_KEYS, default=str),
+                        media_type="application/json")
+    return JSONResponse(obj)
+
+def project_items(items: List[Dict[str, Any]], fields: Optional[List[str]] = None,
+                  snippet_len: Optional[int] = None, debug: bool = False) -> List[Dict[str, Any]]:
+    """Keep only `fields` (all if None), cut snippets to `snippet_len` (0 drops them) and drop
+    `_`-prefixed internals (_coverage, _score_ce, ...) unless debugging."""
+    keep = set(fields) if fields else None
+    out = []
+    for it in items:
+        d = {k: v for k, v in it.items() if (debug or not k.startswith("_")) and (keep is None or k in keep)}
+        if snippet_len is not None and "snippet" in d:
+            if snippet_len <= 0: d.pop("snippet")
+            else: d["snippet"] = (d["snippet"] or "")[:snippet_len]
+        out.append(d)
+    return out
+
+def _strip_internal(obj: Any) -> Any:
+    """Recursively drop `_`-prefixed keys (nested payloads such as the /compare matrix)."""
+    if isinstance(obj, dict):
+        return {k: _strip_internal(v) for k, v in obj.items() if not (isinstance(k, str) and k.startswith("_"))}
+    if isinstance(obj, list):
+        return [_strip_internal(v) for v in obj]
+    return obj
+
+# ---------------- Query log + warm-up ----------------
+QLOG = None
+if QUERY_LOG_PATH:
+    try:
+        import logging, logging.handlers
+        os.makedirs(os.path.dirname(QUERY_LOG_PATH) or ".", exist_ok=True)
+        QLOG = logging.getLogger("pysearch.querylog")
+        QLOG.setLevel(logging.INFO)
+        QLOG.propagate = False
+        _qh = logging.handlers.RotatingFileHandler(QUERY_LOG_PATH, maxBytes=int(QUERY_LOG_MAX_MB * 1e6),
+                                                   backupCount=QUERY_LOG_KEEP, encoding="utf-8")
+        _qh.setFormatter(logging.Formatter("%(message)s"))
+        QLOG.addHandler(_qh)
+    except Exception as e:
+        print(f"[pysearch] WARN: query log disabled ({e})")
+        QLOG = None
+
+_QLOG_MUTE: contextvars.ContextVar = contextvars.ContextVar("pysearch_qlog_mute", default=False)
+RE_EMAIL = re.compile(r"\b[\w.+-]+@[\w-]+\.[\w.-]+\b")
+RE_LONGNUM = re.compile(r"(?<![\w-])\+?\d[\d .]{8,}\d(?![\w-])")   # phone-like runs (codes keep their prefix)
+
+def anonymize_query(q: str) -> str:
+    return norm(RE_LONGNUM.sub("<num>", RE_EMAIL.sub("<email>", q or "")))
+
+def log_query(endpoint: str, fields: Dict[str, Any], ms: float, n: int):
+    """One JSON line per request; None fields are dropped. No-op unless PYSEARCH_QUERY_LOG is set."""
+    if QLOG is None or _QLOG_MUTE.get():
+        return
+    if QUERY_LOG_SAMPLE < 1.0 and random.random() >= QUERY_LOG_SAMPLE:
+        return
+    rec = {"ts": round(time.time(), 3), "ep": endpoint, **{k: v for k, v in fields.items() if v is not None},
+           "ms": round(ms, 3), "n": n}
+    QLOG.info(json.dumps(rec, ensure_ascii=False, default=str))
+
+def search_log_fields(req: "SearchReq") -> Dict[str, Any]:
+    return {"q": anonymize_query(req.query), "k": req.k, "role": req.role, "sector": req.sector,
+            "deep": req.deep, "rerank": req.rerank, "budget_ms": req.budget_ms,
+            "filters": req.filters.model_dump(exclude_none=True) if req.filters is not None else None}
+
+def read_query_log(path: str) -> List[Dict[str, Any]]:
+    """Records from a query log and its rotated siblings (oldest first); bad lines skipped."""
+    paths = [f"{path}.{i}" for i in range(QUERY_LOG_KEEP, 0, -1)] + [path]
+    out = []
+    for p in paths:
+        if not os.path.exists(p): continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    continue
+    return out
+
+def top_logged_queries(records: List[Dict[str, Any]], n: int) -> List[Dict[str, Any]]:
+    """Most frequent distinct requests (same endpoint + params), most frequent first."""
+    counts: Dict[str, List] = {}
+    for r in records:
+        key = json.dumps({k: v for k, v in r.items() if k not in ("ts", "ms", "n")}, sort_keys=True)
+        e = counts.setdefault(key, [0, r])
+        e[0] += 1
+    return [r for _c, r in sorted(counts.values(), key=lambda e: -e[0])[:n]]
+
+WARM: Dict[str, Any] = {"state": "off", "trigger": None, "done": 0, "total": 0, "errors": 0, "secs": None}
+
+def warm_up(n: int = WARMUP_N, path: str = WARMUP_LOG):
+    """Replay the top-n logged queries in-process (fills caches, loads CE weights into cache/RAM)."""
+    t0 = time.time()
+    tok = _QLOG_MUTE.set(True)
+    adm_tok = _ADMIT_AS.set(ADMIT_WARMUP)
+    try:
+        # cursor fetches can't be replayed (their first page is logged as "search")
+        recs = top_logged_queries([r for r in read_query_log(path) if r.get("ep") != "search_page"], n) if path else []
+        WARM.update(state="running", done=0, total=len(recs), errors=0)
+        for r in recs:
+            try:
+                if r.get("ep") == "compare":
+                    compare(CompareReq(topic=r.get("q") or "", doc_ids=r.get("doc_ids") or [],
+                                       criteria=r.get("criteria"), k_per_crit=r.get("k_per_crit")))
+                else:
+                    search(SearchReq(query=r.get("q") or "", k=r.get("k"), role=r.get("role"), sector=r.get("sector"),
+                                     deep=r.get("deep"), rerank=r.get("rerank"), filters=r.get("filters")))
+            except Exception:
+                WARM["errors"] += 1
+            WARM["done"] += 1
+        WARM["state"] = "done"
+    except Exception as e:
+        print(f"[pysearch] WARN: warm-up failed: {e}")
+        WARM["state"] = "failed"
+    finally:
+        _QLOG_MUTE.reset(tok)
+        _ADMIT_AS.reset(adm_tok)
+        WARM["secs"] = round(time.time() - t0, 3)
+        print(f"[pysearch] warm-up {WARM['state']}: {WARM['done']}/{WARM['total']} queries in {WARM['secs']}s")
+
+def start_warm_up(trigger: str = "startup"):
+    """trigger: "startup" (instance not ready until done) or "reindex" (serving, just colder)"""
+    if WARMUP_N <= 0 or not WARMUP_LOG:
+        return
+    WARM.update(state="pending", trigger=trigger, done=0, total=0, errors=0, secs=None)
+    threading.Thread(target=warm_up, name="pysearch-warmup", daemon=True).start()
+
+# ---------------- Profiling (opt-in) ----------------
+class _NoProfile:
+    active = False
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+    def attach(self, out: Dict[str, Any]): pass
+
+NO_PROFILE = _NoProfile()
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack every PROFILE_SAMPLE_MS -> collapsed stacks."""
+    def __init__(self, target_tid: int, interval_s: float):
+        super().__init__(daemon=True)
+        self.tid = target_tid
+        self.interval = max(0.0005, interval_s)
+        self.stop_evt = threading.Event()
+        self.counts: Dict[str, int] = {}
+        self.samples = 0
+    def run(self):
+        while not self.stop_evt.wait(self.interval):
+            f = sys._current_frames().get(self.tid)
+            if f is None: continue
+            stack = []
+            while f is not None:
+                co = f.f_code
+                stack.append(f"{co.co_name} ({os.path.basename(co.co_filename)}:{f.f_lineno})")
+                f = f.f_back
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+_CPROFILE_LOCK = threading.Lock()   # one cProfile session per process (sys.monitoring on 3.12+)
+
+class _Profile:
+    """Runs the wrapped handler under cProfile (deterministic) or the stack sampler.
+    Either way only the handler thread is observed, not the shard pool workers."""
+    active = True
+    def __init__(self, endpoint: str, mode: str):
+        self.endpoint = endpoint
+        self.mode = mode
+        self.name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}"
+        self.summary: Dict[str, Any] = {}
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        if self.mode == "sample":
+            self.sampler = _StackSampler(threading.get_ident(), PROFILE_SAMPLE_MS / 1000.0)
+            self.sampler.start()
+        else:
+            import cProfile
+            if not _CPROFILE_LOCK.acquire(blocking=False):
+                raise HTTPException(status_code=409, detail="a cprofile run is already in progress; retry or use ?profile=sample")
+            try:
+                self.prof = cProfile.Profile()
+                self.prof.enable()
+            except Exception as e:  # another profiler owns the hooks
+                _CPROFILE_LOCK.release()
+                raise HTTPException(status_code=409, detail=f"cprofile unavailable: {e}")
+        return self
+    def __exit__(self, *exc):
+        wall_ms = round((time.perf_counter() - self.t0) * 1000, 3)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if self.mode == "sample":
+            self.sampler.stop_evt.set()
+            self.sampler.join()
+            path = os.path.join(PROFILE_DIR, self.name + ".collapsed")
+            with open(path, "w") as f:
+                for stack, n in sorted(self.sampler.counts.items(), key=lambda x: -x[1]):
+                    f.write(f"{stack} {n}\n")
+            leaf: Dict[str, int] = {}
+            for stack, n in self.sampler.counts.items():
+                fr = stack.rsplit(";", 1)[-1]
+                leaf[fr] = leaf.get(fr, 0) + n
+            top = sorted(leaf.items(), key=lambda x: -x[1])[:15]
+            self.summary = {"samples": self.sampler.samples,
+                            "top_self": [{"frame": fr, "samples": n} for fr, n in top]}
+        else:
+            import pstats
+            self.prof.disable()
+            _CPROFILE_LOCK.release()
+            path = os.path.join(PROFILE_DIR, self.name + ".pstats")
+            self.prof.dump_stats(path)
+            st = pstats.Stats(self.prof)
+            rows = sorted(st.stats.items(), key=lambda kv: -kv[1][3])[:15]  # by cumulative time
+            self.summary = {"top_cumulative": [
+                {"func": f"{fn} ({os.path.basename(file)}:{line})", "calls": nc, "cum_ms": round(ct * 1000, 3),
+                 "self_ms": round(tt * 1000, 3)}
+                for (file, line, fn), (_cc, nc, tt, ct, _callers) in rows]}
+        self.summary.update({"mode": self.mode, "artifact": os.path.basename(path), "wall_ms": wall_ms})
+        _prune_profiles()
+        return False
+    def attach(self, out: Dict[str, Any]):
+        out["profile"] = self.summary
+
+def _prune_profiles():
+    try:
+        files = sorted((os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR)), key=os.path.getmtime)
+        for f in files[:-PROFILE_KEEP]:
+            os.remove(f)
+    except Exception:
+        pass
+
+def _profile_authorized(request: Request) -> bool:
+    return bool(PROFILE_TOKEN) and request.headers.get("x-pysearch-profile") == PROFILE_TOKEN
+
+def profile_scope(request: Request, endpoint: str):
+    """NO_PROFILE unless a token is configured AND the admin header + ?profile= are present."""
+    if not PROFILE_TOKEN or request is None:
+        return NO_PROFILE
+    mode = request.query_params.get("profile")
+    if not mode or not _profile_authorized(request):
+        return NO_PROFILE
+    return _Profile(endpoint, "sample" if mode == "sample" else "cprofile")
+
 # ---------------- Patterns / normalization ----------------
 RE_SOP_NUM = re.compile(r"\b(?:QD-?)?SOP[-\s]?(\d{4,7})\b", re.I)
 RE_SOP_FULL = re.compile(r"\b(?:QD-?)?SOP[-\s]?[A-Z0-9\-]{3,}\b", re.I)
@@ -222,6 +800,53 @@ TFIDF_WORD = None
 VECT_CHAR: Optional[TfidfVectorizer] = None
 TFIDF_CHAR = None
 
+INDEX_GEN = 0                             # bumped on every build_index()
+
+# near-duplicates: indexed row -> collapsed member rows (askv_chunks dicts + "_codes", rep excluded)
+DUP_MEMBERS: Dict[int, List[Dict[str, Any]]] = {}
+DEDUP_STATS: Dict[str, Any] = {}
+
+# metadata indexes (filter push-down)
+DOC_ROWS: Dict[str, np.ndarray] = {}      # doc_id -> sorted row ids
+CODE_ROWS: Dict[str, np.ndarray] = {}     # CODE (upper) -> sorted row ids
+DOC_FILENAMES: List[Tuple[str, str, str]] = []  # sorted (fn_key(filename), doc_id, filename), one per doc
+CHUNK_ROW: Dict[Any, int] = {}            # chunk_id -> row id
+
+# document-level TF-IDF (MMR doc stage)
+DOC_CENTROIDS = None                      # L2-normalized chunk-centroid rows, one per doc
+DOC_CENTROID_ROW: Dict[str, int] = {}     # doc_id -> row in DOC_CENTROIDS
+
+# vectorized scoring kernels (built in build_index)
+BM25_TW = None                            # csr rows x vocab: BM25 term weight tf*(k1+1)/(tf+k1*len_norm)
+BM25_VOCAB: Dict[str, int] = {}           # token -> column in BM25_TW
+BM25_IDF: Optional[np.ndarray] = None     # idf per column (rank_bm25 epsilon floor included)
+CODE_EXACT_ROWS: Dict[str, np.ndarray] = {}  # code (as extracted) -> sorted row ids
+ROW_FN = np.zeros(0, dtype=np.int64)      # row -> index in FN_* (distinct filenames)
+FN_TOKS = None                            # csc distinct filenames x filename-token vocab (binary)
+FN_VOCAB: Dict[str, int] = {}
+FN_JOINED: List[str] = []                 # " ".join(tokenize(filename)) (keyword / negative matches)
+FN_NORM: List[str] = []                   # norm(filename) (fuzzy filename match)
+FN_LOWER: List[str] = []                  # filename.lower() (role/sector bias)
+FN_KW = np.zeros(0)                       # query-independent KEYWORD_BOOSTS sum
+FN_GENERAL = np.zeros(0, dtype=bool)
+FN_SPECIFIC = np.zeros(0, dtype=bool)
+FN_SOP = np.zeros(0, dtype=bool)
+
+# /suggest prefix indexes: (sorted keys, weights, payloads, {short prefix: top positions})
+SUGGEST_NAMES: Tuple = ([], np.zeros(0), [], {})   # codes + filenames, keyed by fn_key()
+SUGGEST_TERMS: Tuple = ([], np.zeros(0), [], {})   # frequent vocabulary terms
+
+# spelling: SPELL_DELETES[delete of a term prefix] -> term ids in SPELL_TERMS
+SPELL_TERMS: List[str] = []
+SPELL_DF = np.zeros(0, dtype=np.int64)
+SPELL_IDS: Dict[str, int] = {}            # every clean vocabulary token (df >= 1) -> id in SPELL_TERMS
+SPELL_DELETES: Dict[str, List[int]] = {}
+SPELL_CACHE: Dict[str, Optional[Tuple[str, int, int]]] = {}
+
+# row shards: contiguous (lo, hi) ranges, [] = unsharded
+SHARD_BOUNDS: List[Tuple[int, int]] = []
+SHARD_POOL: Optional[ThreadPoolExecutor] = None
+
 # spans (optional)
 HAS_SPANS = False
 SPANS: List[Dict[str, Any]] = []          # askv_spans rows
@@ -302,32 +927,39 @@ def load_spans_if_any():
 def build_index():
     global DOCS, TOKS, FILEN_TOKS, CODES
     global BM25, VECT_WORD, TFIDF_WORD, VECT_CHAR, TFIDF_CHAR
-    global ROW_TFIDF, ROW_CTFIDF
+    global ROW_TFIDF, ROW_CTFIDF, INDEX_GEN
 
     t0 = time.time()
 
-    rows = load_chunks()
-    DOCS = rows
+    with timed("index.load"):
+        rows = load_chunks()
 
-    TOKS = [tokenize(r.get("content") or "") for r in DOCS]
-    FILEN_TOKS = [tokenize(r.get("filename") or "") for r in DOCS]
-    CODES = [extract_codes((r.get("content") or "") + " " + (r.get("filename") or "")) for r in DOCS]
+    with timed("index.tokenize"):
+        toks = [tokenize(r.get("content") or "") for r in rows]
 
-    BM25 = BM25Okapi(TOKS) if len(DOCS) else None
+    with timed("index.dedup"):
+        keep = dedup_chunks(rows, toks)
+    DOCS = [rows[i] for i in keep]
+    TOKS = [toks[i] for i in keep]
+
+    with timed("index.tokenize"):
+        FILEN_TOKS = [tokenize(r.get("filename") or "") for r in DOCS]
+        CODES = [extract_codes((r.get("content") or "") + " " + (r.get("filename") or "")) for r in DOCS]
+
+    with timed("index.bm25"):
+        BM25 = BM25Okapi(TOKS) if len(DOCS) else None
 
     corpus = [norm((r.get("content") or "") + " " + (r.get("filename") or "")) for r in DOCS]
 
     if corpus:
-        VECT_WORD = TfidfVectorizer(analyzer="word", ngram_range=(1,3), min_df=2, max_df=0.95)
-        TFIDF_WORD = VECT_WORD.fit_transform(corpus)
+        with timed("index.tfidf_word"):
+            VECT_WORD = TfidfVectorizer(analyzer="word", ngram_range=(1,3), min_df=2, max_df=0.95)
+            TFIDF_WORD = VECT_WORD.fit_transform(corpus)
 
-        VECT_CHAR = TfidfVectorizer(analyzer="char", ngram_range=(3,5), min_df=2, max_df=0.90)
-        TFIDF_CHAR = VECT_CHAR.fit_transform(corpus)
+        with timed("index.tfidf_char"):
+            VECT_CHAR = TfidfVectorizer(analyzer="char", ngram_range=(3,5), min_df=2, max_df=0.90)
+            TFIDF_CHAR = VECT_CHAR.fit_transform(corpus)
 
-        def l2norm(mat):
-            norms = np.sqrt((mat.power(2)).sum(axis=1)).A1 + 1e-12
-            inv = 1.0 / norms
-            return mat.multiply(inv[:,None])
         ROW_TFIDF = l2norm(TFIDF_WORD)
         ROW_CTFIDF = l2norm(TFIDF_CHAR)
     else:
@@ -335,13 +967,487 @@ def build_index():
         VECT_CHAR = TFIDF_CHAR = None
         ROW_TFIDF = ROW_CTFIDF = None
 
+    with timed("index.meta"):
+        build_meta_indexes()
+
+    with timed("index.kernels"):
+        build_scoring_kernels()
+        build_shards()
+
+    with timed("index.suggest"):
+        build_suggest_indexes()
+
+    with timed("index.spell"):
+        build_spell_index()
+
+    with timed("index.centroids"):
+        build_doc_centroids()
+
     # Load spans (optional)
-    load_spans_if_any()
+    with timed("index.spans"):
+        load_spans_if_any()
 
+    INDEX_GEN += 1
     secs = round(time.time() - t0, 3)
+    if PROM is not None:
+        M_CHUNKS.set(len(DOCS))
+        M_SPANS.set(len(SPANS) if HAS_SPANS else 0)
+        M_DOCS.set(len(DOC_ROWS))
+        M_INDEX_GEN.set(INDEX_GEN)
+        M_INDEX_SECS.set(secs)
+    if DUP_MEMBERS:
+        print(f"[pysearch] dedup: {DEDUP_STATS['rows_raw']} chunks -> {len(DOCS)} indexed ({len(DUP_MEMBERS)} clusters)")
     print(f"[pysearch] indexed chunks={len(DOCS)} spans={len(SPANS) if HAS_SPANS else 0} in {secs}s")
     return {"docs": len(DOCS), "spans": len(SPANS) if HAS_SPANS else 0, "secs": secs}
 
+def l2norm(mat):
+    norms = np.sqrt((mat.power(2)).sum(axis=1)).A1 + 1e-12
+    inv = 1.0 / norms
+    return mat.multiply(inv[:,None]).tocsr()
+
+def build_doc_centroids():
+    """DOC_CENTROIDS[r] = L2-normalized mean of a document's ROW_TFIDF rows (r = DOC_CENTROID_ROW[doc_id])."""
+    global DOC_CENTROIDS, DOC_CENTROID_ROW
+    if ROW_TFIDF is None or not DOC_ROWS:
+        DOC_CENTROIDS, DOC_CENTROID_ROW = None, {}
+        return
+    from scipy.sparse import csr_matrix
+    doc_ids = list(DOC_ROWS.keys())
+    lens = np.array([len(DOC_ROWS[d]) for d in doc_ids])
+    indptr = np.concatenate([[0], np.cumsum(lens)])
+    cols = np.concatenate([DOC_ROWS[d] for d in doc_ids])
+    vals = np.repeat(1.0 / lens, lens)
+    avg = csr_matrix((vals, cols, indptr), shape=(len(doc_ids), ROW_TFIDF.shape[0]))
+    DOC_CENTROIDS = l2norm(avg @ ROW_TFIDF)
+    DOC_CENTROID_ROW = {d: j for j, d in enumerate(doc_ids)}
+
+def minhash_signatures(toks: List[List[str]], num_perm: int = DEDUP_PERM, shingle: int = DEDUP_SHINGLE,
+                       seed: int = 1) -> np.ndarray:
+    """(n x num_perm) MinHash over token shingles. Shingles are hashed from token ids in one
+    vectorized pass (chunks shorter than a shingle use their tokens), then multiply-shift
+    hashing per permutation. Chunks without tokens get an all-max row."""
+    n = len(toks)
+    sig = np.full((n, num_perm), np.iinfo(np.uint64).max, dtype=np.uint64)
+    lens = np.fromiter((len(t) for t in toks), dtype=np.int64, count=n)
+    if not lens.sum():
+        return sig
+    vocab: Dict[str, int] = {}
+    ids = np.fromiter((vocab.setdefault(w, len(vocab)) for t in toks for w in t), dtype=np.uint64, count=int(lens.sum()))
+    owner = np.repeat(np.arange(n), lens)
+    w = max(1, shingle)
+    m = len(ids) - w + 1
+    if m > 0:
+        coef = (np.arange(w, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+        h = np.zeros(m, dtype=np.uint64)
+        for k in range(w):
+            h = h * np.uint64(1099511628211) + ids[k:k + m] * coef[k]
+        ok = owner[:m] == owner[w - 1:]
+        h, own = h[ok], owner[:m][ok]
+    else:
+        h, own = np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    short = np.isin(owner, np.flatnonzero((lens > 0) & (lens < w)))
+    h = np.concatenate([h, ids[short] * np.uint64(0xBF58476D1CE4E5B9)])
+    own = np.concatenate([own, owner[short]])
+    order = np.argsort(own, kind="stable")
+    h, own = h[order], own[order]
+    h ^= h >> np.uint64(31)                                        # mix before multiply-shift
+    rng = np.random.RandomState(seed)
+    a = (rng.randint(0, 2**62, size=num_perm, dtype=np.int64).astype(np.uint64) << np.uint64(1)) | np.uint64(1)
+    b = rng.randint(0, 2**62, size=num_perm, dtype=np.int64).astype(np.uint64)
+    shift = np.uint64(32)
+    step = 1 << 17
+    for lo in range(0, len(h), step):
+        hb, ob = h[lo:lo + step], own[lo:lo + step]
+        starts = np.flatnonzero(np.r_[True, ob[1:] != ob[:-1]])
+        for p0 in range(0, num_perm, 16):
+            v = (hb[:, None] * a[None, p0:p0 + 16] + b[None, p0:p0 + 16]) >> shift
+            blk = np.minimum.reduceat(v, starts, axis=0)
+            sig[ob[starts], p0:p0 + 16] = np.minimum(sig[ob[starts], p0:p0 + 16], blk)
+    return sig
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) with bands*rows = num_perm and (1/bands)^(1/rows) closest below threshold."""
+    best = (1, num_perm)
+    for r in range(1, num_perm + 1):
+        if num_perm % r: continue
+        bands = num_perm // r
+        t = (1.0 / bands) ** (1.0 / r)
+        if t <= threshold and abs(t - threshold) < abs((1.0 / best[0]) ** (1.0 / best[1]) - threshold):
+            best = (bands, r)
+    return best
+
+def dedup_chunks(rows: List[Dict[str, Any]], toks: List[List[str]]) -> List[int]:
+    """Cluster near-duplicate chunks, across documents. Returns the row ids to index (lowest row
+    of each cluster); DUP_MEMBERS is keyed by position in that list, i.e. by the future DOCS row."""
+    global DUP_MEMBERS, DEDUP_STATS
+    n = len(rows)
+    DUP_MEMBERS = {}
+    DEDUP_STATS = {"threshold": DEDUP_THRESHOLD, "rows_raw": n, "rows_indexed": n, "clusters": 0}
+    if DEDUP_THRESHOLD <= 0 or n < 2:
+        return list(range(n))
+    sig = minhash_signatures(toks)
+    bands, r = lsh_params(DEDUP_THRESHOLD, DEDUP_PERM)
+    parent = np.arange(n)
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    live = np.flatnonzero(np.array([bool(t) for t in toks]))
+    for bi in range(bands):
+        band = np.ascontiguousarray(sig[live, bi * r:(bi + 1) * r]).view(np.dtype((np.void, 8 * r))).ravel()
+        _u, inv, cnt = np.unique(band, return_inverse=True, return_counts=True)
+        multi = np.flatnonzero(cnt[inv] > 1)
+        if not len(multi): continue
+        order = multi[np.argsort(inv[multi], kind="stable")]
+        grp = inv[order]
+        starts = np.flatnonzero(np.r_[True, grp[1:] != grp[:-1]])
+        for s0, s1 in zip(starts, np.r_[starts[1:], len(order)]):
+            head = live[order[s0]]
+            for j in live[order[s0 + 1:s1]]:
+                ra, rb = find(head), find(j)
+                if ra == rb: continue
+                # verify: estimated Jaccard = share of equal MinHash values
+                if np.mean(sig[head] == sig[j]) >= DEDUP_THRESHOLD:
+                    parent[max(ra, rb)] = min(ra, rb)
+    roots = np.array([find(i) for i in range(n)])
+    keep = np.flatnonzero(roots == np.arange(n))
+    pos = {int(i): p for p, i in enumerate(keep)}
+    for i in np.flatnonzero(roots != np.arange(n)):
+        DUP_MEMBERS.setdefault(pos[int(roots[i])], []).append(rows[i])
+    DEDUP_STATS.update(rows_indexed=len(keep), clusters=len(DUP_MEMBERS), bands=bands, band_rows=r)
+    return keep.tolist()
+
+def build_scoring_kernels():
+    """Precompute what score_arrays_for_query needs so per-query work is sparse products and gathers."""
+    global BM25_TW, BM25_VOCAB, BM25_IDF, ROW_FN, FN_TOKS, FN_VOCAB
+    global FN_JOINED, FN_NORM, FN_LOWER, FN_KW, FN_GENERAL, FN_SPECIFIC, FN_SOP
+    from scipy.sparse import csr_matrix
+    # BM25 as a sparse matrix: score(q) = BM25_TW @ (idf * query term counts), same values as BM25Okapi.get_scores
+    if BM25 is not None:
+        vocab: Dict[str, int] = {}
+        indptr, cols, tfs = [0], [], []
+        for f in BM25.doc_freqs:
+            for t, c in f.items():
+                cols.append(vocab.setdefault(t, len(vocab)))
+                tfs.append(c)
+            indptr.append(len(cols))
+        tf = np.asarray(tfs, dtype=np.float64)
+        dl = np.repeat(np.asarray(BM25.doc_len, dtype=np.float64), np.diff(indptr))
+        w = tf * (BM25.k1 + 1) / (tf + BM25.k1 * (1 - BM25.b + BM25.b * dl / BM25.avgdl))
+        BM25_TW = csr_matrix((w, np.asarray(cols, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                             shape=(len(DOCS), len(vocab)))
+        BM25_VOCAB = vocab
+        BM25_IDF = np.zeros(len(vocab))
+        for t, j in vocab.items():
+            BM25_IDF[j] = BM25.idf.get(t) or 0
+    else:
+        BM25_TW, BM25_VOCAB, BM25_IDF = None, {}, None
+
+    # filename-level signals, computed once per distinct filename and gathered per row
+    fn_ix: Dict[str, int] = {}
+    ROW_FN = np.fromiter((fn_ix.setdefault(r.get("filename") or "", len(fn_ix)) for r in DOCS),
+                         dtype=np.int64, count=len(DOCS))
+    fns = list(fn_ix.keys())
+    toks = [tokenize(fn) for fn in fns]
+    FN_VOCAB = {}
+    indptr, cols = [0], []
+    for ts in toks:
+        cols.extend(FN_VOCAB.setdefault(t, len(FN_VOCAB)) for t in set(ts))
+        indptr.append(len(cols))
+    FN_TOKS = csr_matrix((np.ones(len(cols)), np.asarray(cols, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+                         shape=(len(fns), len(FN_VOCAB))).tocsc()
+    FN_JOINED = [" ".join(ts) for ts in toks]
+    FN_NORM = [norm(fn) for fn in fns]
+    FN_LOWER = [fn.lower() for fn in fns]
+    FN_KW = np.array([sum(b for kw, b in KEYWORD_BOOSTS.items() if kw in j) if j else 0.0 for j in FN_JOINED])
+    FN_GENERAL = np.array([is_general_filename(fn) for fn in fns], dtype=bool)
+    FN_SPECIFIC = np.array([is_specific_filename(fn) for fn in fns], dtype=bool)
+    FN_SOP = np.array([bool(re.search(r"\b(sop|qd-sop)\b", fn, re.I)) for fn in fns], dtype=bool)
+
+def build_shards():
+    global SHARD_BOUNDS, SHARD_POOL
+    n = len(DOCS)
+    if SHARDS <= 1 or n < SHARD_MIN_ROWS:
+        SHARD_BOUNDS = []
+        return
+    edges = np.linspace(0, n, SHARDS + 1).astype(np.int64)
+    SHARD_BOUNDS = [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+    if SHARD_POOL is None:
+        SHARD_POOL = ThreadPoolExecutor(max_workers=SHARDS, thread_name_prefix="pysearch-shard")
+
+def _prefix_index(entries: List[Tuple[str, float, Dict[str, Any]]]) -> Tuple:
+    """Sorted prefix index over (key, weight, payload); duplicate keys keep the heaviest entry."""
+    best: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+    for key, w, payload in entries:
+        if key and (key not in best or w > best[key][0]):
+            best[key] = (w, payload)
+    keys = sorted(best)
+    weights = np.array([best[k][0] for k in keys], dtype=np.float64)
+    payloads = [best[k][1] for k in keys]
+    head: Dict[str, np.ndarray] = {}
+    for n in range(1, SUGGEST_HEAD_LEN + 1):
+        for p in {k[:n] for k in keys if len(k) >= n}:
+            head[p] = _prefix_scan(keys, weights, p, SUGGEST_LIMIT_MAX)
+    return keys, weights, payloads, head
+
+def _prefix_scan(keys: List[str], weights: np.ndarray, p: str, limit: int) -> np.ndarray:
+    lo = bisect.bisect_left(keys, p)
+    hi = bisect.bisect_left(keys, p + "\uffff")
+    if hi - lo > limit:
+        top = lo + np.argpartition(-weights[lo:hi], limit - 1)[:limit]
+    else:
+        top = np.arange(lo, hi)
+    return top[np.argsort(-weights[top], kind="stable")]
+
+def prefix_lookup(ix: Tuple, p: str, limit: int) -> List[Tuple[float, Dict[str, Any]]]:
+    keys, weights, payloads, head = ix
+    if not p or not keys:
+        return []
+    top = head.get(p) if len(p) <= SUGGEST_HEAD_LEN else None
+    if top is None:
+        top = _prefix_scan(keys, weights, p, limit)
+    return [(float(weights[j]), payloads[j]) for j in top[:limit]]
+
+RE_SUGGEST_TERM = re.compile(r"^(?=.*[a-z])[a-z0-9][a-z0-9\-_/\.]+[a-z0-9]$")  # no trailing punctuation
+
+def build_suggest_indexes():
+    """Codes and filenames weighted by chunk count; terms by document frequency."""
+    global SUGGEST_NAMES, SUGGEST_TERMS
+    names = []
+    for code, rows in CODE_ROWS.items():
+        names.append((fn_key(code), float(len(rows)), {"text": code, "kind": "code"}))
+    for key, doc_id, fn in DOC_FILENAMES:
+        names.append((key, float(len(DOC_ROWS.get(doc_id, ()))), {"text": fn, "kind": "file", "doc_id": doc_id}))
+    SUGGEST_NAMES = _prefix_index(names)
+
+    terms = []
+    if BM25_TW is not None and BM25_VOCAB:
+        df = np.bincount(BM25_TW.indices, minlength=len(BM25_VOCAB))
+        vocab = [t for t, _j in sorted(BM25_VOCAB.items(), key=lambda kv: kv[1])]
+        keep = [j for j in np.argsort(-df, kind="stable")
+                if df[j] >= 2 and RE_SUGGEST_TERM.match(vocab[j])][:SUGGEST_TERMS_MAX]
+        terms = [(vocab[j], float(df[j]), {"text": vocab[j], "kind": "term"}) for j in keep]
+    SUGGEST_TERMS = _prefix_index(terms)
+
+RE_SPELL_TOKEN = re.compile(r"^[a-z][a-z\-]*[a-z]$")  # plain words only (no codes / numbers)
+
+def _deletes(w: str, d: int) -> set:
+    """w plus every string obtained by deleting up to d characters."""
+    out, frontier = {w}, {w}
+    for _ in range(d):
+        frontier = {x[:i] + x[i + 1:] for x in frontier for i in range(len(x))} - out
+        out |= frontier
+    return out
+
+def build_spell_index():
+    """Symmetric-delete dictionary from the BM25 vocabulary and document frequencies."""
+    global SPELL_TERMS, SPELL_DF, SPELL_IDS, SPELL_DELETES, SPELL_CACHE
+    SPELL_CACHE = {}
+    if not SPELL_ON or BM25_TW is None:
+        SPELL_TERMS, SPELL_DF, SPELL_IDS, SPELL_DELETES = [], np.zeros(0, dtype=np.int64), {}, {}
+        return
+    df = np.bincount(BM25_TW.indices, minlength=len(BM25_VOCAB))
+    terms = [t for t, j in BM25_VOCAB.items() if RE_SPELL_TOKEN.match(t)]
+    SPELL_TERMS = terms
+    SPELL_DF = np.array([df[BM25_VOCAB[t]] for t in terms], dtype=np.int64)
+    SPELL_IDS = {t: i for i, t in enumerate(terms)}
+    deletes: Dict[str, List[int]] = {}
+    for i, t in enumerate(terms):
+        if SPELL_DF[i] < SPELL_MIN_DF or len(t) < 4:
+            continue
+        for e in _deletes(t[:SPELL_PREFIX], SPELL_MAX_EDIT):
+            deletes.setdefault(e, []).append(i)
+    SPELL_DELETES = deletes
+
+def spell_lookup(tok: str) -> Optional[Tuple[str, int, int]]:
+    """Closest dictionary term (term, distance, df): smallest edit distance, then most frequent."""
+    if tok in SPELL_CACHE:
+        cache_lookup("spell", True)
+        return SPELL_CACHE[tok]
+    cache_lookup("spell", False)
+    d = SPELL_MAX_EDIT if len(tok) > 5 else 1
+    cands = set()
+    for e in _deletes(tok[:SPELL_PREFIX], d):
+        cands.update(SPELL_DELETES.get(e, ()))
+    best = None
+    for i in cands:
+        t = SPELL_TERMS[i]
+        if t == tok or abs(len(t) - len(tok)) > d:
+            continue
+        dist = OSA.distance(tok, t, score_cutoff=d)
+        if dist > d:
+            continue
+        key = (dist, -int(SPELL_DF[i]), t)
+        if best is None or key < best[0]:
+            best = (key, (t, dist, int(SPELL_DF[i])))
+    out = best[1] if best else None
+    if len(SPELL_CACHE) < 100000:
+        SPELL_CACHE[tok] = out
+    return out
+
+SPELL_PROTECTED = None  # query words never corrected (bilingual pairs, seeds), built lazily
+
+def spell_correct(q: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Unknown tokens are replaced by their closest vocabulary term; rare known tokens get the
+    frequent 1-edit neighbour appended. Only the corrected words of q are rewritten (their
+    casing kept), the rest of q is untouched. Returns (query, corrections)."""
+    global SPELL_PROTECTED
+    if not SPELL_DELETES:
+        return q, []
+    if SPELL_PROTECTED is None:
+        SPELL_PROTECTED = {t for pair in BILINGUAL_DEFAULTS for w in pair for t in tokenize(w)} | \
+                          {t for w in NEXT_SEED_TERMS for t in tokenize(w)}
+    with timed("spell"):
+        fixes: List[Dict[str, Any]] = []
+        for tok in dict.fromkeys(tokenize(q)):
+            if len(tok) < 4 or tok in SPELL_PROTECTED or not RE_SPELL_TOKEN.match(tok):
+                continue
+            j = SPELL_IDS.get(tok)
+            df = int(SPELL_DF[j]) if j is not None else 0
+            if df >= SPELL_RARE_DF:
+                continue
+            hit = spell_lookup(tok)
+            if hit is None:
+                continue
+            term, dist, tdf = hit
+            if df == 0:
+                fixes.append({"from": tok, "to": term, "distance": dist, "mode": "corrected"})
+            elif dist == 1 and tdf >= SPELL_EXPAND_RATIO * df:
+                fixes.append({"from": tok, "to": term, "distance": dist, "mode": "expanded"})
+        if not fixes:
+            return q, []
+        fixed = {f["from"]: f["to"] for f in fixes if f["mode"] == "corrected"}
+        def _sub(m):
+            w = m.group(0)
+            to = fixed.get(unidecode(w.lower()))
+            if to is None:
+                return w
+            return to.upper() if w.isupper() and len(w) > 1 else to.capitalize() if w[:1].isupper() else to
+        out = re.sub(r"(?<![\w\-/.])[^\W\d_][\w\-]*(?![\w\-/.])", _sub, q) if fixed else q
+        extra = [f["to"] for f in fixes if f["mode"] == "expanded"]
+        return (out + " " + " ".join(extra)) if extra else out, fixes
+
+def fn_key(s: str) -> str:
+    # lower/accents/spaces only: norm() would rewrite partial codes (QD-SOP-0262 -> QD-SOP-000262)
+    return re.sub(r"\s+", " ", unidecode((s or "").lower())).strip()
+
+def build_meta_indexes():
+    global DOC_ROWS, CODE_ROWS, CODE_EXACT_ROWS, DOC_FILENAMES, CHUNK_ROW
+    CHUNK_ROW = {r["chunk_id"]: i for i, r in enumerate(DOCS)}
+    doc_rows: Dict[str, List[int]] = {}
+    code_rows: Dict[str, List[int]] = {}
+    exact_rows: Dict[str, List[int]] = {}
+    fnames: Dict[str, str] = {}
+    for i, r in enumerate(DOCS):
+        d = str(r["doc_id"])
+        doc_rows.setdefault(d, []).append(i)
+        fnames.setdefault(d, r.get("filename") or "")
+        for c in CODES[i]:
+            code_rows.setdefault(str(c).upper(), []).append(i)
+            exact_rows.setdefault(c, []).append(i)
+    # a representative stands for its collapsed members: their doc / codes / filename mark its
+    # row too (resolve_filters then presents the member that actually matched)
+    for i, members in DUP_MEMBERS.items():
+        for m in members:
+            d = str(m["doc_id"])
+            m["_codes"] = extract_codes((m.get("content") or "") + " " + (m.get("filename") or ""))
+            CHUNK_ROW[m["chunk_id"]] = i
+            doc_rows.setdefault(d, []).append(i)
+            fnames.setdefault(d, m.get("filename") or "")
+            for c in m["_codes"]:
+                code_rows.setdefault(str(c).upper(), []).append(i)
+    DOC_ROWS = {d: np.unique(np.asarray(v, dtype=np.int64)) for d, v in doc_rows.items()}
+    CODE_ROWS = {c: np.asarray(sorted(set(v)), dtype=np.int64) for c, v in code_rows.items()}
+    CODE_EXACT_ROWS = {c: np.asarray(v, dtype=np.int64) for c, v in exact_rows.items()}
+    DOC_FILENAMES = sorted((fn_key(fn), d, fn) for d, fn in fnames.items())
+
+class RowSet(np.ndarray):
+    """Filtered row ids; `alias[row]` is the collapsed member presented in place of a
+    representative that only matched the filters through that member."""
+    def __array_finalize__(self, obj):
+        self.alias = getattr(obj, "alias", {})
+
+def row_entity(i: int, doc_id: Optional[str] = None) -> Dict[str, Any]:
+    """DOCS[i], or its collapsed member from `doc_id` when the row stands in for that document."""
+    r = DOCS[i]
+    if doc_id is None or str(r["doc_id"]) == str(doc_id):
+        return r
+    return next((m for m in DUP_MEMBERS.get(i, ()) if str(m["doc_id"]) == str(doc_id)), r)
+
+def _entity_matches(f: "SearchFilters", e: Dict[str, Any], codes: List[str]) -> bool:
+    """All filter fields against one chunk (representative or member)."""
+    fn = e.get("filename") or ""
+    if f.doc_ids is not None and str(e["doc_id"]) not in {str(d) for d in f.doc_ids}:
+        return False
+    if f.filename_prefix and not fn_key(fn).startswith(fn_key(f.filename_prefix)):
+        return False
+    if f.filename_regex and not re.search(f.filename_regex, fn, re.I):
+        return False
+    if f.codes is not None:
+        keys = {x.upper() for c in f.codes for x in (extract_codes(c) or [c])}
+        if not keys & {str(c).upper() for c in codes}:
+            return False
+    if f.sector and f.sector.lower() not in fn.lower():
+        return False
+    return True
+
+def _rows_of_docs(doc_ids) -> np.ndarray:
+    parts = [DOC_ROWS[d] for d in doc_ids if d in DOC_ROWS]
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+def resolve_filters(f: Optional["SearchFilters"]) -> Optional[np.ndarray]:
+    """Filters -> sorted row ids to score (None = no filter). Fields are ANDed."""
+    if f is None:
+        return None
+    with timed("filters"):
+        mask = None
+        def _and(rows: np.ndarray):
+            nonlocal mask
+            m = np.zeros(len(DOCS), dtype=bool)
+            m[rows] = True
+            mask = m if mask is None else (mask & m)
+
+        if f.doc_ids is not None:
+            _and(_rows_of_docs(str(d) for d in f.doc_ids))
+        if f.filename_prefix:
+            p = fn_key(f.filename_prefix)
+            lo = bisect.bisect_left(DOC_FILENAMES, (p,))
+            hi = bisect.bisect_left(DOC_FILENAMES, (p + "\uffff",))
+            _and(_rows_of_docs(d for _n, d, _fn in DOC_FILENAMES[lo:hi]))
+        if f.filename_regex:
+            try:
+                rx = re.compile(f.filename_regex, re.I)
+            except re.error as e:
+                raise HTTPException(status_code=400, detail=f"bad filename_regex: {e}")
+            _and(_rows_of_docs(d for _n, d, fn in DOC_FILENAMES if rx.search(fn)))
+        if f.codes is not None:
+            keys = set()
+            for c in f.codes:
+                keys.update(x.upper() for x in (extract_codes(c) or [c]))
+            parts = [CODE_ROWS[c] for c in keys if c in CODE_ROWS]
+            _and(np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64))
+        if f.sector:
+            sl = f.sector.lower()
+            _and(_rows_of_docs(d for _n, d, fn in DOC_FILENAMES if sl in fn.lower()))
+
+        if mask is None:
+            return None
+        # representatives marked through members: fields may have matched different members,
+        # keep the row only if one chunk matches them all and present that chunk
+        alias: Dict[int, Dict[str, Any]] = {}
+        for i, members in DUP_MEMBERS.items():
+            if not mask[i] or _entity_matches(f, DOCS[i], CODES[i]):
+                continue
+            m = next((m for m in members if _entity_matches(f, m, m.get("_codes") or [])), None)
+            if m is None:
+                mask[i] = False
+            else:
+                alias[i] = m
+        out = np.flatnonzero(mask).view(RowSet)
+        out.alias = alias
+        return out
+
 def ensure_index():
     if not DOCS:
         return build_index()
@@ -360,7 +1466,8 @@ def fetch_synonyms_for_tokens(tokens: List[str]) -> List[Tuple[str,str,float]]:
     """
     params = [t.lower() for t in tokens] + [t.lower() for t in tokens]
     try:
-        rows = db_query(sql, params)
+        with timed("synonyms_db"):
+            rows = db_query(sql, params)
         return [(r["term"], r["alt_term"], float(r["weight"])) for r in rows]
     except Exception:
         return []
@@ -436,10 +1543,128 @@ def generate_subqueries(q: str, next_terms: Optional[List[str]] = None) -> List[
         for t in next_terms[:5]:
             subs.add(q + " " + str(t))
 
-    return list(subs)[:10]  # petit cap
+    return list(subs)[:SUBQ_MAX]  # petit cap
 
 # ---------------- Scoring core ----------------
-def score_arrays_for_query(q: str) -> Tuple[np.ndarray,np.ndarray,np.ndarray,np.ndarray,np.ndarray,np.ndarray]:
+def _row_block(mat, lo: int, hi: int):
+    """Zero-copy CSR view of rows [lo, hi)."""
+    from scipy.sparse import csr_matrix
+    p = mat.indptr
+    a, b = p[lo], p[hi]
+    return csr_matrix((mat.data[a:b], mat.indices[a:b], p[lo:hi + 1] - a), shape=(hi - lo, mat.shape[1]), copy=False)
+
+def _select(mat, blk):
+    """Rows of `mat` for a block: (lo, hi) range or an array of row ids."""
+    return _row_block(mat, *blk) if isinstance(blk, tuple) else mat[blk]
+
+def _blocks(rows: Optional[np.ndarray]) -> list:
+    """Work units for one scoring pass: shard ranges (or filtered rows split the same way)."""
+    if rows is None:
+        return SHARD_BOUNDS or [(0, len(DOCS))]
+    rows = np.asarray(rows)  # plain ids (a RowSet's aliases only matter when items are built)
+    if SHARD_BOUNDS and len(rows) >= SHARD_MIN_ROWS:
+        return np.array_split(rows, len(SHARD_BOUNDS))
+    return [rows]
+
+def _fan_out(fn, blocks: list) -> list:
+    """fn over blocks: in the shard pool when there is more than one, inline otherwise."""
+    if len(blocks) <= 1 or SHARD_POOL is None:
+        return [fn(b) for b in blocks]
+    acc = _REQ_TIMINGS.get()
+    if acc is None:
+        with timed("shards"):
+            return list(SHARD_POOL.map(fn, blocks))
+
+    # workers run in a copy of the caller's context with their own stage collector (no shared
+    # dict across threads); their timings are merged back (summed over workers) so
+    # debug_timings sees shard stages
+    def run(b):
+        stages: Dict[str, List[float]] = {}
+        def inner():
+            _REQ_TIMINGS.set(stages)
+            return fn(b)
+        return contextvars.copy_context().run(inner), stages
+    with timed("shards"):
+        done = list(SHARD_POOL.map(run, blocks))
+    for _out, stages in done:
+        for name, (dt, n) in stages.items():
+            e = acc.get(name)
+            if e is None: acc[name] = [dt, n]
+            else: e[0] += dt; e[1] += n
+    return [out for out, _stages in done]
+
+def tfidf_batch(queries: List[str]):
+    """One vectorizer transform + one sparse product per matrix for many queries.
+    Returns CSC (n_docs x n_queries) score matrices (word, char), or None if no index."""
+    from scipy.sparse import vstack
+    qn = [norm(q) for q in queries]
+    blocks = _blocks(None)
+    W = C = None
+    if TFIDF_WORD is not None and VECT_WORD is not None:
+        with timed("tfidf_word"):
+            qw = VECT_WORD.transform(qn).T.tocsc()
+            W = vstack(_fan_out(lambda b: _select(TFIDF_WORD, b) @ qw, blocks)).tocsc()
+    if TFIDF_CHAR is not None and VECT_CHAR is not None:
+        with timed("tfidf_char"):
+            qc = VECT_CHAR.transform(qn).T.tocsc()
+            C = vstack(_fan_out(lambda b: _select(TFIDF_CHAR, b) @ qc, blocks)).tocsc()
+    return W, C
+
+def _view(rows: Optional[np.ndarray]) -> np.ndarray:
+    """Row ids scored by this call: whole corpus, or a filtered subset."""
+    return np.arange(len(DOCS)) if rows is None else rows
+
+def _bm25_query_vec(q_tokens: List[str]) -> Optional[np.ndarray]:
+    """idf-weighted query term counts over BM25_VOCAB (None if no known token)."""
+    qv = None
+    for t in q_tokens:
+        j = BM25_VOCAB.get(t)
+        if j is None: continue
+        if qv is None: qv = np.zeros(len(BM25_VOCAB))
+        qv[j] += BM25_IDF[j]
+    return qv
+
+def _scan_block(blk, bm_q, qvec_word, qvec_char):
+    """Per-shard kernel: BM25 and TF-IDF sparse products for one block of rows."""
+    n = (blk[1] - blk[0]) if isinstance(blk, tuple) else len(blk)
+    bm = np.zeros(n)
+    if bm_q is not None:
+        with timed("bm25"):
+            bm = _select(BM25_TW, blk) @ bm_q
+    tf_word = tf_char = None
+    if qvec_word is not None:
+        with timed("tfidf_word"):
+            tf_word = (_select(TFIDF_WORD, blk) @ qvec_word).toarray().ravel()
+    if qvec_char is not None:
+        with timed("tfidf_char"):
+            tf_char = (_select(TFIDF_CHAR, blk) @ qvec_char).toarray().ravel()
+    return bm, tf_word, tf_char
+
+def _code_boost(q_codes: List[str]) -> Optional[np.ndarray]:
+    """Full-corpus code boost: +1.25 rows carrying the code, +0.7 rows with a near-identical one."""
+    if not q_codes or not CODE_EXACT_ROWS:
+        return None
+    vocab = list(CODE_EXACT_ROWS.keys())
+    low = [c.lower() for c in vocab]
+    out = np.zeros(len(DOCS))
+    for qc in q_codes:
+        exact = np.zeros(len(DOCS), dtype=bool)
+        if qc in CODE_EXACT_ROWS:
+            exact[CODE_EXACT_ROWS[qc]] = True
+        sc = process.cdist([qc.lower()], low, scorer=fuzz.ratio, dtype=np.float64, workers=max(1, SHARDS))[0]
+        near = np.zeros(len(DOCS), dtype=bool)
+        for j in np.flatnonzero(sc >= 90):
+            if vocab[j] != qc:
+                near[CODE_EXACT_ROWS[vocab[j]]] = True
+        out[exact] += 1.25
+        out[near & ~exact] += 0.7
+    return out
+
+def score_arrays_for_query(q: str, tf: Optional[Tuple[np.ndarray,np.ndarray]] = None, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray,np.ndarray,np.ndarray,np.ndarray,np.ndarray,np.ndarray]:
+    """Raw signals for one query; `tf` = precomputed (tf_word, tf_char) columns (batch path).
+    With `rows`, only those corpus rows are scored and arrays are aligned to `rows`.
+    Row-level products run per shard; filename/code signals are computed per distinct
+    filename/code and gathered."""
     qn = norm(q)
     q_tokens = tokenize(q)
     q_codes = extract_codes(q)
@@ -447,54 +1672,43 @@ def score_arrays_for_query(q: str) -> Tuple[np.ndarray,np.ndarray,np.ndarray,np.
     neg_tokens = [t[1:] for t in q_tokens if t.startswith("-") and len(t) > 1]
     q_tokens = [t for t in q_tokens if not t.startswith("-")]
 
-    bm = np.zeros(len(DOCS))
-    if BM25 and q_tokens:
-        bm = np.array(BM25.get_scores(q_tokens))
+    idx = _view(rows)
+    n = len(idx)
+    bm_q = _bm25_query_vec(q_tokens) if BM25_TW is not None and q_tokens else None
+    qvec_word = qvec_char = None
+    if tf is None:
+        if TFIDF_WORD is not None and VECT_WORD is not None:
+            qvec_word = VECT_WORD.transform([qn]).T.tocsc()
+        if TFIDF_CHAR is not None and VECT_CHAR is not None:
+            qvec_char = VECT_CHAR.transform([qn]).T.tocsc()
+
+    parts = _fan_out(lambda b: _scan_block(b, bm_q, qvec_word, qvec_char), _blocks(rows))
+    bm = np.concatenate([p[0] for p in parts]) if parts else np.zeros(n)
+    if tf is not None:
+        tf_word, tf_char = tf
+    else:
+        tf_word = np.concatenate([p[1] for p in parts]) if qvec_word is not None else np.zeros(n)
+        tf_char = np.concatenate([p[2] for p in parts]) if qvec_char is not None else np.zeros(n)
+
+    with timed("boosts"):
+        fn_rows = ROW_FN[idx]
+        # filename tokens / keywords / negatives (0 when the filename has no tokens)
+        qcols = [FN_VOCAB[t] for t in set(q_tokens) if t in FN_VOCAB]
+        inter = np.asarray(FN_TOKS[:, qcols].sum(axis=1)).ravel() if qcols else np.zeros(len(FN_JOINED))
+        fn_score = np.minimum(0.5, 0.12 * inter) * (inter > 0) + FN_KW
+        for nt in neg_tokens:
+            if nt:
+                fn_score -= 0.25 * np.fromiter((bool(j) and nt in j for j in FN_JOINED), dtype=bool, count=len(FN_JOINED))
+        fname = fn_score[fn_rows]
 
-    tf_word = np.zeros(len(DOCS))
-    if TFIDF_WORD is not None and VECT_WORD is not None:
-        qvec_word = VECT_WORD.transform([qn])
-        tf_word = (TFIDF_WORD @ qvec_word.T).toarray().ravel()
+        cb = _code_boost(q_codes)
+        code_boost = cb[idx] if cb is not None else np.zeros(n)
 
-    tf_char = np.zeros(len(DOCS))
-    if TFIDF_CHAR is not None and VECT_CHAR is not None:
-        qvec_char = VECT_CHAR.transform([qn])
-        tf_char = (TFIDF_CHAR @ qvec_char.T).toarray().ravel()
-
-    fname = np.zeros(len(DOCS))
-    qset = set(q_tokens)
-    for i, ft in enumerate(FILEN_TOKS):
-        if not ft: continue
-        inter = qset.intersection(ft)
-        if inter:
-            fname[i] += min(0.5, 0.12 * len(inter))
-        lowfname = " ".join(ft)
-        for kw, b in KEYWORD_BOOSTS.items():
-            if kw in lowfname:
-                fname[i] += b
-        for nt in neg_tokens:
-            if nt and nt in lowfname:
-                fname[i] -= 0.25
-
-    code_boost = np.zeros(len(DOCS))
-    for i, codes in enumerate(CODES):
-        if not codes: continue
-        for qc in q_codes:
-            if qc in codes:
-                code_boost[i] += 1.25
-            else:
-                if any(fuzz.ratio(qc.lower(), c.lower()) >= 90 for c in codes):
-                    code_boost[i] += 0.7
-
-    fuzzy = np.zeros(len(DOCS))
-    if len(qn) >= 5:
-        for i, r in enumerate(DOCS):
-            f = r.get("filename") or ""
-            if not f: continue
-            sc = fuzz.partial_ratio(qn, norm(f))
-            if sc >= 92: fuzzy[i] = 0.45
-            elif sc >= 84: fuzzy[i] = 0.25
-            elif sc >= 78: fuzzy[i] = 0.12
+        fuzzy = np.zeros(n)
+        if len(qn) >= 5 and FN_NORM:
+            sc = process.cdist([qn], FN_NORM, scorer=fuzz.partial_ratio, dtype=np.float64, workers=max(1, SHARDS))[0]
+            fz = np.where(sc >= 92, 0.45, np.where(sc >= 84, 0.25, np.where(sc >= 78, 0.12, 0.0)))
+            fuzzy = fz[fn_rows]
 
     return bm, tf_word, tf_char, fname, code_boost, fuzzy
 
@@ -505,43 +1719,95 @@ def _z(x: np.ndarray) -> np.ndarray:
 
 def combine_scores(arrs: List[np.ndarray]) -> np.ndarray:
     bm, tfw, tfc, fname, code_boost, fuzzy = arrs
-    return 0.60*_z(bm) + 0.56*_z(tfw) + 0.22*_z(tfc) + fname + code_boost + 0.5*fuzzy
+    w = COMBINE_W
+    return (w["bm"]*_z(bm) + w["tfw"]*_z(tfw) + w["tfc"]*_z(tfc)
+            + w["fname"]*fname + w["code"]*code_boost + w["fuzzy"]*fuzzy)
 
-def score_hybrid_single(q: str, role: Optional[str], sector: Optional[str]) -> np.ndarray:
+def score_hybrid_single(q: str, role: Optional[str], sector: Optional[str], tf: Optional[Tuple[np.ndarray,np.ndarray]] = None, rows: Optional[np.ndarray] = None) -> np.ndarray:
     prefer_global, prefer_sop = intent_from_query(q)
-    bm, tfw, tfc, fname, code_boost, fuzzy = score_arrays_for_query(q)
-
-    rs = np.zeros(len(DOCS))
-    rlow = (role or "").lower()
-    slow = (sector or "").lower()
-    if rlow or slow:
-        for i, r in enumerate(DOCS):
-            fn = (r.get("filename") or "").lower()
-            if rlow and rlow in fn: rs[i] += 0.06
-            if slow and slow in fn: rs[i] += 0.06
-
-    intent = np.zeros(len(DOCS))
-    for i, r in enumerate(DOCS):
-        fn = r.get("filename") or ""
+    bm, tfw, tfc, fname, code_boost, fuzzy = score_arrays_for_query(q, tf=tf, rows=rows)
+
+    with timed("bias"):
+        # per distinct filename, gathered to rows
+        fb = np.zeros(len(FN_LOWER))
+        rlow = (role or "").lower()
+        slow = (sector or "").lower()
+        for sub in (rlow, slow):
+            if sub:
+                fb += 0.06 * np.fromiter((sub in f for f in FN_LOWER), dtype=bool, count=len(FN_LOWER))
         if prefer_global:
-            if is_general_filename(fn): intent[i] += 0.35
-            if is_specific_filename(fn): intent[i] -= 0.15
+            fb += 0.35 * FN_GENERAL - 0.15 * FN_SPECIFIC
         else:
-            if is_specific_filename(fn): intent[i] += 0.12
-        if prefer_sop and re.search(r"\b(sop|qd-sop)\b", fn, re.I):
-            intent[i] += 0.25
+            fb += 0.12 * FN_SPECIFIC
+        if prefer_sop:
+            fb += 0.25 * FN_SOP
+        bias = fb[ROW_FN[_view(rows)]]
 
-    S = combine_scores([bm, tfw, tfc, fname, code_boost, fuzzy]) + rs + intent
+    S = combine_scores([bm, tfw, tfc, fname, code_boost, fuzzy]) + bias
     return S
 
-def aggregate_over_subqueries(q: str, role: Optional[str], sector: Optional[str], next_terms: Optional[List[str]] = None) -> np.ndarray:
-    """Blend scores over generated sub-queries for recall."""
-    subs = [q] + generate_subqueries(q, next_terms=next_terms)
-    # poids décroissants ; next_terms étant dans subs, ils héritent d'un poids bas
-    weights = np.linspace(1.0, 0.6, num=len(subs))
-    S = np.zeros(len(DOCS))
-    for w, sq in zip(weights, subs):
-        S += w * score_hybrid_single(sq, role, sector)
+def _idf_mass(tokens) -> float:
+    return float(sum(BM25_IDF[BM25_VOCAB[t]] for t in tokens if t in BM25_VOCAB)) if BM25_IDF is not None else 0.0
+
+def plan_subqueries(q: str, subs: List[str]) -> Tuple[List[Tuple[str, float]], Dict[str, Any]]:
+    """Sub-queries -> [(sub-query, weight)] to score, heaviest first, plus a report.
+    `subs` starts with `q`; positional weights (1.0 -> 0.6) as before planning."""
+    from collections import Counter
+    weights = np.linspace(1.0, 0.6, num=len(subs)) if subs else np.zeros(0)
+    if not PLAN_ON:
+        return list(zip(subs, weights.tolist())), {"raw": len(subs), "scored": len(subs)}
+    base = Counter(t for t in tokenize(q) if not t.startswith("-"))
+    base_mass = _idf_mass(base.elements())
+    groups: Dict[Tuple, List] = {}      # token multiset -> [sub-query, weight, variants]
+    pruned = []
+    for sq, w in zip(subs, weights.tolist()):
+        toks = Counter(tokenize(sq))
+        key = tuple(sorted(toks.items()))
+        added = toks - base
+        # pure expansions (every query term kept, terms added) are priced by what they add;
+        # reductions and reformulations are kept as-is
+        if sq != q and added and (toks & base) == base:
+            mass = _idf_mass(added.elements())
+            if mass < PLAN_MIN_IDF_SHARE * max(base_mass, 1e-9):
+                pruned.append({"q": sq, "added": sorted(added), "idf_mass": round(mass, 4)})
+                key = tuple(sorted(base.items()))   # folded into the original query
+                sq = q
+        g = groups.get(key)
+        if g is None:
+            groups[key] = [sq, w, 1]
+        else:
+            g[1] += w
+            g[2] += 1
+    plan = sorted(((sq, w) for sq, w, _n in groups.values()), key=lambda p: -p[1])
+    report = {
+        "raw": len(subs), "scored": len(plan),
+        "merged": len(subs) - len(plan) - len(pruned), "pruned": pruned,
+        "plan": [{"q": sq, "weight": round(w, 4), "variants": n} for sq, w, n in
+                 sorted(groups.values(), key=lambda g: -g[1])],
+    }
+    return plan, report
+
+def aggregate_over_subqueries(q: str, role: Optional[str], sector: Optional[str], next_terms: Optional[List[str]] = None, budget=None, rows: Optional[np.ndarray] = None, plan_out: Optional[Dict[str, Any]] = None) -> np.ndarray:
+    """Blend scores over generated sub-queries for recall (planned: duplicates merged, weak expansions folded)."""
+    with timed("subqueries"):
+        subs = [q] + generate_subqueries(q, next_terms=next_terms)
+        plan, report = plan_subqueries(q, subs)
+    if plan_out is not None:
+        plan_out.update(report)
+    return blend_subqueries(plan, lambda sq: score_hybrid_single(sq, role, sector, rows=rows), budget=budget, n=len(_view(rows)))
+
+def blend_subqueries(plan: List[Tuple[str, float]], score_fn, budget=None, n: Optional[int] = None) -> np.ndarray:
+    """Weighted sum of score_fn over the plan, in plan order (heaviest weight first, see
+    plan_subqueries); a budget cutoff therefore drops the lightest sub-queries."""
+    S = np.zeros(len(DOCS) if n is None else n)
+    for i, (sq, w) in enumerate(plan):
+        # budget: stop expanding once the next sub-query (avg cost so far) would overrun its share
+        if budget is not None and i > 0:
+            el = budget.elapsed_ms()
+            if el + el / i > budget.ms * BUDGET_SUBQ_SHARE:
+                budget.degrade(f"subqueries:{i}/{len(plan)}")
+                break
+        S += w * score_fn(sq)
     return S
 
 # ---------------- Two-stage MMR ----------------
@@ -572,18 +1838,10 @@ def _mmr_from_rows(rowvecs, qvec, lam, limit) -> List[int]:
 def mmr_two_stage(items: List[Dict[str,Any]], k: int, q: str) -> List[Dict[str,Any]]:
     if not items or ROW_TFIDF is None or VECT_WORD is None:
         return items[:k]
-    # doc-level: map each item to doc row centroid (approx by first chunk row)
-    doc_to_rows = {}
-    for idx, it in enumerate(items):
-        # find RAM row index
-        ridx = next((i for i, d in enumerate(DOCS) if d["chunk_id"] == it["chunk_id"]), -1)
-        if ridx < 0: continue
-        doc_to_rows.setdefault(it["doc_id"], []).append(ridx)
-
-    # build unique doc list & choose representative row per doc (first for now)
-    docs = list(doc_to_rows.keys())
-    rep_rows = [doc_to_rows[d][0] for d in docs]
-    doc_rowvecs = ROW_TFIDF[rep_rows]
+    # doc-level: each candidate doc is represented by its precomputed chunk centroid
+    docs = list(dict.fromkeys(it["doc_id"] for it in items
+                              if it["chunk_id"] in CHUNK_ROW and it["doc_id"] in DOC_CENTROID_ROW))
+    doc_rowvecs = DOC_CENTROIDS[[DOC_CENTROID_ROW[d] for d in docs]]
     qvec = VECT_WORD.transform([norm(q)])
     qnorm = math.sqrt((qvec.power(2)).sum()) + 1e-12
     qv = (qvec / qnorm)
@@ -594,10 +1852,8 @@ def mmr_two_stage(items: List[Dict[str,Any]], k: int, q: str) -> List[Dict[str,A
     # second stage: within kept docs, run chunk-level MMR on their items
     kept_items = [it for it in items if it["doc_id"] in keep_docs]
     # Rebuild row list for kept items
-    kept_rows = []
-    for it in kept_items:
-        ridx = next((i for i, d in enumerate(DOCS) if d["chunk_id"] == it["chunk_id"]), -1)
-        if ridx >= 0: kept_rows.append(ridx)
+    kept_items = [it for it in kept_items if it["chunk_id"] in CHUNK_ROW]
+    kept_rows = [CHUNK_ROW[it["chunk_id"]] for it in kept_items]
     if not kept_rows: return items[:k]
     chunk_rowvecs = ROW_TFIDF[kept_rows]
     keep_idx_rel = _mmr_from_rows(chunk_rowvecs, qv, MMR_LAMBDA_CHUNK, min(MMR_LIMIT_CHUNK, len(kept_items)))
@@ -641,14 +1897,34 @@ def answerability_label(evidence_counts: List[int], need: int = 2) -> str:
     return "NR"
 
 # ---------------- FastAPI models ----------------
+class SearchFilters(BaseModel):
+    doc_ids: Optional[List[str]] = None          # any of these documents
+    filename_prefix: Optional[str] = None        # filename prefix (case/accent-insensitive)
+    filename_regex: Optional[str] = None         # case-insensitive, searched in the raw filename
+    codes: Optional[List[str]] = None            # any of these codes (QD-SOP-######, N####-#, IDR)
+    sector: Optional[str] = None                 # substring of the filename (same rule as the sector bias)
+
 class SearchReq(BaseModel):
-    query: str
+    query: str = ""
     k: Optional[int] = None
     role: Optional[str] = None
     sector: Optional[str] = None
     rerank: Optional[bool] = None
     deep: Optional[bool] = None
     next_terms: Optional[List[str]] = None  # <<< NEW
+    filters: Optional[SearchFilters] = None  # push-down: only matching rows are scored
+    budget_ms: Optional[float] = None       # latency budget (None -> PYSEARCH_BUDGET_MS, 0 -> unlimited)
+    debug_timings: Optional[bool] = False   # per-stage breakdown in the response
+    spell: Optional[bool] = None            # typo correction (None -> PYSEARCH_SPELL)
+    expand_duplicates: Optional[bool] = False  # list collapsed near-duplicate chunks per item
+    fields: Optional[List[str]] = None      # item keys to return (None = all); "evidence" absent -> not computed
+    snippet_len: Optional[int] = None       # truncate item snippets (0 = drop)
+    debug: Optional[bool] = False           # keep `_`-prefixed internals in items
+    paginate: Optional[bool] = False        # keep a deeper pool server-side and return a cursor
+    cursor: Optional[str] = None            # next page of a previous /search (query/filters ignored)
+
+class SearchBatchReq(BaseModel):
+    requests: List[SearchReq] = Field(..., description="Requêtes /search à traiter en un seul appel")
 
 class CompareReq(BaseModel):
     topic: str = Field(..., description="Sujet/objet de la comparaison")
@@ -657,6 +1933,8 @@ class CompareReq(BaseModel):
     k_per_crit: Optional[int] = 3
     role: Optional[str] = None
     sector: Optional[str] = None
+    debug_timings: Optional[bool] = False
+    debug: Optional[bool] = False           # keep `_`-prefixed internals (e.g. _score in fallback evidence)
 
 # ---------------- FastAPI app ----------------
 app = FastAPI()
@@ -674,67 +1952,267 @@ def health():
         syn_count = r[0]["n"] if r else 0
     except Exception:
         syn_count = None
-    return {
-        "ok": True,
+    warming = WARM["state"] in ("pending", "running")
+    not_ready = warming and WARM["trigger"] == "startup"
+    body = {
+        "ok": not not_ready,
         "chunks": len(DOCS),
         "spans": len(SPANS) if HAS_SPANS else 0,
         "bm25": BM25 is not None,
+        "shards": len(SHARD_BOUNDS) or 1,
+        "dedup": DEDUP_STATS,
+        "suggest": {"names": len(SUGGEST_NAMES[0]), "terms": len(SUGGEST_TERMS[0])},
+        "spell": {"terms": len(SPELL_TERMS), "deletes": len(SPELL_DELETES)} if SPELL_ON else None,
         "tfidf_word": TFIDF_WORD is not None,
         "tfidf_char": TFIDF_CHAR is not None,
         "rerank": bool(RERANK_ENABLED and ce_model is not None),
         "model_ce": RERANK_MODEL_NAME if (RERANK_ENABLED and ce_model is not None) else None,
         "deep": bool(DEEP_ON),
+        "budget_ms_default": BUDGET_MS_DEFAULT,
+        "model_ce_small": FALLBACK_RERANK_MODEL if ce_small is not None else None,
+        "rerank_tiers": ce_tiers(),
         "mmr": {"doc_lambda": MMR_LAMBDA_DOC, "chunk_lambda": MMR_LAMBDA_CHUNK,
                 "doc_limit": MMR_LIMIT_DOC, "chunk_limit": MMR_LIMIT_CHUNK},
         "use_spans": bool(HAS_SPANS and USE_SPANS),
         "predict_next": bool(PREDICT_NEXT_ON),
-        "synonyms": syn_count
+        "synonyms": syn_count,
+        "index_generation": INDEX_GEN,
+        "metrics": PROM is not None,
+        "caches": cache_stats(),
+        "admission": {"search": ADMIT_SEARCH.stats(), "reindex": ADMIT_REINDEX.stats(),
+                      "warmup": ADMIT_WARMUP.stats(),
+                      "queue_timeout_ms": ADMIT_QUEUE_TIMEOUT_MS},
+        "pages": {"open": len(PAGES), "ttl_s": PAGE_TTL_S, "pool": PAGE_POOL},
+        "query_log": QUERY_LOG_PATH if QLOG is not None else None,
+        "warmup": WARM
     }
+    # not ready until the startup warm-up replay is over; a reindex warm-up never takes the
+    # instance out of the load balancer
+    return JSONResponse(body, status_code=503) if not_ready else body
+
+@app.get("/metrics")
+def metrics():
+    if PROM is None:
+        return PlainTextResponse("# prometheus_client not installed or PYSEARCH_METRICS=0\n", status_code=503)
+    return PlainTextResponse(PROM.generate_latest().decode("utf-8"), media_type=PROM.CONTENT_TYPE_LATEST)
+
+@app.get("/profiles/{name}")
+def get_profile(name: str, request: Request):
+    if not _profile_authorized(request):
+        raise HTTPException(status_code=403, detail="profiling disabled or bad token")
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="unknown profile")
+    return FileResponse(path, media_type="application/octet-stream", filename=os.path.basename(path))
 
 @app.post("/reindex")
 def reindex():
-    info = build_index()
-    return {"ok": True, **info}
+    with admitted(ADMIT_REINDEX) as adm:
+        info = build_index()
+    start_warm_up(trigger="reindex")
+    return {"ok": True, **info, "queue_wait_ms": adm.wait_ms}
 
 # ---------------- Deep candidates + rerank (multi-objectif) ----------------
-def deep_candidates(q: str, k: int, role: Optional[str], sector: Optional[str], next_terms: Optional[List[str]] = None) -> List[Dict[str,Any]]:
+# EWMA of CE cost (ms per pair) per tier; seeded with CPU ballparks, corrected by real calls
+_CE_MS_PER_PAIR = {"main": 30.0 if RERANK_MODEL_NAME != FALLBACK_RERANK_MODEL else 3.0, "small": 3.0}
+_CE_STATS = {"main": [0, 0, 0.0], "small": [0, 0, 0.0]}  # tier -> [calls, pairs, ms]
+
+def ce_predict(pairs: List[Tuple[str, str]], tier: str = "main") -> np.ndarray:
+    """Cross-encoder scoring with queue-depth gauge + stage timing. Small-tier logits are
+    mapped through a sigmoid so both tiers score in [0, 1] (the blend weights assume it)."""
+    model = ce_small if tier == "small" else ce_model
+    if PROM is not None: M_RERANK_DEPTH.inc()
+    try:
+        t0 = time.perf_counter()
+        with timed("rerank" if tier == "main" else "rerank_small"):
+            out = model.predict(pairs, convert_to_numpy=True, show_progress_bar=False)
+        if tier == "small" and CE_SMALL_LOGITS:
+            out = expit(np.asarray(out, dtype=float))
+        if pairs:
+            ms = (time.perf_counter() - t0) * 1000
+            _CE_MS_PER_PAIR[tier] = 0.8 * _CE_MS_PER_PAIR[tier] + 0.2 * ms / len(pairs)
+            st = _CE_STATS[tier]
+            st[0] += 1; st[1] += len(pairs); st[2] += ms
+        return out
+    finally:
+        if PROM is not None: M_RERANK_DEPTH.dec()
+
+def ce_cascade(pairs: List[Tuple[str, str]], bounds: Optional[List[Tuple[int, int]]] = None) -> np.ndarray:
+    """Small CE over every pair, main CE over the CASCADE_TOP best of each [a, b) group
+    (one call per tier for a whole batch). In the top slice the score is the blend of both
+    (ce_predict puts the small tier on the large model's [0, 1] sigmoid scale); below it the
+    small score, capped under the slice's minimum so an item the large model never saw
+    cannot overtake one it vetted."""
+    bounds = bounds or [(0, len(pairs))]
+    small = np.asarray(ce_predict(pairs, tier="small"), dtype=float)
+    tops = []
+    for a, b in bounds:
+        tops.append(a + np.argsort(-small[a:b], kind="stable")[:CASCADE_TOP])
+    idx = np.concatenate(tops) if tops else np.zeros(0, dtype=int)
+    out = small.copy()
+    if len(idx):
+        large = np.asarray(ce_predict([pairs[i] for i in idx], tier="main"), dtype=float)
+        out[idx] = CASCADE_BLEND * large + (1 - CASCADE_BLEND) * small[idx]
+    for (a, b), top in zip(bounds, tops):
+        if len(top) < b - a:
+            rest = np.setdiff1d(np.arange(a, b), top)
+            out[rest] = np.minimum(out[rest], out[top].min() - 1e-6)
+    return out
+
+def ce_tiers() -> Dict[str, Any]:
+    """Load state + cumulative timings per CE tier (/health)."""
+    def tier(name, model, key):
+        calls, pairs, ms = _CE_STATS[key]
+        return {"model": name, "loaded": model is not None, "calls": calls, "pairs": pairs,
+                "total_ms": round(ms, 1), "ms_per_pair_ewma": round(_CE_MS_PER_PAIR[key], 3)}
+    return {
+        "main": tier(RERANK_MODEL_NAME, ce_model, "main"),
+        "small": tier(FALLBACK_RERANK_MODEL, ce_small, "small"),
+        "cascade": {"on": bool(RERANK_CASCADE and ce_small is not None), "top": CASCADE_TOP, "blend": CASCADE_BLEND},
+    }
+
+# ---------------- Latency budget ----------------
+class Budget:
+    """Per-request latency budget; stages ask it how much work still fits."""
+    def __init__(self, ms: float):
+        self.ms = float(ms)
+        self.t0 = time.perf_counter()
+        self.applied: List[str] = []
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000
+    def remaining_ms(self) -> float:
+        return self.ms - self.elapsed_ms()
+    def over(self, share: float) -> bool:
+        return self.elapsed_ms() >= self.ms * share
+    def degrade(self, step: str):
+        self.applied.append(step)
+        if PROM is not None:
+            M_DEGRADE.labels(step.split(":", 1)[0]).inc()
+    def report(self) -> Dict[str, Any]:
+        return {"budget_ms": self.ms, "elapsed_ms": round(self.elapsed_ms(), 3), "degradations": self.applied}
+
+def plan_rerank(budget: Optional[Budget], n: int) -> Tuple[Optional[str], int]:
+    """Pick (tier, pool size) that fits the remaining budget: main model (or the cascade)
+    on the full pool, then a smaller pool, then the small model, else (None, 0) = no rerank."""
+    cascade = RERANK_CASCADE and ce_small is not None
+    if budget is None:
+        return ("cascade" if cascade else "main"), n
+    avail = budget.remaining_ms() - 0.1 * budget.ms  # keep room for MMR + evidence
+    if cascade and n * _CE_MS_PER_PAIR["small"] + min(n, CASCADE_TOP) * _CE_MS_PER_PAIR["main"] <= avail:
+        return "cascade", n
+    fit_main = int(avail / max(_CE_MS_PER_PAIR["main"], 1e-3))
+    if fit_main >= n:
+        return "main", n  # cascade did not fit but the whole pool does: nothing dropped
+    if fit_main >= min(n, BUDGET_MIN_POOL):
+        budget.degrade(f"rerank_pool:{fit_main}/{n}")
+        return "main", fit_main
+    if ce_small is not None:
+        fit_small = min(n, int(avail / max(_CE_MS_PER_PAIR["small"], 1e-3)))
+        if fit_small >= min(n, BUDGET_MIN_POOL):
+            budget.degrade("rerank_model:small")
+            if fit_small < n:
+                budget.degrade(f"rerank_pool:{fit_small}/{n}")
+            return "small", fit_small
+    budget.degrade("rerank:skipped")
+    return None, 0
+
+def hybrid_candidates(q: str, k: int, role: Optional[str], sector: Optional[str], next_terms: Optional[List[str]] = None, budget: Optional[Budget] = None, rows: Optional[np.ndarray] = None, plan_out: Optional[Dict[str, Any]] = None, depth: int = 0) -> List[Dict[str,Any]]:
+    """First stage: sub-query blended hybrid scores -> top baseK items (lexical only).
+    `depth` keeps a deeper pool (cursor pagination); callers rank only the first baseK."""
+    if rows is not None and len(rows) == 0:
+        return []
+    S = aggregate_over_subqueries(q, role, sector, next_terms=next_terms, budget=budget, rows=rows, plan_out=plan_out)
+    return top_items(S, max(k, depth), rows=rows)
+
+def top_items(S: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> List[Dict[str,Any]]:
+    """Top baseK of S; S is aligned to `rows` when the search was filtered."""
     baseK = max(k, RERANK_KEEP) if RERANK_ENABLED else k
-    S = aggregate_over_subqueries(q, role, sector, next_terms=next_terms)
     # take top baseK by score
     if len(S) == 0: return []
-    kprime = min(max(baseK, 1), len(S))
-    idx = np.argpartition(-S, kprime - 1)[:kprime]
-    idx = idx[np.argsort(-S[idx])]
+    with timed("topk"):
+        kprime = min(max(baseK, 1), len(S))
+        idx = _topk(S, kprime)
 
     prelim = []
-    for i in idx:
-        r = DOCS[i]
+    alias = getattr(rows, "alias", None) or {}
+    for j in idx:
+        i = int(j if rows is None else rows[j])
+        r = alias.get(i) or DOCS[i]
         prelim.append({
             "chunk_id": r["chunk_id"],
             "doc_id": str(r["doc_id"]),
             "filename": r.get("filename"),
             "chunk_index": r.get("chunk_index"),
-            "score": float(S[i]),
-            "codes": CODES[i],
+            "score": float(S[j]),
+            "codes": r["_codes"] if i in alias else CODES[i],
             "snippet": (r.get("content") or "")[:900],
             "page": r.get("page"),
             "section_title": r.get("section_title")
         })
+        if i in DUP_MEMBERS:
+            prelim[-1]["dup_count"] = len(DUP_MEMBERS[i])
+    return prelim
 
+def expand_duplicates(items: List[Dict[str,Any]]) -> List[Dict[str,Any]]:
+    """Attach the collapsed near-duplicate chunks of each item (SearchReq.expand_duplicates)."""
+    for it in items:
+        if not it.get("dup_count"): continue
+        i = CHUNK_ROW.get(it["chunk_id"])
+        if i is None: continue
+        # the rest of the cluster (the item may be a member presented by a filter)
+        it["duplicates"] = [{"chunk_id": m["chunk_id"], "doc_id": str(m["doc_id"]), "filename": m.get("filename"),
+                             "chunk_index": m.get("chunk_index"), "page": m.get("page")}
+                            for m in [DOCS[i]] + DUP_MEMBERS.get(i, []) if m["chunk_id"] != it["chunk_id"]]
+    return items
+
+def _topk(S: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k best scores, descending; per-shard partial top-k then a merge when sharded."""
+    if SHARD_BOUNDS and len(S) == len(DOCS) and len(SHARD_BOUNDS) > 1:
+        def local(b):
+            lo, hi = b
+            kk = min(k, hi - lo)
+            return lo + np.argpartition(-S[lo:hi], kk - 1)[:kk]
+        cand = np.concatenate(_fan_out(local, SHARD_BOUNDS))
+    else:
+        cand = np.arange(len(S))
+    if len(cand) > k:
+        cand = cand[np.argpartition(-S[cand], k - 1)[:k]]
+    return cand[np.argsort(-S[cand])]
+
+def rerank_pairs(q: str, items: List[Dict[str,Any]]) -> List[Tuple[str, str]]:
+    pool = items[:min(len(items), RERANK_CAND)]
+    return [(q, f"{it['filename']} — {it.get('snippet','')}") for it in pool]
+
+def rank_candidates(q: str, k: int, prelim: List[Dict[str,Any]], ce_scores: Optional[np.ndarray] = None, budget: Optional[Budget] = None) -> List[Dict[str,Any]]:
+    """Second stage: coverage, cross-encoder blend (optional) and two-stage MMR.
+    `ce_scores` lets /search/batch pass scores computed in a shared CE batch."""
     # coverage par doc (contrat de preuve light, basé sur spans)
-    for it in prelim:
-        cov = 0.0
-        if HAS_SPANS and USE_SPANS:
-            spans = best_spans_for(it["doc_id"], q, limit=SPANS_TOP)
-            cov = min(len(spans) / float(max(1, SPANS_TOP)), 1.0)
-        it["_coverage"] = float(cov)
+    with_cov = HAS_SPANS and USE_SPANS
+    if with_cov and budget is not None and budget.over(BUDGET_COVERAGE_SHARE):
+        budget.degrade("coverage:skipped")
+        with_cov = False
+    with timed("coverage"):
+        for it in prelim:
+            cov = 0.0
+            if with_cov:
+                spans = best_spans_for(it["doc_id"], q, limit=SPANS_TOP)
+                cov = min(len(spans) / float(max(1, SPANS_TOP)), 1.0)
+            it["_coverage"] = float(cov)
 
     # rerank (optional) + multi-objectif
     items = prelim
+    tier, n_pool = None, 0
     if RERANK_ENABLED and ce_model is not None and items:
-        pool = items[:min(len(items), RERANK_CAND)]
-        pairs = [(q, f"{it['filename']} — {it.get('snippet','')}") for it in pool]
-        scores = ce_model.predict(pairs, convert_to_numpy=True, show_progress_bar=False)
+        n_pool = min(len(items), RERANK_CAND)
+        tier, n_pool = ("main", n_pool) if ce_scores is not None else plan_rerank(budget, n_pool)
+    if tier is not None:
+        pool, rest = items[:n_pool], items[n_pool:]
+        if ce_scores is not None:
+            scores = ce_scores
+        elif tier == "cascade":
+            scores = ce_cascade(rerank_pairs(q, pool))
+        else:
+            scores = ce_predict(rerank_pairs(q, pool), tier=tier)
         # Blend multi-objectif
         n_has_code = re.search(r"\b(sop|qd-sop|n[12]\d{3}-\d|idr)\b", norm(q)) is not None
         for it, sc in zip(pool, scores):
@@ -751,7 +2229,11 @@ def deep_candidates(q: str, k: int, role: Optional[str], sector: Optional[str],
             δ = 0.05
             it["score_final"] = α*ce + β*cov + γ*codeb + δ*roleb + (1 - RERANK_ALPHA) * float(it.get("score", 0.0)) * 0.10
         pool.sort(key=lambda x: x["score_final"], reverse=True)
-        items = pool[:max(k, RERANK_KEEP)]
+        # budget-shrunk pool: the non-reranked tail keeps its hybrid order below the pool
+        floor = pool[-1]["score_final"] if pool else 0.0
+        for it in rest:
+            it["score_final"] = floor
+        items = (pool + rest)[:max(k, RERANK_KEEP)]
     else:
         # Pas de CE : on mélange hybrid normalisé + coverage + codeb
         for it in items:
@@ -763,41 +2245,346 @@ def deep_candidates(q: str, k: int, role: Optional[str], sector: Optional[str],
 
     # two-stage MMR pour stabilité/diversité
     if DEEP_ON and items:
-        items = mmr_two_stage(items, k, q)
+        with timed("mmr"):
+            items = mmr_two_stage(items, k, q)
 
     return items[:k]
 
-@app.post("/search")
-def search(req: SearchReq):
-    ensure_index()
+def deep_candidates(q: str, k: int, role: Optional[str], sector: Optional[str], next_terms: Optional[List[str]] = None, budget: Optional[Budget] = None, rows: Optional[np.ndarray] = None, plan_out: Optional[Dict[str, Any]] = None) -> List[Dict[str,Any]]:
+    prelim = hybrid_candidates(q, k, role, sector, next_terms=next_terms, budget=budget, rows=rows, plan_out=plan_out)
+    return rank_candidates(q, k, prelim, budget=budget)
+
+def attach_evidence(items: List[Dict[str,Any]], q: str, budget: Optional[Budget] = None) -> List[Dict[str,Any]]:
+    """Attach top spans (evidence) per item doc (optional)."""
+    enriched = []
+    seen_doc_span = {}
+    with_ev = HAS_SPANS and USE_SPANS
+    if with_ev and budget is not None and budget.over(BUDGET_EVIDENCE_SHARE):
+        budget.degrade("evidence:skipped")
+        with_ev = False
+    with timed("evidence"):
+        for it in items:
+            ev = []
+            # one call per doc (cache within request)
+            if with_ev:
+                hit = it["doc_id"] in seen_doc_span
+                cache_lookup("evidence_spans", hit)
+                if not hit:
+                    seen_doc_span[it["doc_id"]] = best_spans_for(it["doc_id"], q, limit=SPANS_TOP)
+                ev = seen_doc_span[it["doc_id"]]
+            enriched.append({**it, "evidence": ev})
+    return enriched
+
+def _wants_evidence(req: SearchReq) -> bool:
+    return req.fields is None or "evidence" in req.fields
+
+def _project(req: SearchReq, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return project_items(items, req.fields, req.snippet_len, bool(req.debug))
+
+def _search_budget(req: SearchReq) -> Optional[Budget]:
+    ms = req.budget_ms if req.budget_ms is not None else BUDGET_MS_DEFAULT
+    return Budget(ms) if ms and ms > 0 else None
+
+def _search_params(req: SearchReq) -> Tuple[str, int, List[str], List[Dict[str, Any]]]:
     q = normalize_codes(req.query or "")
     k = max(10, min(200, req.k or TOPK_DEFAULT))
-
+    corrections = []
+    if req.spell is not False:
+        q, corrections = spell_correct(q)
     # next_terms: priorité à celles du client, sinon petite anticipation locale
     next_terms = (req.next_terms or [])[:5]
     if not next_terms:
         next_terms = predict_next_terms(q, None, limit=5)
+    return q, k, next_terms, corrections
+
+# ---------------- Result pages (cursor pagination) ----------------
+class PageState:
+    """Server-side state behind a cursor: ranked items so far + the unranked first-stage tail."""
+    def __init__(self, q: str, kk: int, ranked: List[Dict[str,Any]], tail: List[Dict[str,Any]]):
+        self.q, self.kk = q, kk
+        self.ranked, self.tail = ranked, tail
+        self.gen = INDEX_GEN
+        self.expires = time.time() + PAGE_TTL_S
+        self.lock = threading.Lock()
+
+    def extend(self, need: int):
+        """Rank further batches of the tail until `need` items are ranked (or the pool runs out)."""
+        while len(self.ranked) < need and self.tail:
+            batch, self.tail = self.tail[:self.kk], self.tail[self.kk:]
+            more = rank_candidates(self.q, self.kk, batch)
+            got = {it["chunk_id"] for it in more}
+            self.ranked += more
+            # MMR leftovers stay eligible for the next batch
+            self.tail = [it for it in batch if it["chunk_id"] not in got] + self.tail
+
+PAGES: Dict[str, PageState] = {}
+_PAGES_LOCK = threading.Lock()
+
+def page_open(q: str, k: int, kk: int, prelim: List[Dict[str,Any]], ranked: List[Dict[str,Any]]) -> Optional[str]:
+    """Register a ranked result list; returns its token (None when cursors are off or one page holds it all)."""
+    if PAGE_TTL_S <= 0 or (len(ranked) <= k and len(prelim) <= len(ranked)):
+        return None
+    got = {it["chunk_id"] for it in ranked}
+    st = PageState(q, kk, list(ranked), [it for it in prelim if it["chunk_id"] not in got])
+    token = secrets.token_urlsafe(12)
+    now = time.time()
+    with _PAGES_LOCK:
+        for t in [t for t, p in PAGES.items() if p.expires < now or p.gen != INDEX_GEN]:
+            del PAGES[t]
+        while len(PAGES) >= PAGE_CACHE_MAX:
+            del PAGES[next(iter(PAGES))]   # oldest first (insertion order)
+        PAGES[token] = st
+    return token
+
+def encode_cursor(token: Optional[str], offset: int, st: Optional[PageState]) -> Optional[str]:
+    if token is None or st is None or (offset >= len(st.ranked) and not st.tail):
+        return None
+    raw = json.dumps({"t": token, "o": offset, "g": st.gen}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def page_fetch(cursor: str, k: int) -> Tuple[PageState, List[Dict[str,Any]], Optional[str], int]:
+    """(state, items of the page, next cursor, offset) for a cursor; 400 if malformed, 410 if gone."""
+    try:
+        c = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        token, offset, gen = str(c["t"]), int(c["o"]), int(c["g"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="malformed cursor")
+    with _PAGES_LOCK:
+        st = PAGES.get(token)
+    hit = st is not None and gen == INDEX_GEN and st.gen == INDEX_GEN and st.expires >= time.time()
+    cache_lookup("pages", hit)
+    if not hit:
+        raise HTTPException(status_code=410, detail="cursor expired or index rebuilt; search again")
+    with st.lock:
+        st.expires = time.time() + PAGE_TTL_S
+        with timed("page_rank"):
+            st.extend(offset + k)
+        items = st.ranked[offset:offset + k]
+    return st, items, encode_cursor(token, offset + len(items), st), offset
+
+def search_page(req: SearchReq, request: Request = None):
+    """/search with a cursor: slice the stored ranking, no first-stage scoring."""
+    with admitted(ADMIT_SEARCH) as adm, request_timer("search_page") as rt:
+        k = max(10, min(200, req.k or TOPK_DEFAULT))
+        st, items, nxt, offset = page_fetch(req.cursor, k)
+        items = [dict(it) for it in items]
+        enriched = attach_evidence(items, st.q) if _wants_evidence(req) else items
+        if req.expand_duplicates:
+            expand_duplicates(enriched)
+        out = {"ok": True, "items": _project(req, enriched), "cursor": nxt, "offset": offset,
+               "queue_wait_ms": adm.wait_ms}
+    if req.debug_timings:
+        out["debug_timings"] = rt.report()
+    log_query("search_page", {"q": anonymize_query(st.q), "k": k, "offset": offset}, rt.total * 1000, len(out["items"]))
+    return json_response(out)
 
-    items = deep_candidates(
-        q,
-        max(k, RERANK_KEEP) if RERANK_ENABLED else k,
-        req.role, req.sector,
-        next_terms=next_terms
-    )
-
-    # attach top spans (evidence) per item doc (optional)
-    enriched = []
-    seen_doc_span = {}
-    for it in items:
-        ev = []
-        # one call per doc (cache within request)
-        if HAS_SPANS and USE_SPANS:
-            if it["doc_id"] not in seen_doc_span:
-                seen_doc_span[it["doc_id"]] = best_spans_for(it["doc_id"], q, limit=SPANS_TOP)
-            ev = seen_doc_span[it["doc_id"]]
-        enriched.append({**it, "evidence": ev})
+@app.post("/search")
+def search(req: SearchReq, request: Request = None):
+    if req.cursor:
+        return search_page(req, request)
+    prof = profile_scope(request, "search")
+    with admitted(ADMIT_SEARCH) as adm, prof, request_timer("search") as rt:
+        ensure_index()
+        budget = _search_budget(req)
+        q, k, next_terms, corrections = _search_params(req)
+
+        rows = resolve_filters(req.filters)
+        plan = {} if req.debug else None
+
+        kk = max(k, RERANK_KEEP) if RERANK_ENABLED else k
+        paginate = bool(req.paginate) and PAGE_TTL_S > 0
+        prelim = hybrid_candidates(q, kk, req.role, req.sector, next_terms=next_terms, budget=budget,
+                                   rows=rows, plan_out=plan, depth=PAGE_POOL if paginate else 0)
+        items = rank_candidates(q, kk, prelim[:kk], budget=budget)
+        token = page_open(q, k, kk, prelim, items) if paginate else None
+
+        page = [dict(it) for it in items[:k]] if token else items[:k]
+        enriched = attach_evidence(page, q, budget=budget) if _wants_evidence(req) else page
+        out = {"ok": True, "anticipated_terms": next_terms, "items": enriched, "queue_wait_ms": adm.wait_ms}
+        if paginate:
+            out["cursor"] = encode_cursor(token, len(page), PAGES.get(token) if token else None)
+        if req.expand_duplicates:
+            expand_duplicates(out["items"])
+        out["items"] = _project(req, out["items"])
+        if corrections:
+            out["corrections"] = corrections
+            out["corrected_query"] = q
+        if plan is not None:
+            out["plan"] = plan
+        if rows is not None:
+            out["filtered_rows"] = int(len(rows))
+        if budget is not None:
+            out["budget"] = budget.report()
+            out["degradations"] = budget.applied
+    log_query("search", search_log_fields(req), rt.total * 1000, len(out["items"]))
+    if req.debug_timings:
+        out["debug_timings"] = rt.report()
+    prof.attach(out)
+    return json_response(out)
+
+BATCH_UNSUPPORTED = ("cursor", "paginate", "budget_ms")
+
+@app.post("/search/batch")
+def search_batch(req: SearchBatchReq):
+    """Many /search calls in one: shared TF-IDF transforms/products, shared CE batches."""
+    bad = [{"index": i, "fields": f} for i, r in enumerate(req.requests[:BATCH_MAX])
+           if (f := [n for n in BATCH_UNSUPPORTED if getattr(r, n)])]
+    if bad:
+        raise HTTPException(status_code=422, detail={"msg": "not supported in /search/batch; use /search", "requests": bad})
+    with admitted(ADMIT_SEARCH) as adm, request_timer("search_batch") as rt:
+        ensure_index()
+        plans, filt, fixes, reports = [], [], [], []
+        for r in req.requests[:BATCH_MAX]:
+            q, k, next_terms, corrections = _search_params(r)
+            with timed("subqueries"):
+                plan, report = plan_subqueries(q, [q] + generate_subqueries(q, next_terms=next_terms))
+            plans.append((r, q, k, next_terms, plan))
+            reports.append(report)
+            fixes.append(corrections)
+            filt.append(resolve_filters(r.filters))
+
+        # 1) all distinct sub-queries -> one transform + one sparse product per TF-IDF matrix
+        uniq = list(dict.fromkeys(sq for p in plans for sq, _w in p[4]))
+        col = {sq: j for j, sq in enumerate(uniq)}
+        W, C = tfidf_batch(uniq) if uniq else (None, None)
+        zeros = np.zeros(len(DOCS))
+        def tf_cols(sq):
+            j = col[sq]
+            w = W[:, j].toarray().ravel() if W is not None else zeros
+            c = C[:, j].toarray().ravel() if C is not None else zeros
+            return w, c
+
+        # hybrid per (sub-query, role, sector), kept only while another plan still needs it
+        # (filtered requests score their own row subset and are not shared)
+        refs: Dict[Tuple, int] = {}
+        for (r, _q, _k, _nt, plan), rows in zip(plans, filt):
+            if rows is not None: continue
+            for sq, _w in plan:
+                refs[(sq, r.role, r.sector)] = refs.get((sq, r.role, r.sector), 0) + 1
+        memo: Dict[Tuple, np.ndarray] = {}
+        def hybrid(sq, r, rows):
+            if rows is not None:
+                w, c = tf_cols(sq)
+                return score_hybrid_single(sq, r.role, r.sector, tf=(w[rows], c[rows]), rows=rows)
+            key = (sq, r.role, r.sector)
+            S = memo.get(key)
+            if S is None:
+                S = score_hybrid_single(sq, r.role, r.sector, tf=tf_cols(sq))
+            refs[key] -= 1
+            if refs[key] > 0: memo[key] = S
+            else: memo.pop(key, None)
+            return S
+
+        prelims = []
+        for (r, q, k, _nt, plan), rows in zip(plans, filt):
+            kk = max(k, RERANK_KEEP) if RERANK_ENABLED else k
+            if rows is not None and len(rows) == 0:
+                prelims.append((kk, []))
+                continue
+            S = blend_subqueries(plan, lambda sq: hybrid(sq, r, rows), n=len(_view(rows)))
+            prelims.append((kk, top_items(S, kk, rows=rows)))
+
+        # 2) one cross-encoder call over every query's rerank pool
+        ce_split: List[Optional[np.ndarray]] = [None] * len(plans)
+        if RERANK_ENABLED and ce_model is not None:
+            all_pairs, bounds = [], []
+            for (r, q, *_), (_kk, prelim) in zip(plans, prelims):
+                pairs = rerank_pairs(q, prelim)
+                bounds.append((len(all_pairs), len(all_pairs) + len(pairs)))
+                all_pairs.extend(pairs)
+            if all_pairs:
+                scores = ce_cascade(all_pairs, bounds) if RERANK_CASCADE and ce_small is not None else ce_predict(all_pairs)
+                ce_split = [scores[a:b] for a, b in bounds]
+
+        # 3) per query: coverage / blend / MMR / evidence, same payload as /search
+        results = []
+        for (r, q, k, next_terms, _plan), (kk, prelim), ce, corrections, report in zip(plans, prelims, ce_split, fixes, reports):
+            items = rank_candidates(q, kk, prelim, ce_scores=ce)
+            items = attach_evidence(items, q) if _wants_evidence(r) else items
+            res = {"ok": True, "anticipated_terms": next_terms, "items": items[:k]}
+            if r.expand_duplicates:
+                expand_duplicates(res["items"])
+            res["items"] = _project(r, res["items"])
+            if corrections:
+                res["corrections"] = corrections
+                res["corrected_query"] = q
+            if r.debug:
+                res["plan"] = report
+            results.append(res)
+
+        out = {"ok": True, "count": len(results), "truncated": len(req.requests) > BATCH_MAX, "results": results,
+               "queue_wait_ms": adm.wait_ms}
+    # batch entries are logged as individual searches sharing the batch latency
+    for r, res in zip(req.requests, results):
+        log_query("search_batch", search_log_fields(r), rt.total * 1000, len(res["items"]))
+    if any(r.debug_timings for r in req.requests):
+        out["debug_timings"] = rt.report()
+    return json_response(out)
+
+def _ndjson(obj: Dict[str, Any]) -> bytes:
+    if ORJSON is not None:
+        return ORJSON.dumps(obj, option=ORJSON.OPT_SERIALIZE_NUMPY | ORJSON.OPT_APPEND_NEWLINE, default=str)
+    return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+@app.post("/search/stream")
+def search_stream(req: SearchReq):
+    """Progressive /search: lexical top-k first, then the reranked/MMR list, then evidence per doc."""
+    ensure_index()
+    # admit before the response starts so shedding is a real 503; the slot is held until
+    # the stream finishes or the client disconnects
+    adm = admitted(ADMIT_SEARCH).__enter__()
+
+    def events():
+        t0 = time.perf_counter()
+        el = lambda: round((time.perf_counter() - t0) * 1000, 3)
+        budget = _search_budget(req)
+        q, k, next_terms, corrections = _search_params(req)
+        kk = max(k, RERANK_KEEP) if RERANK_ENABLED else k
+        rows = resolve_filters(req.filters)
+        plan = {} if req.debug else None
+        prelim = hybrid_candidates(q, kk, req.role, req.sector, next_terms=next_terms, budget=budget, rows=rows, plan_out=plan)
+        ev_hybrid = {"event": "hybrid", "t_ms": el(), "queue_wait_ms": adm.wait_ms, "corrections": corrections,
+                     "anticipated_terms": next_terms, "items": _project(req, prelim[:k])}
+        if corrections:
+            ev_hybrid["corrected_query"] = q
+        if plan is not None:
+            ev_hybrid["plan"] = plan
+        yield _ndjson(ev_hybrid)
+
+        items = rank_candidates(q, kk, prelim, budget=budget)[:k]
+        if req.expand_duplicates:
+            expand_duplicates(items)
+        yield _ndjson({"event": "ranked", "t_ms": el(), "items": _project(req, items)})
+
+        with_ev = HAS_SPANS and USE_SPANS and _wants_evidence(req)
+        if with_ev and budget is not None and budget.over(BUDGET_EVIDENCE_SHARE):
+            budget.degrade("evidence:skipped")
+            with_ev = False
+        if with_ev:
+            seen = set()
+            for it in items:
+                if it["doc_id"] in seen: continue
+                seen.add(it["doc_id"])
+                with timed("evidence"):
+                    ev = best_spans_for(it["doc_id"], q, limit=SPANS_TOP)
+                yield _ndjson({"event": "evidence", "t_ms": el(), "doc_id": it["doc_id"], "evidence": ev})
+
+        done = {"event": "done", "t_ms": el(), "count": len(items)}
+        if budget is not None:
+            done["budget"] = budget.report()
+        yield _ndjson(done)
+        if PROM is not None:
+            M_REQUEST.labels("search_stream").observe(time.perf_counter() - t0)
+        log_query("search_stream", search_log_fields(req), el(), len(items))
+
+    def gen():
+        try:
+            yield from events()
+        finally:
+            adm.release()
 
-    return {"ok": True, "anticipated_terms": next_terms, "items": enriched[:k]}
+    # background release covers a client that disconnects before the body is iterated
+    return StreamingResponse(gen(), media_type="application/x-ndjson", background=BackgroundTask(adm.release))
 
 # --------- /compare: evidence matrix across docs ----------
 DEFAULT_CRITERIA = [
@@ -816,61 +2603,100 @@ def _criteria_for_topic(topic: str, lang: str) -> List[str]:
     return DEFAULT_CRITERIA
 
 @app.post("/compare")
-def compare(req: CompareReq):
-    ensure_index()
-    topic = normalize_codes(req.topic or "")
-    lang = guess_lang(topic)
-    crits = req.criteria or _criteria_for_topic(topic, "en" if lang=="en" else "fr")
-    kpc = max(1, min(6, req.k_per_crit or 3))
-
-    # For each doc & criterion, fetch top spans or fallback to chunk snippet
-    matrix = []
-    cover_counts = {doc_id: 0 for doc_id in req.doc_ids}
-
-    for crit in crits:
-        row = {"criterion": crit, "docs": []}
-        subq = f"{topic} {crit}"
-        # we want targeted spans: try spans first for each doc
-        for doc_id in req.doc_ids:
-            ev = best_spans_for(doc_id, subq, limit=kpc) if (HAS_SPANS and USE_SPANS) else []
-            if not ev:
-                # fallback: pick best chunk snippet of that doc by our hybrid score
-                S = score_hybrid_single(subq, req.role, req.sector)
-                # restrict to doc_id
-                pairs = []
-                for i, r in enumerate(DOCS):
-                    if str(r["doc_id"]) == str(doc_id):
-                        pairs.append((S[i], i))
-                pairs.sort(reverse=True, key=lambda x: x[0])
-                top_snips = []
-                for sc, i in pairs[:kpc]:
-                    r = DOCS[i]
-                    top_snips.append({
-                        "text": (r.get("content") or "")[:350],
-                        "page": r.get("page"), "bbox": None,
-                        "chunk_index": r.get("chunk_index"), "span_index": None,
-                        "_score": float(sc)
-                    })
-                ev = top_snips
-            cover_counts[doc_id] += int(len(ev) > 0)
-            row["docs"].append({"doc_id": doc_id, "evidence": ev})
-        matrix.append(row)
-
-    # Simple answerability per doc
-    answerability = {doc_id: answerability_label([cover_counts[doc_id]], need=1) for doc_id in req.doc_ids}
-
-    return {
-        "ok": True,
-        "topic": topic,
-        "criteria": crits,
-        "matrix": matrix,
-        "answerability": answerability
-    }
+def compare(req: CompareReq, request: Request = None):
+    prof = profile_scope(request, "compare")
+    with admitted(ADMIT_SEARCH) as adm, prof, request_timer("compare") as rt:
+        ensure_index()
+        topic = normalize_codes(req.topic or "")
+        lang = guess_lang(topic)
+        crits = req.criteria or _criteria_for_topic(topic, "en" if lang=="en" else "fr")
+        kpc = max(1, min(6, req.k_per_crit or 3))
+
+        # For each doc & criterion, fetch top spans or fallback to chunk snippet
+        matrix = []
+        cover_counts = {doc_id: 0 for doc_id in req.doc_ids}
+
+        for crit in crits:
+            row = {"criterion": crit, "docs": []}
+            subq = f"{topic} {crit}"
+            # we want targeted spans: try spans first for each doc
+            for doc_id in req.doc_ids:
+                with timed("compare_spans"):
+                    ev = best_spans_for(doc_id, subq, limit=kpc) if (HAS_SPANS and USE_SPANS) else []
+                if not ev:
+                    # fallback: pick best chunk snippet of that doc by our hybrid score
+                    # restrict to doc_id: score only that document's rows
+                    rows = DOC_ROWS.get(str(doc_id))
+                    pairs = []
+                    if rows is not None:
+                        S = score_hybrid_single(subq, req.role, req.sector, rows=rows)
+                        pairs = list(zip(S.tolist(), rows.tolist()))
+                    pairs.sort(reverse=True, key=lambda x: x[0])
+                    top_snips = []
+                    for sc, i in pairs[:kpc]:
+                        r = row_entity(i, doc_id)
+                        top_snips.append({
+                            "text": (r.get("content") or "")[:350],
+                            "page": r.get("page"), "bbox": None,
+                            "chunk_index": r.get("chunk_index"), "span_index": None,
+                            "_score": float(sc)
+                        })
+                    ev = top_snips
+                cover_counts[doc_id] += int(len(ev) > 0)
+                row["docs"].append({"doc_id": doc_id, "evidence": ev})
+            matrix.append(row)
+
+        # Simple answerability per doc
+        answerability = {doc_id: answerability_label([cover_counts[doc_id]], need=1) for doc_id in req.doc_ids}
+
+        out = {
+            "ok": True,
+            "topic": topic,
+            "criteria": crits,
+            "matrix": matrix,
+            "answerability": answerability,
+            "queue_wait_ms": adm.wait_ms
+        }
+    log_query("compare", {"q": anonymize_query(req.topic), "doc_ids": req.doc_ids, "criteria": req.criteria,
+                          "k_per_crit": req.k_per_crit, "role": req.role, "sector": req.sector},
+              rt.total * 1000, len(matrix))
+    if not req.debug:
+        out = _strip_internal(out)
+    if req.debug_timings:
+        out["debug_timings"] = rt.report()
+    prof.attach(out)
+    return json_response(out)
+
+# --------- /suggest: prefix autocomplete ----------
+SUGGEST_KINDS = ("code", "file", "term")
+
+@app.get("/suggest")
+def suggest(q: str = "", limit: int = 10, kinds: Optional[str] = None):
+    """Type-ahead over codes, filenames (whole input as prefix) and frequent terms (last word).
+    Answers from the RAM prefix indexes only; never runs the scoring pipeline."""
+    with timed("suggest"):
+        limit = max(1, min(limit, SUGGEST_LIMIT_MAX))
+        want = set((kinds or ",".join(SUGGEST_KINDS)).split(","))
+        p = fn_key(q)
+        items: List[Dict[str, Any]] = []
+        if want & {"code", "file"}:
+            for w, it in prefix_lookup(SUGGEST_NAMES, p, limit * 2 if len(want) > 1 else limit):
+                if it["kind"] in want:
+                    items.append({**it, "weight": w})
+            # identifiers first, then documents
+            items.sort(key=lambda it: it["kind"] != "code")
+        if "term" in want and p and not p.endswith(" "):
+            head, _sp, last = p.rpartition(" ")
+            for w, it in prefix_lookup(SUGGEST_TERMS, last, limit):
+                if it["text"] != last:
+                    items.append({"text": (head + " " if head else "") + it["text"], "kind": "term", "weight": w})
+        return {"ok": True, "q": q, "items": items[:limit]}
 
 # ---------------- Autostart indexing ----------------
 if os.getenv("PYSEARCH_AUTOINDEX", "1").lower() not in ("0", "false", "no"):
     try:
         build_index()
+        start_warm_up()
     except Exception as e:
         print(f"[pysearch] Delayed index build (will build on first /search): {e}")
 
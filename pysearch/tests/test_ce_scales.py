@@ -0,0 +1,69 @@
+# Cross-encoder tiers score on one scale: stub models with the real models' output ranges
+#   cd pysearch && python -m pytest -q tests
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("PYSEARCH_AUTOINDEX", "0")
+os.environ.setdefault("PYSEARCH_RERANK", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pysearch_service as svc
+
+
+class Identity:  # CrossEncoder.default_activation_function of ms-marco MiniLM
+    pass
+
+
+class StubCE:
+    """predict() -> fixed score per passage, like CrossEncoder.predict"""
+    def __init__(self, scores, activation=None):
+        self.scores = scores
+        self.default_activation_function = activation
+        self.seen = []
+
+    def predict(self, pairs, convert_to_numpy=True, show_progress_bar=False):
+        self.seen.append([p for _q, p in pairs])
+        return np.array([self.scores[p] for _q, p in pairs], dtype=np.float32)
+
+
+@pytest.fixture
+def tiers(monkeypatch):
+    # small: raw logits in about [-11, 9]; large: sigmoid output in [0, 1]
+    small = StubCE({"a": 9.0, "b": 6.0, "c": 3.0, "d": -2.0, "e": -11.0}, activation=Identity())
+    large = StubCE({"a": 0.05, "b": 0.95, "c": 0.60, "d": 0.99, "e": 0.99})
+    monkeypatch.setattr(svc, "ce_small", small)
+    monkeypatch.setattr(svc, "ce_model", large)
+    monkeypatch.setattr(svc, "CE_SMALL_LOGITS", True)
+    monkeypatch.setattr(svc, "CASCADE_TOP", 3)
+    monkeypatch.setattr(svc, "CASCADE_BLEND", 0.7)
+    return small, large
+
+
+def test_small_tier_is_sigmoid_scaled(tiers):
+    out = svc.ce_predict([("q", p) for p in "abcde"], tier="small")
+    assert np.all((out > 0) & (out < 1))
+    assert np.all(np.diff(out) < 0)  # order of the logits kept
+
+
+def test_cascade_order_follows_large_model_in_top_slice(tiers):
+    small, large = tiers
+    pairs = [("q", p) for p in "abcde"]
+    out = svc.ce_cascade(pairs)
+    assert large.seen == [["a", "b", "c"]]   # top CASCADE_TOP by the small model
+    assert np.all((out >= 0) & (out <= 1))
+    top = {p: out[i] for i, (_q, p) in enumerate(pairs)}
+    # large model prefers b > c > a; on a common scale the 0.7 blend keeps its order
+    assert top["b"] > top["c"] > top["a"]
+    # unvetted items stay below the vetted slice even though the large model would love them
+    assert max(top["d"], top["e"]) < min(top["a"], top["b"], top["c"])
+    assert top["d"] > top["e"]
+
+
+def test_cascade_groups_are_independent(tiers):
+    pairs = [("q", p) for p in "abcde"] * 2
+    out = svc.ce_cascade(pairs, bounds=[(0, 5), (5, 10)])
+    assert np.allclose(out[:5], out[5:])
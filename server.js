@@ -819,6 +819,8 @@ async function updateUserExpertise() {
 
 // Trigger ML model retraining
 const ML_SERVICE_URL_INTERNAL = process.env.ML_SERVICE_URL || 'http://localhost:8089';
+const ML_TRAIN_POLL_INTERVAL_MS = 5000;
+const ML_TRAIN_POLL_TIMEOUT_MS = 15 * 60 * 1000;
 
 async function triggerMLRetraining(site = null) {
   try {
@@ -834,8 +836,28 @@ async function triggerMLRetraining(site = null) {
       throw new Error(`ML service returned ${response.status}`);
     }
 
-    const result = await response.json();
-    console.log(`[AI-AutoLearn] ✅ ML training complete: accuracy ${result.accuracy || 'N/A'}`);
+    // /train queues a background job (202): poll its status until it finishes
+    let job = await response.json();
+    const deadline = Date.now() + ML_TRAIN_POLL_TIMEOUT_MS;
+    while (job.status === 'queued' || job.status === 'running') {
+      if (Date.now() > deadline) {
+        console.warn(`[AI-AutoLearn] ⏳ ML training job ${job.job_id} still ${job.status}, not waiting further`);
+        return { success: false, pending: true, job_id: job.job_id, status: job.status };
+      }
+      await new Promise(resolve => setTimeout(resolve, ML_TRAIN_POLL_INTERVAL_MS));
+      const statusRes = await fetch(`${ML_SERVICE_URL_INTERNAL}/train/${job.job_id}`);
+      if (!statusRes.ok) {
+        throw new Error(`ML service returned ${statusRes.status} for job ${job.job_id}`);
+      }
+      job = await statusRes.json();
+    }
+
+    const result = { job_id: job.job_id, status: job.status, ...(job.result || {}) };
+    if (job.status === 'succeeded') {
+      console.log(`[AI-AutoLearn] ✅ ML training complete: accuracy ${result.accuracy ?? 'N/A'} (model ${result.model_version || 'N/A'})`);
+    } else {
+      console.error(`[AI-AutoLearn] ML training job ${job.job_id} failed: ${result.error || result.message || 'unknown error'}`);
+    }
     return result;
   } catch (e) {
     console.error('[AI-AutoLearn] ML training error:', e.message);